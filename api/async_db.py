@@ -0,0 +1,123 @@
+"""异步数据库访问：在专用线程池中执行同步 sqlite3 调用，避免阻塞事件循环"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "4"))  # 不宜超过 DB_POOL_SIZE
+DB_MAX_PENDING = int(os.getenv("DB_MAX_PENDING", "64"))           # 排队 + 执行中的任务上限
+
+
+class DatabaseOverloaded(Exception):
+    """排队任务已满，调用方应快速失败（返回 503）而不是无限堆积"""
+
+
+class AsyncDB:
+    """专用数据库线程池
+
+    - 所有任务在固定数量的线程中执行，事件循环只 await 结果
+    - 排队 + 执行中的任务数超过 max_pending 时立即拒绝
+    - 按任务名统计调用次数、排队耗时和执行耗时
+    """
+
+    def __init__(
+        self,
+        workers: int = DB_EXECUTOR_WORKERS,
+        max_pending: int = DB_MAX_PENDING,
+        thread_name_prefix: str = "agentstore-db",
+    ):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.thread_name_prefix = thread_name_prefix
+        self._executor: ThreadPoolExecutor | None = None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._rejected = 0
+        self._queries: dict[str, dict] = {}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers, thread_name_prefix=self.thread_name_prefix
+                    )
+        return self._executor
+
+    async def run(self, fn, *args, name: str | None = None):
+        """在数据库线程中执行 fn(*args) 并等待结果"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise DatabaseOverloaded(f"数据库任务排队已满（{self.max_pending}）")
+        label = name or getattr(fn, "__name__", "query")
+        submitted = time.perf_counter()
+        with self._lock:
+            self._pending += 1
+
+        def job():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                finished = time.perf_counter()
+                self._record(label, started - submitted, finished - started)
+                with self._lock:
+                    self._pending -= 1
+                self._slots.release()
+
+        try:
+            future = self._get_executor().submit(job)
+        except RuntimeError:
+            # 线程池已关闭，任务不会执行，归还名额
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+            raise
+        return await asyncio.wrap_future(future)
+
+    def _record(self, label: str, wait_s: float, run_s: float):
+        with self._lock:
+            q = self._queries.setdefault(
+                label, {"count": 0, "wait_ms": 0.0, "total_ms": 0.0, "max_ms": 0.0}
+            )
+            q["count"] += 1
+            q["wait_ms"] += wait_s * 1000
+            q["total_ms"] += run_s * 1000
+            q["max_ms"] = max(q["max_ms"], run_s * 1000)
+
+    def stats(self) -> dict:
+        with self._lock:
+            queries = {
+                label: {
+                    "count": q["count"],
+                    "avg_wait_ms": round(q["wait_ms"] / q["count"], 3),
+                    "avg_ms": round(q["total_ms"] / q["count"], 3),
+                    "max_ms": round(q["max_ms"], 3),
+                }
+                for label, q in self._queries.items()
+            }
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "rejected": self._rejected,
+                "queries": queries,
+            }
+
+    def shutdown(self):
+        """等待已提交的任务完成后关闭线程池（之后再调用 run 会重建）"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+db_executor = AsyncDB()
+
+
+async def run_db(fn, *args, name: str | None = None):
+    """在共享的数据库线程池中执行同步数据库函数"""
+    return await db_executor.run(fn, *args, name=name)
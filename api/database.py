@@ -1,25 +1,250 @@
 """SQLite 数据库层"""
+import atexit
+import base64
+import functools
+import hashlib
 import json
+import logging
 import os
+import queue
 import re
 import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
 from pathlib import Path
 
+from pydantic import ValidationError
+
+from .cache import LRUCache
+from .schemas import CapabilityItem
+
 
 def _get_db_path() -> str:
     return os.getenv("DATABASE_PATH", str(Path(__file__).parent.parent / "data" / "agentstore.db"))
 
 
-def _get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(_get_db_path())
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")  # 并发读写不阻塞
-    conn.execute("PRAGMA busy_timeout=5000")  # 锁等待 5 秒
-    return conn
+# ── 连接池 ──────────────────────────────────────────────
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))             # 每个数据库文件最多保持的连接数
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))    # 连接耗尽时的最长等待秒数
+_HEALTH_CHECK_IDLE_SECONDS = 30                              # 空闲超过该时长的连接借出前先探活
+_STATEMENT_CACHE_SIZE = 256                                  # 每个连接缓存的预编译语句数
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """连接池耗尽且等待超时，API 层映射为 503"""
+
+
+class _PooledConnection:
+    """连接池借出的连接代理：close() 归还连接而不是真正关闭，其余属性透传给 sqlite3.Connection
+
+    推荐 `with _get_conn() as conn:` 使用，退出时归还（未提交的事务由归还时回滚）。
+    注意与 sqlite3.Connection 自带的上下文管理不同：不会自动 commit。
+    忘记归还的代理被回收时由 __del__ 兜底归还，避免永久占用池位。
+    """
+
+    __slots__ = ("_conn", "_pool")
+
+    def __init__(self, conn: sqlite3.Connection, pool: "ConnectionPool"):
+        self._conn = conn
+        self._pool = pool
+
+    def __getattr__(self, name):
+        conn = self._conn
+        if conn is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return getattr(conn, name)
+
+    def __enter__(self) -> "_PooledConnection":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass  # 解释器退出阶段池可能已不可用
+
+    def close(self):
+        """归还连接，重复调用安全"""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+
+class ConnectionPool:
+    """有界 SQLite 连接池
+
+    - PRAGMA 只在建连时执行一次，连接带语句缓存
+    - 借出时对长时间空闲的连接做 SELECT 1 探活，失败则重建
+    - 归还时回滚未提交的事务，保证下一个使用者拿到干净连接
+    """
+
+    def __init__(self, db_path: str, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._idle: queue.LifoQueue = queue.LifoQueue()  # (conn, 归还时间)，LIFO 让热连接优先复用
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_ms": 0.0,
+            "timeouts": 0,
+            "connects": 0,
+            "health_check_failures": 0,
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,  # 连接会在线程池的不同线程间复用
+            cached_statements=_STATEMENT_CACHE_SIZE,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")  # 并发读写不阻塞
+        conn.execute("PRAGMA busy_timeout=5000")  # 锁等待 5 秒
+        with self._lock:
+            self._stats["connects"] += 1
+        return conn
+
+    def _discard(self, conn: sqlite3.Connection):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._opened -= 1
+
+    def acquire(self) -> _PooledConnection:
+        """借出一个连接；池满时最多等待 timeout 秒"""
+        start = time.perf_counter()
+        waited = False
+        try:
+            conn, released_at = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    conn, released_at = self._connect(), None
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                waited = True
+                try:
+                    conn, released_at = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"数据库连接池耗尽（等待 {self.timeout}s）")
+
+        if released_at is not None and time.monotonic() - released_at > _HEALTH_CHECK_IDLE_SECONDS:
+            try:
+                conn.execute("SELECT 1").fetchone()
+            except sqlite3.Error:
+                with self._lock:
+                    self._stats["health_check_failures"] += 1
+                self._discard(conn)
+                with self._lock:
+                    self._opened += 1
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+
+        with self._lock:
+            self._stats["checkouts"] += 1
+            if waited:
+                self._stats["waits"] += 1
+                self._stats["wait_time_ms"] += (time.perf_counter() - start) * 1000
+        return _PooledConnection(conn, self)
+
+    def release(self, conn: sqlite3.Connection):
+        """归还连接：回滚残留事务；池已关闭或连接异常则直接关闭"""
+        if self._closed:
+            self._discard(conn)
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    def close(self):
+        """关闭所有空闲连接，借出中的连接在归还时关闭"""
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            opened = self._opened
+        stats["wait_time_ms"] = round(stats["wait_time_ms"], 2)
+        idle = self._idle.qsize()
+        stats.update({"size": opened, "max_size": self.size, "idle": idle, "in_use": opened - idle})
+        return stats
+
+
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(db_path: str | None = None) -> ConnectionPool:
+    """按数据库路径获取连接池（默认取 DATABASE_PATH，变化时自动使用新池）"""
+    db_path = db_path or _get_db_path()
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_path)
+            if pool is None:
+                pool = _pools[db_path] = ConnectionPool(db_path)
+    return pool
+
+
+def _get_conn() -> _PooledConnection:
+    """从连接池借出连接；用 `with _get_conn() as conn:` 自动归还"""
+    return _get_pool().acquire()
+
+
+def get_pool_stats() -> dict:
+    """连接池统计：借出次数、等待耗时、连接数等"""
+    return _get_pool().stats()
+
+
+def close_pools():
+    """关闭所有连接池（进程退出时调用）"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
 
 
 def init_db():
-    conn = _get_conn()
+    with _get_conn() as conn:
+        _create_schema(conn)
+        conn.commit()
+
+
+def _create_schema(conn: sqlite3.Connection):
     conn.execute("""
         CREATE TABLE IF NOT EXISTS capabilities (
             slug TEXT PRIMARY KEY,
@@ -143,20 +368,210 @@ def init_db():
             UNIQUE(user_id, comment_id)
         )
     """)
-    # 索引
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_logs_key_date ON usage_logs(api_key_id, created_at)")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_api_keys_hash ON api_keys(key_hash)")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_comment_likes_comment ON comment_likes(comment_id)")
-
+    # 数据代际计数器：写入方递增，读缓存以此判断是否失效（存库里，多 worker 可见）
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS generations (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    # 目录统计物化表：写入 capabilities 时在同一事务内重算，读接口只查单行
+    # category='*' 为全平台汇总行，category_counts 仅在汇总行上填写
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_stats (
+            category TEXT PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0,
+            avg_score REAL NOT NULL DEFAULT 0,
+            score_histogram TEXT NOT NULL DEFAULT '{}',
+            top_slug TEXT,
+            category_counts TEXT NOT NULL DEFAULT '{}'
+        )
+    """)
     # 安全添加新列（SQLite 不支持 IF NOT EXISTS 语法）
     _safe_add_columns(conn, "capabilities", [
         ("dependencies", "TEXT DEFAULT '[]'"),
         ("latest_version", "TEXT DEFAULT ''"),
         ("supported_clients", "TEXT DEFAULT '[]'"),
+        ("payload_json", "TEXT"),  # 入库时预编码的 API 响应 JSON
+        ("payload_version", "TEXT"),  # 编码 payload_json 时的 CapabilityItem 结构指纹
     ])
 
-    conn.commit()
-    conn.close()
+    _create_fts(conn)
+    _apply_migrations(conn)
+    # CapabilityItem 字段或类型变化后，按新结构重算旧的预编码 JSON
+    if _refresh_payloads(conn):
+        _bump_generation(conn, DATASET_GENERATION)
+
+    # 老库首次升级时补算目录统计
+    if not conn.execute("SELECT 1 FROM catalog_stats WHERE category = ?", (_ALL_CATEGORIES,)).fetchone():
+        _refresh_catalog_stats(conn)
+
+
+# ── 全文索引 ──────────────────────────────────────────
+# FTS5 外部内容表，列顺序即 bm25() 权重参数顺序
+FTS_COLUMNS = ("name", "provider", "description", "one_liner", "ai_summary")
+# 各字段 bm25 权重：名称命中远比长摘要里的命中重要
+FTS_FIELD_WEIGHTS = {
+    "name": 10.0,
+    "provider": 5.0,
+    "one_liner": 4.0,
+    "description": 2.0,
+    "ai_summary": 1.0,
+}
+# trigram 分词器最短只能匹配 3 个字符，更短的关键词回退到 LIKE
+_FTS_MIN_QUERY_LENGTH = 3
+
+
+def _create_fts(conn: sqlite3.Connection):
+    """创建 capabilities_fts 全文索引及同步触发器；首次创建时从现有数据重建索引
+
+    使用 trigram 分词器：保持与原 LIKE '%q%' 一致的子串匹配语义，中文也无需分词。
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'capabilities_fts'"
+    ).fetchone()
+    cols = ", ".join(FTS_COLUMNS)
+    new_cols = ", ".join(f"new.{c}" for c in FTS_COLUMNS)
+    old_cols = ", ".join(f"old.{c}" for c in FTS_COLUMNS)
+    conn.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS capabilities_fts USING fts5(
+            {cols},
+            content='capabilities', content_rowid='rowid', tokenize='trigram'
+        )
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS capabilities_fts_ai AFTER INSERT ON capabilities BEGIN
+            INSERT INTO capabilities_fts(rowid, {cols}) VALUES (new.rowid, {new_cols});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS capabilities_fts_ad AFTER DELETE ON capabilities BEGIN
+            INSERT INTO capabilities_fts(capabilities_fts, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS capabilities_fts_au AFTER UPDATE OF {cols} ON capabilities BEGIN
+            INSERT INTO capabilities_fts(capabilities_fts, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols});
+            INSERT INTO capabilities_fts(rowid, {cols}) VALUES (new.rowid, {new_cols});
+        END
+    """)
+    if not exists:
+        conn.execute("INSERT INTO capabilities_fts(capabilities_fts) VALUES ('rebuild')")
+
+
+def _fts_match_query(q: str) -> str:
+    """把用户关键词转成 FTS5 短语查询（整体作为子串匹配，转义双引号）"""
+    return '"' + q.replace('"', '""') + '"'
+
+
+def _bm25_expr(field_weights: dict[str, float] | None = None) -> str:
+    weights = {**FTS_FIELD_WEIGHTS, **(field_weights or {})}
+    args = ", ".join(repr(float(weights[c])) for c in FTS_COLUMNS)
+    return f"bm25(capabilities_fts, {args})"
+
+
+# ── 迁移 ──────────────────────────────────────────────
+# 按版本号顺序执行，已执行到的版本记录在 PRAGMA user_version 中；只追加，不修改已发布的版本
+# 迁移步骤可以是 SQL 字符串，也可以是接收 conn 的函数（用于需要 Python 计算的回填）
+_MIGRATIONS: list[tuple[int, list]] = [
+    # 1: 基础索引 + 游标分页索引（每个排序字段都带 slug 作为次序键）
+    (1, [
+        "CREATE INDEX IF NOT EXISTS idx_usage_logs_key_date ON usage_logs(api_key_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_api_keys_hash ON api_keys(key_hash)",
+        "CREATE INDEX IF NOT EXISTS idx_comment_likes_comment ON comment_likes(comment_id)",
+        *(
+            f"CREATE INDEX IF NOT EXISTS idx_capabilities_{col}_slug ON capabilities({col}, slug)"
+            for col in ("overall_score", "stars", "last_updated", "name", "created_at")
+        ),
+        # NULL 无法参与行值比较，统一存为空串
+        "UPDATE capabilities SET last_updated = '' WHERE last_updated IS NULL",
+    ]),
+    # 2: 按 EXPLAIN QUERY PLAN 补齐热点查询的复合索引，消除全表扫描和临时排序
+    (2, [
+        # 分类筛选 + 各字段排序
+        *(
+            f"CREATE INDEX IF NOT EXISTS idx_capabilities_category_{col}_slug ON capabilities(category, {col}, slug)"
+            for col in ("overall_score", "stars", "last_updated", "name", "created_at")
+        ),
+        # 评论：按能力列出、按用户列出、每分钟限频
+        "CREATE INDEX IF NOT EXISTS idx_comments_slug_created ON comments(capability_slug, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_comments_user_created ON comments(user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_comments_user_slug_created ON comments(user_id, capability_slug, created_at)",
+        # 收藏：按用户列出
+        "CREATE INDEX IF NOT EXISTS idx_favorites_user_created ON favorites(user_id, created_at)",
+        # 提交：按状态列出、全部列出、每分钟限频
+        "CREATE INDEX IF NOT EXISTS idx_submissions_status_created ON submissions(status, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_submissions_created ON submissions(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_submissions_user_created ON submissions(user_id, created_at)",
+        # API Key：按用户列出
+        "CREATE INDEX IF NOT EXISTS idx_api_keys_user_created ON api_keys(user_id, created_at)",
+    ]),
+    # 3: 每日调用计数器，限流与用量统计 O(1)；从历史日志回填
+    (3, [
+        """CREATE TABLE IF NOT EXISTS usage_daily_counters (
+            api_key_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (api_key_id, day)
+        ) WITHOUT ROWID""",
+        """INSERT OR IGNORE INTO usage_daily_counters (api_key_id, day, count)
+           SELECT api_key_id, date(created_at), COUNT(*) FROM usage_logs
+           WHERE api_key_id IS NOT NULL GROUP BY api_key_id, date(created_at)""",
+    ]),
+    # 4: 为已有数据补算预编码的响应 JSON（之后由 insert_capabilities 维护）
+    (4, [
+        lambda conn: _refresh_payloads(conn),
+    ]),
+    # 5: 增量导出按 updated_at 过滤并排序
+    (5, [
+        "CREATE INDEX IF NOT EXISTS idx_capabilities_updated_at_slug ON capabilities(updated_at, slug)",
+    ]),
+    # 6: 其余排序字段同样回填 NULL，否则游标的行值比较会漏掉这些行（入库时已统一写默认值）
+    (6, [
+        "UPDATE capabilities SET stars = 0 WHERE stars IS NULL",
+        "UPDATE capabilities SET overall_score = 0 WHERE overall_score IS NULL",
+        "UPDATE capabilities SET created_at = '' WHERE created_at IS NULL",
+    ]),
+    # 7: 时间字段改为在排序表达式里 COALESCE（配表达式索引），存储值恢复为 NULL，API 照旧返回 null
+    #    （迁移 1/6 为了游标比较写入的空串还原；payload_json 置空后由 init_db 重新编码）
+    (7, [
+        *(
+            stmt
+            for col in ("last_updated", "created_at")
+            for stmt in (
+                f"CREATE INDEX IF NOT EXISTS idx_capabilities_{col}_key_slug "
+                f"ON capabilities(COALESCE({col}, ''), slug)",
+                f"CREATE INDEX IF NOT EXISTS idx_capabilities_category_{col}_key_slug "
+                f"ON capabilities(category, COALESCE({col}, ''), slug)",
+                f"UPDATE capabilities SET {col} = NULL, payload_json = NULL WHERE {col} = ''",
+            )
+        ),
+    ]),
+    # 8: 搜索附加筛选（language / protocol / source）按默认排序走索引；分面统计走覆盖索引，不回表
+    (8, [
+        *(
+            f"CREATE INDEX IF NOT EXISTS idx_capabilities_{col}_overall_score_slug "
+            f"ON capabilities({col}, overall_score, slug)"
+            for col in ("language", "protocol", "source")
+        ),
+        "CREATE INDEX IF NOT EXISTS idx_capabilities_facets "
+        "ON capabilities(category, language, protocol, source, has_tests)",
+    ]),
+]
+
+
+def _apply_migrations(conn: sqlite3.Connection):
+    """执行尚未应用的迁移"""
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, statements in _MIGRATIONS:
+        if version <= current:
+            continue
+        for step in statements:
+            if callable(step):
+                step(conn)
+            else:
+                conn.execute(step)
+        conn.execute(f"PRAGMA user_version = {int(version)}")
 
 
 _VALID_IDENTIFIER = re.compile(r"^[a-zA-Z_][a-zA-Z0-9_]*$")
@@ -178,6 +593,56 @@ def _safe_add_columns(conn: sqlite3.Connection, table: str, columns: list[tuple[
             pass  # 列已存在，跳过
 
 
+# ── 数据代际 ──────────────────────────────────────────
+DATASET_GENERATION = "dataset"  # capabilities 表每次写入递增
+API_KEYS_GENERATION = "api_keys"  # 吊销 API Key 时递增，使各进程的 Key 缓存失效
+
+
+def _read_generation(conn: sqlite3.Connection, name: str) -> int:
+    row = conn.execute("SELECT value FROM generations WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def _bump_generation(conn: sqlite3.Connection, name: str):
+    """在调用方的事务内递增代际计数器，随事务一起提交"""
+    conn.execute(
+        "INSERT INTO generations (name, value) VALUES (?, 1) "
+        "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+        (name,),
+    )
+
+
+# 其他进程写入后，本进程最迟在该间隔后感知到新代际
+GENERATION_CHECK_INTERVAL = float(os.getenv("CACHE_VERSION_CHECK_INTERVAL", "1.0"))
+_generations: dict[tuple[str, str], tuple[int, float]] = {}  # (db_path, name) -> (值, 读取时间)
+
+
+def get_generation(name: str, conn: sqlite3.Connection | None = None) -> int:
+    """读取代际计数器；进程内缓存，最多每 GENERATION_CHECK_INTERVAL 秒回库确认一次"""
+    key = (_get_db_path(), name)
+    now = time.monotonic()
+    cached = _generations.get(key)
+    if cached is not None and now - cached[1] < GENERATION_CHECK_INTERVAL:
+        return cached[0]
+    if conn is None:
+        with _get_conn() as own:
+            value = _read_generation(own, name)
+    else:
+        value = _read_generation(conn, name)
+    _generations[key] = (value, now)
+    return value
+
+
+def _forget_generation(name: str):
+    """本进程刚写入时调用，下次读取立即回库拿到新值"""
+    _generations.pop((_get_db_path(), name), None)
+
+
+def get_dataset_version() -> int:
+    """当前 capabilities 数据版本号"""
+    return get_generation(DATASET_GENERATION)
+
+
 # ── Tier 定义 ──────────────────────────────────────────
 TIER_LIMITS = {
     "free": 100,       # 100 次/天
@@ -186,56 +651,186 @@ TIER_LIMITS = {
 }
 
 
+# ── 用量日志批量写入 ──────────────────────────────────────
+USAGE_FLUSH_INTERVAL_MS = int(os.getenv("USAGE_FLUSH_INTERVAL_MS", "500"))  # 最长攒批时间
+USAGE_FLUSH_BATCH_SIZE = int(os.getenv("USAGE_FLUSH_BATCH_SIZE", "500"))    # 攒够即写
+USAGE_QUEUE_MAX = int(os.getenv("USAGE_QUEUE_MAX", "20000"))                # 队列满时丢弃并计数
+
+logger = logging.getLogger("agentstore.usage")
+
+
+class UsageLogWriter:
+    """进程内用量日志缓冲：请求路径只入队，后台线程每 N 毫秒或 M 条批量写库
+
+    - 一个事务内 executemany 插入 usage_logs
+    - 同一批内每个 key 的 last_used_at 只更新一次（取最新时间）
+    - shutdown() 停止后台线程并写完队列中剩余的日志
+    """
+
+    def __init__(
+        self,
+        interval_ms: int = USAGE_FLUSH_INTERVAL_MS,
+        batch_size: int = USAGE_FLUSH_BATCH_SIZE,
+        max_queue: int = USAGE_QUEUE_MAX,
+    ):
+        self.interval = max(interval_ms, 1) / 1000
+        self.batch_size = max(batch_size, 1)
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._write_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._stats = {"enqueued": 0, "dropped": 0, "written": 0, "batches": 0, "errors": 0}
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._state_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="agentstore-usage-writer", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, api_key_id, user_id, endpoint, method, status_code, response_time_ms):
+        """记录一次调用，不阻塞、不访问数据库"""
+        created_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")  # 与 CURRENT_TIMESTAMP 同格式
+        event = (_get_db_path(), (api_key_id, user_id, endpoint, method, status_code, response_time_ms, created_at))
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._state_lock:
+                self._stats["dropped"] += 1
+            return
+        with self._state_lock:
+            self._stats["enqueued"] += 1
+        self._ensure_started()
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+
+    def _collect(self) -> list:
+        """阻塞等到第一条日志，然后在 interval 内最多攒 batch_size 条；遇到停止标记立即返回"""
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            timeout = self.interval if deadline is None else deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                event = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if event is None:  # shutdown() 放入的唤醒标记
+                break
+            batch.append(event)
+            if deadline is None:
+                deadline = time.monotonic() + self.interval
+        return batch
+
+    def _drain(self) -> list:
+        batch = []
+        while True:
+            try:
+                event = self._queue.get_nowait()
+            except queue.Empty:
+                return batch
+            if event is not None:
+                batch.append(event)
+
+    def _write(self, batch: list):
+        by_db: dict[str, list] = {}
+        for db_path, row in batch:
+            by_db.setdefault(db_path, []).append(row)
+        with self._write_lock:
+            for db_path, rows in by_db.items():
+                last_used: dict[int, str] = {}
+                for row in rows:
+                    if row[0]:
+                        last_used[row[0]] = max(last_used.get(row[0], ""), row[6])
+                try:
+                    conn = _get_pool(db_path).acquire()
+                    try:
+                        conn.executemany(
+                            "INSERT INTO usage_logs (api_key_id, user_id, endpoint, method, status_code, response_time_ms, created_at) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            rows,
+                        )
+                        conn.executemany(
+                            "UPDATE api_keys SET last_used_at = ? WHERE id = ? AND (last_used_at IS NULL OR last_used_at < ?)",
+                            [(ts, key_id, ts) for key_id, ts in last_used.items()],
+                        )
+                        conn.commit()
+                    finally:
+                        conn.close()
+                except Exception:
+                    logger.exception("批量写入使用日志失败，丢弃 %d 条", len(rows))
+                    with self._state_lock:
+                        self._stats["errors"] += 1
+                    continue
+                with self._state_lock:
+                    self._stats["written"] += len(rows)
+                    self._stats["batches"] += 1
+
+    def flush(self):
+        """立即把队列中的日志写入数据库（在调用方线程中执行）"""
+        batch = self._drain()
+        if batch:
+            self._write(batch)
+
+    def shutdown(self):
+        """停止后台线程并写完剩余日志"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            try:
+                self._queue.put_nowait(None)  # 唤醒阻塞在 get() 上的后台线程
+            except queue.Full:
+                pass
+            thread.join(timeout=5)
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._state_lock:
+            stats = dict(self._stats)
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+
+usage_writer = UsageLogWriter()
+atexit.register(usage_writer.shutdown)
+
+
 def log_usage(api_key_id: int | None, user_id: int | None, endpoint: str, method: str, status_code: int, response_time_ms: int):
-    """记录 API 调用日志"""
-    conn = _get_conn()
-    try:
-        conn.execute(
-            "INSERT INTO usage_logs (api_key_id, user_id, endpoint, method, status_code, response_time_ms) VALUES (?, ?, ?, ?, ?, ?)",
-            (api_key_id, user_id, endpoint, method, status_code, response_time_ms),
-        )
-        # 更新 key 的最后使用时间
-        if api_key_id:
-            conn.execute(
-                "UPDATE api_keys SET last_used_at = CURRENT_TIMESTAMP WHERE id = ?",
-                (api_key_id,),
-            )
-        conn.commit()
-    finally:
-        conn.close()
+    """记录 API 调用日志（入队后由 usage_writer 批量写库，不在请求路径上写数据库）"""
+    usage_writer.enqueue(api_key_id, user_id, endpoint, method, status_code, response_time_ms)
 
 
 def get_usage_stats(api_key_id: int) -> dict:
     """获取某个 API Key 的使用统计：今日调用、剩余次数、最近 7 天每天调用"""
-    conn = _get_conn()
-    try:
+    with _get_conn() as conn:
         # 获取 key 的 daily_limit
         key_row = conn.execute(
             "SELECT daily_limit FROM api_keys WHERE id = ?", (api_key_id,)
         ).fetchone()
         daily_limit = key_row["daily_limit"] if key_row else 100
 
-        # 今日调用次数
-        today_count = conn.execute(
-            "SELECT COUNT(*) FROM usage_logs WHERE api_key_id = ? AND date(created_at) = date('now')",
-            (api_key_id,),
-        ).fetchone()[0]
-
-        # 今日剩余次数（-1 表示无限制）
-        today_remaining = -1 if daily_limit == -1 else max(0, daily_limit - today_count)
-
-        # 最近 7 天每天的调用次数
+        # 最近 7 天每天的调用次数（直接读每日计数器，不再扫 usage_logs）
         daily_rows = conn.execute(
-            """SELECT date(created_at) as day, COUNT(*) as cnt
-               FROM usage_logs
-               WHERE api_key_id = ? AND created_at >= datetime('now', '-7 days')
-               GROUP BY date(created_at)
+            """SELECT day, count FROM usage_daily_counters
+               WHERE api_key_id = ? AND day >= date('now', '-7 days')
                ORDER BY day DESC""",
             (api_key_id,),
         ).fetchall()
-        daily = {r["day"]: r["cnt"] for r in daily_rows}
-    finally:
-        conn.close()
+        daily = {r["day"]: r["count"] for r in daily_rows}
+        today = conn.execute("SELECT date('now')").fetchone()[0]
+
+    # 今日调用次数与剩余次数（-1 表示无限制）
+    today_count = daily.get(today, 0)
+    today_remaining = -1 if daily_limit == -1 else max(0, daily_limit - today_count)
 
     return {
         "today_count": today_count,
@@ -248,42 +843,84 @@ def get_usage_stats(api_key_id: int) -> dict:
 
 def get_today_usage_count(api_key_id: int) -> int:
     """获取某个 key 今日调用次数"""
-    conn = _get_conn()
-    try:
-        count = conn.execute(
-            "SELECT COUNT(*) FROM usage_logs WHERE api_key_id = ? AND date(created_at) = date('now')",
+    with _get_conn() as conn:
+        row = conn.execute(
+            "SELECT count FROM usage_daily_counters WHERE api_key_id = ? AND day = date('now')",
             (api_key_id,),
-        ).fetchone()[0]
-    finally:
-        conn.close()
-    return count
+        ).fetchone()
+    return row[0] if row else 0
+
+
+def consume_daily_quota(api_key_id: int, daily_limit: int) -> int | None:
+    """为 key 的今日计数 +1 并校验额度，单条 UPSERT 原子完成，O(1)
+
+    返回计数后的今日调用次数；已达 daily_limit 时不计数并返回 None。daily_limit=-1 表示无限制。
+    """
+    if daily_limit == 0:
+        return None
+    with _get_conn() as conn:
+        row = conn.execute(
+            """INSERT INTO usage_daily_counters (api_key_id, day, count) VALUES (?, date('now'), 1)
+               ON CONFLICT(api_key_id, day) DO UPDATE SET count = count + 1
+               WHERE ? = -1 OR count < ?
+               RETURNING count""",
+            (api_key_id, daily_limit, daily_limit),
+        ).fetchone()
+        conn.commit()
+    return row[0] if row else None
+
+
+# 可排序字段（白名单防注入）
+_SORT_COLUMNS = ("overall_score", "stars", "last_updated", "name", "created_at")
+# 可为 NULL 的排序字段：NULL 不能参与游标的行值比较，排序时按空串处理（有对应的表达式索引）
+_NULLABLE_SORT_EXPRS = {
+    "last_updated": "COALESCE(c.last_updated, '')",
+    "created_at": "COALESCE(c.created_at, '')",
+}
+# 搜索总数计算方式
+_TOTAL_MODES = ("exact", "estimate", "none")
+# 搜索总数缓存：key 含数据版本号，数据写入后旧条目自然失效
+_count_cache = LRUCache(maxsize=2048)
+# 能力详情缓存：存解码后的 dict，key 含数据版本号
+CAPABILITY_CACHE_SIZE = int(os.getenv("CAPABILITY_CACHE_SIZE", "4096"))
+_capability_cache = LRUCache(maxsize=CAPABILITY_CACHE_SIZE)
+
+_CAPABILITY_COLUMNS = (
+    "slug", "name", "source", "source_id", "provider", "description", "category",
+    "repo_url", "endpoint", "protocol", "stars", "forks", "language", "last_updated",
+    "contributors", "has_tests", "has_typescript", "readme_length",
+    "reliability", "safety", "capability", "reputation", "usability", "overall_score",
+    "dependencies", "latest_version", "supported_clients",
+    "ai_summary", "one_liner", "install_guide", "usage_guide", "safety_notes",
+)
+
+# UPSERT 而非 INSERT OR REPLACE：保留 rowid 与 created_at，并让全文索引的 UPDATE 触发器生效
+# （REPLACE 删除旧行时默认不触发 DELETE 触发器，会在 FTS 中留下脏数据）
+_UPSERT_CAPABILITY_SQL = f"""
+    INSERT INTO capabilities ({", ".join(_CAPABILITY_COLUMNS)})
+    VALUES ({", ".join("?" for _ in _CAPABILITY_COLUMNS)})
+    ON CONFLICT(slug) DO UPDATE SET
+        {", ".join(f"{c} = excluded.{c}" for c in _CAPABILITY_COLUMNS if c != "slug")},
+        updated_at = CURRENT_TIMESTAMP
+"""
 
 
 def insert_capabilities(items: list[dict]):
-    conn = _get_conn()
-    try:
+    """批量 UPSERT；采集器给出的 None 数值/布尔字段按默认值入库，避免预编码和响应校验失败"""
+    with _get_conn() as conn:  # 出错时归还连接会回滚整批写入
         for item in items:
-            scores = item.get("scores", {})
-            conn.execute("""
-                INSERT OR REPLACE INTO capabilities
-                (slug, name, source, source_id, provider, description, category,
-                 repo_url, endpoint, protocol, stars, forks, language, last_updated,
-                 contributors, has_tests, has_typescript, readme_length,
-                 reliability, safety, capability, reputation, usability, overall_score,
-                 dependencies, latest_version, supported_clients,
-                 ai_summary, one_liner, install_guide, usage_guide, safety_notes)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
+            scores = item.get("scores") or {}
+            conn.execute(_UPSERT_CAPABILITY_SQL, (
                 item["slug"], item["name"], item["source"], item["source_id"],
                 item["provider"], item.get("description", ""), item.get("category", ""),
-                item.get("repo_url"), item.get("endpoint"), item.get("protocol", "rest"),
-                item.get("stars", 0), item.get("forks", 0), item.get("language"),
-                item.get("last_updated"), item.get("contributors", 0),
-                item.get("has_tests", False), item.get("has_typescript", False),
-                item.get("readme_length", 0),
-                scores.get("reliability", 0), scores.get("safety", 0),
-                scores.get("capability", 0), scores.get("reputation", 0),
-                scores.get("usability", 0), item.get("overall_score", 0),
+                item.get("repo_url"), item.get("endpoint"), item.get("protocol") or "rest",
+                item.get("stars") or 0, item.get("forks") or 0, item.get("language"),
+                item.get("last_updated") or None, item.get("contributors") or 0,
+                bool(item.get("has_tests")), bool(item.get("has_typescript")),
+                item.get("readme_length") or 0,
+                scores.get("reliability") or 0, scores.get("safety") or 0,
+                scores.get("capability") or 0, scores.get("reputation") or 0,
+                scores.get("usability") or 0, item.get("overall_score") or 0,
                 json.dumps(item.get("dependencies", []), ensure_ascii=False),
                 item.get("latest_version", ""),
                 json.dumps(item.get("supported_clients", []), ensure_ascii=False),
@@ -291,12 +928,157 @@ def insert_capabilities(items: list[dict]):
                 item.get("install_guide", ""), item.get("usage_guide", ""),
                 item.get("safety_notes", ""),
             ))
+        _refresh_payloads(conn, [item["slug"] for item in items])
+        _refresh_catalog_stats(conn)
+        _bump_generation(conn, DATASET_GENERATION)
         conn.commit()
-    except Exception:
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
+    _forget_generation(DATASET_GENERATION)
+    _capability_cache.clear()
+
+
+@functools.cache
+def payload_version() -> str:
+    """CapabilityItem 的 JSON Schema 指纹：模型字段或类型一变，已存的 payload_json 即视为过期
+
+    生成 JSON Schema 要几毫秒，放到首次写入/建表时再算，不拖慢 import。
+    """
+    return hashlib.sha256(
+        json.dumps(CapabilityItem.model_json_schema(), sort_keys=True).encode()
+    ).hexdigest()[:16]
+
+catalog_logger = logging.getLogger("agentstore.catalog")
+
+
+def _encode_payload(d: dict) -> str:
+    """按 CapabilityItem 的字段和类型编码为 JSON，与 response_model 序列化的结果一致"""
+    return CapabilityItem.model_validate(d).model_dump_json()
+
+
+def _try_encode_payload(row: sqlite3.Row) -> str | None:
+    """编码失败（如采集到 stars=NULL 的脏数据）时记日志并返回 None，读取时再按列现场组装"""
+    try:
+        return _encode_payload(_row_to_dict(row))
+    except ValidationError as e:
+        catalog_logger.warning("能力 %s 无法预编码，payload_json 留空: %s", row["slug"], e)
+        return None
+
+
+def _row_payload(row: sqlite3.Row) -> str | None:
+    """行的预编码 JSON；缺失时现场编码，数据无法通过校验时返回 None（调用方当作不存在处理）"""
+    return row["payload_json"] or _try_encode_payload(row)
+
+
+def _refresh_payloads(conn: sqlite3.Connection, slugs: list[str] | None = None) -> int:
+    """重算预编码 JSON，返回成功编码的行数；slugs 为 None 时处理所有缺失或 payload_version 过期的行
+
+    在 UPSERT 之后执行，这样 created_at / updated_at 等数据库生成的字段也在 JSON 里。
+    单行编码失败不影响整批写入。payload_json 不在全文索引列中，更新它不会触发 FTS 重建。
+    """
+    if slugs is None:
+        batches = [conn.execute(
+            "SELECT * FROM capabilities WHERE payload_json IS NULL OR payload_version IS NOT ?",
+            (payload_version(),),
+        ).fetchall()]
+    else:
+        batches = (
+            conn.execute(
+                f"SELECT * FROM capabilities WHERE slug IN ({', '.join('?' for _ in chunk)})", chunk
+            ).fetchall()
+            for chunk in (slugs[i:i + 500] for i in range(0, len(slugs), 500))
+        )
+    refreshed = 0
+    for rows in batches:
+        version = payload_version()
+        updates = [(_try_encode_payload(r), version, r["slug"]) for r in rows]
+        conn.executemany("UPDATE capabilities SET payload_json = ?, payload_version = ? WHERE slug = ?", updates)
+        refreshed += sum(1 for payload, _, _ in updates if payload is not None)
+    return refreshed
+
+
+# 搜索附加筛选：名称 -> (SQL 条件, 值转换)
+SEARCH_FILTERS = {
+    "language": ("c.language = ?", str),
+    "protocol": ("c.protocol = ?", str),
+    "source": ("c.source = ?", str),
+    "has_tests": ("c.has_tests = ?", lambda v: 1 if v else 0),
+    "min_score": ("c.overall_score >= ?", float),
+    "min_stars": ("c.stars >= ?", int),
+}
+# 分面统计的维度（都是低基数的离散字段）
+FACET_FIELDS = ("category", "language", "protocol", "source", "has_tests")
+_facet_cache = LRUCache(maxsize=1024)
+
+
+def _normalize_filters(filters: dict | None) -> dict:
+    """去掉未设置的筛选项并转换类型；未知筛选项抛 ValueError"""
+    result = {}
+    for name, value in (filters or {}).items():
+        if name not in SEARCH_FILTERS:
+            raise ValueError(f"未知的筛选条件: {name}")
+        if value is None or value == "":
+            continue
+        result[name] = SEARCH_FILTERS[name][1](value)
+    return result
+
+
+def _search_conditions(q: str, category: str, filters: dict) -> tuple[str, list[str], list]:
+    """搜索的 FROM 子句、WHERE 条件和参数（分页查询、计数和分面统计共用）"""
+    source = "capabilities c"
+    conditions = []
+    params: list = []
+    if len(q) >= _FTS_MIN_QUERY_LENGTH:
+        source += " JOIN capabilities_fts ON capabilities_fts.rowid = c.rowid"
+        conditions.append("capabilities_fts MATCH ?")
+        params.append(_fts_match_query(q))
+    elif q:
+        like_fields = " OR ".join(f"c.{col} LIKE ?" for col in FTS_COLUMNS)
+        conditions.append(f"({like_fields})")
+        params.extend([f"%{q}%"] * len(FTS_COLUMNS))
+    if category:
+        conditions.append("c.category = ?")
+        params.append(category)
+    for name, value in filters.items():
+        conditions.append(SEARCH_FILTERS[name][0])
+        params.append(value)
+    return source, conditions, params
+
+
+def get_facet_counts(q: str = "", category: str = "", filters: dict | None = None) -> dict[str, dict[str, int]]:
+    """统计筛选结果在各分面维度上的取值分布
+
+    只扫描一遍：按全部分面字段联合 GROUP BY 得到组合计数，再在内存中按维度汇总，
+    避免每个维度各跑一次 GROUP BY。结果按数据版本缓存。
+    """
+    q = q.strip()
+    filters = _normalize_filters(filters)
+    key = (_get_db_path(), get_dataset_version(), q, category, tuple(sorted(filters.items())))
+    cached = _facet_cache.get(key)
+    if cached is not None:
+        return {field: dict(counts) for field, counts in cached.items()}
+    source, conditions, params = _search_conditions(q, category, filters)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cols = ", ".join(f"c.{field}" for field in FACET_FIELDS)
+    with _get_conn() as conn:
+        rows = conn.execute(
+            f"SELECT {cols}, COUNT(*) FROM {source} {where} GROUP BY {cols}", params
+        ).fetchall()
+    facets: dict[str, dict[str, int]] = {field: {} for field in FACET_FIELDS}
+    for row in rows:
+        count = row[len(FACET_FIELDS)]
+        for i, field in enumerate(FACET_FIELDS):
+            value = row[i]
+            if field == "has_tests":
+                value = "true" if value else "false"
+            elif not value:
+                continue  # 空值不作为可筛选的取值
+            facets[field][value] = facets[field].get(value, 0) + count
+    # 每个维度按数量降序，数量相同按取值排序
+    facets = {
+        field: dict(sorted(counts.items(), key=lambda kv: (-kv[1], kv[0])))
+        for field, counts in facets.items()
+    }
+    _facet_cache.set(key, facets)
+    return {field: dict(counts) for field, counts in facets.items()}
 
 
 def search_capabilities(
@@ -307,95 +1089,426 @@ def search_capabilities(
     order: str = "desc",
     page: int = 1,
     per_page: int | None = None,
+    field_weights: dict[str, float] | None = None,
+    cursor: str | None = None,
+    total_mode: str = "exact",
+    encoded: bool = False,
+    filters: dict | None = None,
 ) -> dict:
-    """搜索能力，支持排序、分页、模糊搜索。
+    """搜索能力，支持排序、分页、全文检索。
+
+    关键词通过 FTS5 全文索引匹配名称/提供者/描述/一句话介绍/AI 摘要；
+    sort_by="relevance" 时按 bm25 相关度排序，field_weights 可覆盖各字段权重。
+    传入上一页返回的 cursor 时走 keyset 分页（忽略 page），深翻页代价与首页相同。
+
+    total_mode 控制总数计算：
+    - exact：精确总数，优先取按数据版本缓存的结果，否则在分页查询中用窗口函数一并算出
+    - estimate：有缓存用缓存，否则返回由当前页推出的下界，不额外计数
+    - none：不计算总数，total 为 None
 
-    返回 {"items": [...], "total": N}
+    filters 为附加筛选条件，可用的键见 SEARCH_FILTERS（值为 None 或空串表示不筛选）。
+
+    encoded=True 时 items 为入库时预编码好的 JSON 字符串，供接口直接拼接响应，跳过逐字段校验。
+
+    返回 {"items": [...], "total": N | None, "total_estimated": bool, "next_cursor": str | None}
     """
-    conn = _get_conn()
-    conditions = []
-    params: list = []
-    if q:
-        conditions.append("(name LIKE ? OR description LIKE ? OR provider LIKE ?)")
-        params.extend([f"%{q}%", f"%{q}%", f"%{q}%"])
-    if category:
-        conditions.append("category = ?")
-        params.append(category)
+    if total_mode not in _TOTAL_MODES:
+        raise ValueError(f"非法的 total 参数: {total_mode}")
+    q = q.strip()
+    filters = _normalize_filters(filters)
+    source, conditions, params = _search_conditions(q, category, filters)
+    use_fts = len(q) >= _FTS_MIN_QUERY_LENGTH
     where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
 
-    # 计算总数
-    total = conn.execute(
-        f"SELECT COUNT(*) FROM capabilities {where}", params
-    ).fetchone()[0]
-
     # 排序（白名单防注入）
-    allowed_sort = {"overall_score", "stars", "last_updated", "name", "created_at"}
-    if sort_by not in allowed_sort:
+    if sort_by not in _SORT_COLUMNS and sort_by != "relevance":
         sort_by = "overall_score"
     order_dir = "ASC" if order.lower() == "asc" else "DESC"
+    if sort_by == "relevance" and not use_fts:
+        # 没有全文关键词时相关度无意义，退回综合评分
+        sort_by, order_dir = "overall_score", "DESC"
+    if sort_by == "relevance":
+        # bm25 越小越相关，固定升序
+        sort_expr, order_dir = _bm25_expr(field_weights), "ASC"
+    else:
+        sort_expr = _NULLABLE_SORT_EXPRS.get(sort_by, f"c.{sort_by}")
 
-    # 分页
+    # 分页：优先使用游标（keyset），否则按页码 OFFSET
     if per_page is not None:
         actual_limit = per_page
         offset = (max(page, 1) - 1) * per_page
     else:
         actual_limit = limit
         offset = 0
+    page_conditions = list(conditions)
+    page_params = list(params)
+    if cursor:
+        last_key, last_slug = _decode_cursor(cursor, sort_by, order_dir)
+        op = ">" if order_dir == "ASC" else "<"
+        if sort_by in _NULLABLE_SORT_EXPRS:
+            # 表达式索引用不上行值比较的范围扫描，拆成等价的 <=/< 形式
+            page_conditions.append(f"{sort_expr} {op}= ? AND ({sort_expr} {op} ? OR c.slug {op} ?)")
+            page_params.extend([last_key, last_key, last_slug])
+        else:
+            page_conditions.append(f"({sort_expr}, c.slug) {op} (?, ?)")
+            page_params.extend([last_key, last_slug])
+        offset = 0
+    page_where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ""
 
-    rows = conn.execute(
-        f"SELECT * FROM capabilities {where} ORDER BY {sort_by} {order_dir} LIMIT ? OFFSET ?",
-        params + [actual_limit, offset]
-    ).fetchall()
-    conn.close()
-    return {"items": [_row_to_dict(r) for r in rows], "total": total}
+    count_key = (_get_db_path(), get_dataset_version(), q, category, tuple(sorted(filters.items())))
+    with _get_conn() as conn:
+        total = _count_cache.get(count_key) if total_mode != "none" else None
+        if total is None and total_mode != "none" and not q and not filters:
+            # 无关键词时总数直接取物化的目录统计，分页查询可沿索引提前结束
+            total = _catalog_total(conn, category)
+        # 精确模式且无缓存、非游标翻页时，在同一条语句里用窗口函数顺带算出总数
+        count_inline = total_mode == "exact" and total is None and not cursor
+        page_sql = f"SELECT c.*, {sort_expr} AS _sort_key FROM {source} {page_where}"
+        if count_inline:
+            # bm25() 不能与窗口函数出现在同一层查询，包一层子查询
+            page_sql = (
+                f"SELECT *, COUNT(*) OVER () AS _total FROM ({page_sql}) "
+                f"ORDER BY _sort_key {order_dir}, slug {order_dir}"
+            )
+        else:
+            page_sql += f" ORDER BY {sort_expr} {order_dir}, c.slug {order_dir}"
+        # 多取一行用于判断是否还有下一页；slug 作为次序键保证排序确定
+        rows = conn.execute(
+            f"{page_sql} LIMIT ? OFFSET ?",
+            page_params + [actual_limit + 1, offset]
+        ).fetchall()
+        if count_inline and rows:
+            total = rows[0]["_total"]
+        elif total_mode == "exact" and total is None:
+            # 游标翻页或页码越界时窗口函数拿不到总数，单独计数一次（结果会被缓存）
+            total = conn.execute(
+                f"SELECT COUNT(*) FROM {source} {where}", params
+            ).fetchone()[0]
 
+    has_more = len(rows) > actual_limit
+    rows = rows[:actual_limit]
+    total_estimated = False
+    if total_mode == "exact":
+        _count_cache.set(count_key, total)
+    elif total_mode == "estimate" and total is None:
+        if cursor:
+            total = None  # 游标翻页不知道已跳过多少行，无法给出下界
+        else:
+            total = offset + len(rows) + (1 if has_more else 0)
+            total_estimated = has_more
 
-def get_stats() -> dict:
-    """返回统计信息：总数、各分类数量、平均分、最高分能力。"""
-    conn = _get_conn()
-    total = conn.execute("SELECT COUNT(*) FROM capabilities").fetchone()[0]
+    next_cursor = None
+    if has_more:
+        next_cursor = _encode_cursor(sort_by, order_dir, rows[-1]["_sort_key"], rows[-1]["slug"])
+    items = []
+    for r in rows:
+        if encoded:
+            payload = _row_payload(r)
+            if payload is not None:  # 无法编码的脏数据跳过（已记日志），不让整页 500
+                items.append(payload)
+            continue
+        item = _row_to_dict(r)
+        item.pop("_sort_key", None)
+        item.pop("_total", None)
+        items.append(item)
+    return {"items": items, "total": total, "total_estimated": total_estimated, "next_cursor": next_cursor}
+
+
+def get_count_cache_stats() -> dict:
+    """搜索总数缓存的命中统计"""
+    return _count_cache.stats()
+
+
+def _encode_cursor(sort_by: str, order_dir: str, key, slug: str) -> str:
+    """游标 = base64url(JSON[排序字段, 方向, 最后一行排序值, 最后一行 slug])，对客户端不透明"""
+    raw = json.dumps([sort_by, order_dir, key, slug], ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).rstrip(b"=").decode()
+
+
+def _decode_cursor(cursor: str, sort_by: str, order_dir: str) -> tuple:
+    """解析游标，格式非法或与当前排序不一致时抛 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cur_sort, cur_dir, key, slug = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("非法的分页游标") from e
+    if (cur_sort, cur_dir) != (sort_by, order_dir):
+        raise ValueError("分页游标与当前排序方式不一致")
+    if not isinstance(slug, str) or not isinstance(key, (int, float, str)) or isinstance(key, bool):
+        raise ValueError("非法的分页游标")
+    return key, slug
+
+
+# ── 目录统计 ──────────────────────────────────────────
+_ALL_CATEGORIES = "*"  # catalog_stats 汇总行的 category 值
+_HISTOGRAM_BUCKETS = 10  # 评分直方图按整数分段：[0,1) ... [9,10]
+
+
+def _refresh_catalog_stats(conn: sqlite3.Connection):
+    """重算 catalog_stats（在调用方事务内执行）：各分类数量、平均分、评分直方图、最高分能力"""
+    histograms: dict[str, dict[str, int]] = {}
+    for r in conn.execute(
+        f"""SELECT category, MIN(CAST(IFNULL(overall_score, 0) AS INTEGER), {_HISTOGRAM_BUCKETS - 1}) AS bucket, COUNT(*) AS cnt
+            FROM capabilities GROUP BY category, bucket"""
+    ):
+        for cat in (r["category"] or "", _ALL_CATEGORIES):
+            hist = histograms.setdefault(cat, {str(b): 0 for b in range(_HISTOGRAM_BUCKETS)})
+            hist[str(max(r["bucket"], 0))] += r["cnt"]
 
-    # 各分类数量
-    cat_rows = conn.execute(
-        "SELECT category, COUNT(*) as cnt FROM capabilities WHERE category != '' GROUP BY category ORDER BY cnt DESC"
+    # SQLite 中与 MAX() 同层的裸列取自最大值所在行
+    per_category = conn.execute(
+        """SELECT category, COUNT(*) AS cnt, AVG(overall_score) AS avg_score,
+                  slug AS top_slug, MAX(overall_score) AS top_score
+           FROM capabilities GROUP BY category ORDER BY cnt DESC, category"""
     ).fetchall()
-    categories = {r["category"]: r["cnt"] for r in cat_rows}
+    overall = conn.execute(
+        "SELECT COUNT(*) AS cnt, AVG(overall_score) AS avg_score FROM capabilities"
+    ).fetchone()
+    top = conn.execute(
+        "SELECT slug FROM capabilities ORDER BY overall_score DESC, slug LIMIT 1"
+    ).fetchone()
 
-    # 平均分
-    avg_row = conn.execute("SELECT AVG(overall_score) as avg_score FROM capabilities").fetchone()
-    avg_score = round(avg_row["avg_score"] or 0, 2)
+    rows = []
+    for r in per_category:
+        if not r["category"]:
+            continue  # 未分类的能力只计入汇总行
+        rows.append((
+            r["category"], r["cnt"], round(r["avg_score"] or 0, 2),
+            json.dumps(histograms[r["category"]]), r["top_slug"], "{}",
+        ))
+    category_counts = {row[0]: row[1] for row in rows}
+    rows.append((
+        _ALL_CATEGORIES, overall["cnt"], round(overall["avg_score"] or 0, 2),
+        json.dumps(histograms.get(_ALL_CATEGORIES, {str(b): 0 for b in range(_HISTOGRAM_BUCKETS)})),
+        top["slug"] if top else None,
+        json.dumps(category_counts, ensure_ascii=False),
+    ))
+    conn.execute("DELETE FROM catalog_stats")
+    conn.executemany(
+        """INSERT INTO catalog_stats (category, total, avg_score, score_histogram, top_slug, category_counts)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        rows,
+    )
 
-    # 最高分能力
-    top_row = conn.execute(
-        "SELECT * FROM capabilities ORDER BY overall_score DESC LIMIT 1"
+
+def _catalog_total(conn: sqlite3.Connection, category: str = "") -> int:
+    row = conn.execute(
+        "SELECT total FROM catalog_stats WHERE category = ?", (category or _ALL_CATEGORIES,)
     ).fetchone()
-    top_capability = _row_to_dict(top_row) if top_row else None
+    return row[0] if row else 0
+
 
-    conn.close()
+def _get_catalog_summary() -> dict | None:
+    with _get_conn() as conn:
+        row = conn.execute(
+            "SELECT * FROM catalog_stats WHERE category = ?", (_ALL_CATEGORIES,)
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def get_stats() -> dict:
+    """返回统计信息：总数、各分类数量、平均分、评分分布、最高分能力（读 catalog_stats 汇总行）"""
+    summary = _get_catalog_summary()
+    if summary is None:
+        return {"total": 0, "categories": {}, "avg_score": 0, "score_histogram": {}, "top_capability": None}
+    top_slug = summary["top_slug"]
     return {
-        "total": total,
-        "categories": categories,
-        "avg_score": avg_score,
-        "top_capability": top_capability,
+        "total": summary["total"],
+        "categories": json.loads(summary["category_counts"]),
+        "avg_score": summary["avg_score"],
+        "score_histogram": json.loads(summary["score_histogram"]),
+        "top_capability": get_capability(top_slug) if top_slug else None,
     }
 
 
+def _load_capability(slug: str) -> tuple[dict, str] | None:
+    """读取 (解码后的 dict, 预编码 JSON)；结果按数据版本缓存，命中时不访问数据库"""
+    key = (_get_db_path(), get_dataset_version(), slug)
+    entry = _capability_cache.get(key)
+    if entry is None:
+        with _get_conn() as conn:
+            row = conn.execute("SELECT * FROM capabilities WHERE slug = ?", (slug,)).fetchone()
+        if not row:
+            return None
+        payload = _row_payload(row)
+        if payload is None:
+            return None
+        entry = (_row_to_dict(row), payload)
+        _capability_cache.set(key, entry)
+    return entry
+
+
 def get_capability(slug: str) -> dict | None:
-    conn = _get_conn()
-    row = conn.execute("SELECT * FROM capabilities WHERE slug = ?", (slug,)).fetchone()
-    conn.close()
-    return _row_to_dict(row) if row else None
+    """按 slug 获取能力详情"""
+    entry = _load_capability(slug)
+    return _copy_capability(entry[0]) if entry else None
+
+
+def get_capability_json(slug: str) -> str | None:
+    """按 slug 获取预编码的能力详情 JSON"""
+    entry = _load_capability(slug)
+    return entry[1] if entry else None
+
+
+def get_capabilities_json(slugs: list[str], invalid: list[str] | None = None) -> dict[str, str]:
+    """批量获取预编码的能力详情 JSON，返回 {slug: json}，不存在的 slug 不在结果中
+
+    先查详情缓存，未命中的 slug 用一条 WHERE slug IN (...) 查询补齐并写回缓存。
+    记录存在但无法通过校验的 slug 同样不在结果中，传入 invalid 时追加到其中。
+    """
+    path, version = _get_db_path(), get_dataset_version()
+    found: dict[str, str] = {}
+    missing = []
+    for slug in dict.fromkeys(slugs):
+        entry = _capability_cache.get((path, version, slug))
+        if entry is None:
+            missing.append(slug)
+        else:
+            found[slug] = entry[1]
+    if missing:
+        with _get_conn() as conn:
+            rows = conn.execute(
+                f"SELECT * FROM capabilities WHERE slug IN ({', '.join('?' for _ in missing)})", missing
+            ).fetchall()
+        for row in rows:
+            payload = _row_payload(row)
+            if payload is None:
+                if invalid is not None:
+                    invalid.append(row["slug"])
+                continue  # 脏数据按不存在处理，不影响同批其他 slug
+            _capability_cache.set((path, version, row["slug"]), (_row_to_dict(row), payload))
+            found[row["slug"]] = payload
+    return found
+
+
+def filter_slugs_by_category(slugs: list[str], category: str) -> set[str]:
+    """返回 slugs 中属于 category 的那些（一条 IN 查询）"""
+    slugs = list(dict.fromkeys(slugs))
+    if not slugs:
+        return set()
+    with _get_conn() as conn:
+        rows = conn.execute(
+            f"SELECT slug FROM capabilities WHERE category = ? AND slug IN ({', '.join('?' for _ in slugs)})",
+            [category, *slugs],
+        ).fetchall()
+    return {row[0] for row in rows}
+
+
+EXPORT_FETCH_SIZE = 500  # 导出时每次从游标取的行数
+
+
+def _parse_timestamp(value: str) -> str:
+    """把 ISO 8601 时间转成库里 CURRENT_TIMESTAMP 的格式（UTC，'YYYY-MM-DD HH:MM:SS'）"""
+    try:
+        dt = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"非法的时间格式: {value}（应为 ISO 8601，如 2026-02-18T12:00:00Z）")
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def iter_capabilities_json(category: str = "", updated_since: str | None = None):
+    """逐条产出预编码的能力 JSON，用于全量/增量导出
+
+    参数在调用时立即校验（非法时抛 ValueError），返回的生成器用独立的只读连接边读边产出，
+    内存占用与目录大小无关；单条 SELECT 读的是同一个快照，导出过程中的写入不会导致重复或遗漏。
+    指定 updated_since 时按 (updated_at, slug) 排序，便于客户端记录断点做增量同步。
+    """
+    conditions, params = [], []
+    if category:
+        conditions.append("category = ?")
+        params.append(category)
+    order = "slug"
+    if updated_since:
+        conditions.append("updated_at >= ?")
+        params.append(_parse_timestamp(updated_since))
+        order = "updated_at, slug"
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return _iter_payloads(f"SELECT rowid, payload_json FROM capabilities {where} ORDER BY {order}", params)
+
+
+def _iter_payloads(sql: str, params: list):
+    # 不占用连接池：慢速客户端可能让导出持续很久
+    conn = sqlite3.connect(
+        Path(_get_db_path()).resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False
+    )
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA busy_timeout=5000")
+        cursor = conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                if row["payload_json"] is not None:
+                    yield row["payload_json"]
+                    continue
+                full = conn.execute("SELECT * FROM capabilities WHERE rowid = ?", (row["rowid"],)).fetchone()
+                payload = _try_encode_payload(full)
+                if payload is not None:  # 脏数据跳过并记日志，不中断数据流
+                    yield payload
+    finally:
+        conn.close()
+
+
+def warm_page_cache(chunk_size: int = 1 << 20) -> int:
+    """顺序读一遍数据库文件（进 OS 页缓存），再扫一遍能力表和全文索引（进 SQLite 页缓存），返回读取字节数"""
+    path = Path(_get_db_path())
+    total = 0
+    if path.exists():
+        with open(path, "rb") as f:
+            while chunk := f.read(chunk_size):
+                total += len(chunk)
+    with _get_conn() as conn:
+        conn.execute("SELECT sum(length(payload_json)) FROM capabilities").fetchone()
+        conn.execute("SELECT count(*) FROM capabilities_fts_data").fetchone()
+    return total
+
+
+def warm_caches(limit: int = 1000) -> int:
+    """预先填充详情缓存（按综合评分取前 limit 条）、总数缓存和目录汇总，返回缓存的能力数"""
+    with _get_conn() as conn:
+        slugs = [row["slug"] for row in conn.execute(
+            "SELECT slug FROM capabilities ORDER BY overall_score DESC, slug LIMIT ?",
+            (min(limit, CAPABILITY_CACHE_SIZE),),
+        )]
+    warmed = 0
+    for i in range(0, len(slugs), 500):  # 控制 IN 参数个数
+        warmed += len(get_capabilities_json(slugs[i:i + 500]))
+    get_stats()
+    get_categories()
+    search_capabilities(encoded=True)
+    return warmed
+
+
+def get_capability_cache_stats() -> dict:
+    """能力详情缓存的命中/未命中/淘汰统计"""
+    return _capability_cache.stats()
+
+
+def _copy_capability(cap: dict) -> dict:
+    """复制缓存中的能力数据，避免调用方修改污染缓存（比 deepcopy 快得多）"""
+    d = dict(cap)
+    d["scores"] = dict(cap["scores"])
+    for key in ("dependencies", "supported_clients"):
+        d[key] = list(cap[key])
+    return d
 
 
 def get_categories() -> list[str]:
-    conn = _get_conn()
-    rows = conn.execute("SELECT DISTINCT category FROM capabilities ORDER BY category").fetchall()
-    conn.close()
-    return [r["category"] for r in rows if r["category"]]
+    """所有非空分类，按字母顺序（读 catalog_stats 汇总行）"""
+    summary = _get_catalog_summary()
+    if summary is None:
+        return []
+    return sorted(json.loads(summary["category_counts"]))
 
 
 def _row_to_dict(row: sqlite3.Row) -> dict:
     d = dict(row)
+    d.pop("payload_json", None)
+    d.pop("payload_version", None)
     d["scores"] = {
         "reliability": d.pop("reliability", 0),
         "safety": d.pop("safety", 0),
@@ -1,20 +1,57 @@
 """AgentStore REST API — Agent 能力注册表 + 信誉系统"""
+import asyncio
+import json
 import logging
+import os
 import math
+import sys
 import time
+import zlib
+from contextlib import contextmanager
 
 from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import hashlib
-from .database import search_capabilities, get_capability, get_categories, get_stats, init_db, log_usage, _get_conn, get_today_usage_count
-from .users import router as users_router
+from .database import (
+    search_capabilities,
+    get_capability,
+    get_capability_json,
+    get_capabilities_json,
+    filter_slugs_by_category,
+    iter_capabilities_json,
+    get_facet_counts,
+    get_categories,
+    get_stats,
+    init_db,
+    log_usage,
+    usage_writer,
+    _get_conn,
+    consume_daily_quota,
+    get_pool_stats,
+    close_pools,
+    get_count_cache_stats,
+    get_capability_cache_stats,
+    get_generation,
+    get_dataset_version,
+    _get_db_path,
+    API_KEYS_GENERATION,
+    PoolTimeout,
+)
+from .async_db import AsyncDB, DatabaseOverloaded, db_executor, run_db
+from .cache import LRUCache
+from .warmup import warmup
+from .users import AUTH_CACHE_SIZE, AUTH_CACHE_TTL, get_token_cache_stats, router as users_router
 from .schemas import (
     SearchResponse,
     CapabilityResponse,
+    BatchCapabilitiesRequest,
+    BatchCapabilitiesResponse,
     ScoresResponse,
     CategoriesResponse,
     RankingsResponse,
     SemanticSearchResponse,
+    HybridSearchResponse,
     StatsResponse,
     ErrorResponse,
 )
@@ -63,6 +100,7 @@ curl https://your-domain/api/v1/rankings?limit=10
         {"name": "排行榜", "description": "按各维度排行"},
         {"name": "统计", "description": "平台整体统计数据"},
         {"name": "语义搜索", "description": "基于 OpenAI Embedding 的语义理解搜索"},
+        {"name": "导出", "description": "以 NDJSON 流式导出全部能力数据"},
     ],
 )
 
@@ -86,61 +124,272 @@ logger = logging.getLogger("agentstore.usage")
 
 @app.get("/health")
 def health_check():
+    """启动预热完成前返回 503，负载均衡/平台健康检查据此等待实例就绪后再转发流量"""
+    if not warmup.ready:
+        return JSONResponse(status_code=503, content={"status": "warming_up", "warmup": warmup.stats()})
     return {"status": "ok"}
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """进程内运行指标（连接池等），供运维排查使用"""
+    return {
+        "db_pool": get_pool_stats(),
+        "search_count_cache": get_count_cache_stats(),
+        "capability_cache": get_capability_cache_stats(),
+        "db_executor": db_executor.stats(),
+        "vector_executor": vector_executor.stats(),
+        "usage_writer": usage_writer.stats(),
+        "api_key_cache": _api_key_cache.stats(),
+        "token_cache": get_token_cache_stats(),
+        "query_embedding_cache": _query_embedding_cache_stats(),
+        "response_cache": get_response_cache_stats(),
+        "warmup": warmup.stats(),
+    }
+
+
+def _query_embedding_cache_stats() -> dict | None:
+    """语义搜索模块按需加载（依赖 numpy/openai），未用过时不为了统计而导入"""
+    embeddings = sys.modules.get("scripts.embeddings")
+    return embeddings.get_query_cache_stats() if embeddings else None
+
+
+# 已解析的 API Key 记录；键里带上 api_keys 代际，吊销后旧条目自然失效
+_api_key_cache = LRUCache(AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+
 def _resolve_api_key(raw_key: str) -> dict | None:
-    """通过 SHA-256 hash 直接查询验证 API Key，O(1) 复杂度"""
+    """通过 SHA-256 hash 直接查询验证 API Key，O(1) 复杂度；有效记录缓存 AUTH_CACHE_TTL 秒"""
     if not raw_key or not raw_key.startswith("ask_"):
         return None
     key_hash = hashlib.sha256(raw_key.encode()).hexdigest()
-    conn = _get_conn()
-    try:
+    cache_key = (_get_db_path(), get_generation(API_KEYS_GENERATION), key_hash)
+    record = _api_key_cache.get(cache_key)
+    if record is not None:
+        return dict(record)
+    with _get_conn() as conn:
         row = conn.execute(
             "SELECT id, user_id, key_hash, daily_limit, is_active FROM api_keys WHERE key_hash = ? AND is_active = 1",
             (key_hash,),
         ).fetchone()
-        return dict(row) if row else None
-    finally:
-        conn.close()
+    if not row:
+        return None  # 无效 Key 不缓存，避免随机 Key 挤掉有效条目
+    record = dict(row)
+    _api_key_cache.set(cache_key, record)
+    return dict(record)
+
+
+_OVERLOADED_RESPONSE = '{"detail":"服务繁忙，请稍后重试"}'
+# 数据库线程池排队已满或连接池等待超时：都是暂时过载，返回 503 让客户端稍后重试
+_OVERLOAD_ERRORS = (DatabaseOverloaded, PoolTimeout)
+
+
+def _overloaded_response() -> Response:
+    return Response(content=_OVERLOADED_RESPONSE, status_code=503, media_type="application/json")
+
+
+@app.exception_handler(DatabaseOverloaded)
+@app.exception_handler(PoolTimeout)
+async def overloaded_handler(request: Request, exc: Exception):
+    return _overloaded_response()
+
+
+def _json_list_response(items: list[str], **fields) -> Response:
+    """把入库时预编码的能力 JSON 直接拼成 {"results": [...], **fields}
+
+    跳过 response_model 的逐字段校验和重新编码；路由上的 response_model 仍用于 OpenAPI 文档。
+    """
+    meta = json.dumps(fields, ensure_ascii=False, separators=(",", ":"))
+    body = '{"results":[' + ",".join(items) + "]," + meta[1:]
+    return Response(content=body, media_type="application/json")
+
+
+# 只依赖 capabilities 数据的只读端点：(路径前缀, Cache-Control)
+# 数据只在采集/auto_update 写入时变化，客户端和 CDN 过期后凭 ETag 重新验证
+_CACHEABLE_PATHS = (
+    ("/api/v1/search", "public, max-age=30, stale-while-revalidate=300"),
+    ("/api/v1/rankings", "public, max-age=30, stale-while-revalidate=300"),
+    ("/api/v1/capabilities/", "public, max-age=60, stale-while-revalidate=600"),
+    ("/api/v1/capabilities:batch", "public, max-age=60, stale-while-revalidate=600"),
+    ("/api/v1/categories", "public, max-age=300, stale-while-revalidate=3600"),
+    ("/api/v1/stats", "public, max-age=300, stale-while-revalidate=3600"),
+)
+
+
+def _cache_control_for(path: str) -> str | None:
+    for prefix, policy in _CACHEABLE_PATHS:
+        if path == prefix or (prefix.endswith("/") and path.startswith(prefix)):
+            return policy
+    return None
+
+
+def _make_etag(version: int, request: Request) -> str:
+    """强 ETag = 数据版本 + 路径 + 规范化（排序后）的查询参数"""
+    query = sorted(request.query_params.multi_items())
+    raw = json.dumps([version, request.url.path, query], ensure_ascii=False, separators=(",", ":"))
+    return '"' + hashlib.sha256(raw.encode()).hexdigest()[:32] + '"'
+
+
+_ENCODING_ETAG_SUFFIXES = ("-gzip",)
+
+
+def _encoded_etag(etag: str, encoding: str) -> str:
+    """不同 Content-Encoding 的字节不同，强 ETag 也要不同：<hash>-gzip"""
+    return etag if encoding == "identity" else etag[:-1] + f'-{encoding}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> str | None:
+    """If-None-Match 中任一编码变体的 ETag 命中时返回该 ETag（供 304 原样回送），否则返回 None"""
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return etag
+        tag = candidate.removeprefix("W/")
+        base = tag
+        for suffix in _ENCODING_ETAG_SUFFIXES:
+            if tag.endswith(suffix + '"'):
+                base = tag[: -len(suffix) - 1] + '"'
+                break
+        if base == etag:
+            return tag
+    return None
+
+
+def _accepted_encodings(request: Request) -> set[str]:
+    """解析 Accept-Encoding，返回客户端接受的编码（忽略 q=0）"""
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if coding and params.replace(" ", "") not in ("q=0", "q=0.0"):
+            accepted.add("gzip" if coding == "x-gzip" else coding)
+    return accepted
+
+
+# 热点只读端点的整响应缓存：键含数据版本，采集写入后自然失效；各编码变体只压缩一次
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_MAX_BYTES = int(float(os.getenv("RESPONSE_CACHE_MAX_MB", "32")) * 1024 * 1024)  # 所有变体的总字节上限
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRY_KB", "512")) * 1024  # 原文超过则不缓存
+RESPONSE_COMPRESS_MIN_BYTES = 1024  # 太小的响应压缩后反而更大
+_RESPONSE_CACHE_PATHS = ("/api/v1/search", "/api/v1/rankings", "/api/v1/categories", "/api/v1/stats")
+_response_cache = LRUCache(RESPONSE_CACHE_SIZE, maxbytes=RESPONSE_CACHE_MAX_BYTES, sizeof=lambda entry: len(entry[0]))
+
+
+def _response_encoding(request: Request) -> str:
+    return "gzip" if "gzip" in _accepted_encodings(request) else "identity"
+
+
+def _gzip(body: bytes) -> bytes:
+    return zlib.compress(body, 9, wbits=31)  # wbits=31 → gzip 格式
+
+
+async def _cached_response(request: Request, call_next, version: int, headers: dict) -> Response:
+    """只缓存首页（不带 cursor）：翻页请求分散，命中率低"""
+    query = tuple(sorted(request.query_params.multi_items()))
+    base_key = (_get_db_path(), version, request.url.path, query)
+    encoding = _response_encoding(request)
+
+    cached = _response_cache.get(base_key + (encoding,))
+    status = "hit"
+    if cached is None:
+        status = "miss"
+        identity = _response_cache.get(base_key + ("identity",))
+        if identity is None:
+            response = await call_next(request)
+            if response.status_code != 200:
+                return response
+            body = b"".join([chunk async for chunk in response.body_iterator])
+            identity = (body, response.media_type or response.headers.get("content-type"), "identity")
+            # 处理期间数据被更新时，响应体可能已是新版本，不能按旧版本缓存
+            if await run_db(get_dataset_version) != version:
+                return Response(content=body, media_type=identity[1], headers={"Vary": "Accept-Encoding"})
+            if len(body) > RESPONSE_CACHE_MAX_ENTRY_BYTES:
+                status = "skip"  # 大响应（如 limit 很大的搜索）不进缓存，免得挤掉大量热点条目
+            else:
+                _response_cache.set(base_key + ("identity",), identity)
+        cached = identity
+        if encoding != "identity":
+            if len(identity[0]) >= RESPONSE_COMPRESS_MIN_BYTES:
+                compressed = await asyncio.to_thread(_gzip, identity[0])
+                cached = (compressed, identity[1], encoding)
+            if status != "skip":
+                _response_cache.set(base_key + (encoding,), cached)
+
+    body, media_type, body_encoding = cached
+    response = Response(content=body, media_type=media_type, headers=headers)
+    response.headers["ETag"] = _encoded_etag(headers["ETag"], body_encoding)
+    response.headers["X-Response-Cache"] = status
+    if body_encoding != "identity":
+        response.headers["Content-Encoding"] = body_encoding
+    return response
+
+
+def get_response_cache_stats() -> dict:
+    return _response_cache.stats()
+
+
+@app.middleware("http")
+async def conditional_get_middleware(request: Request, call_next):
+    """为目录只读端点加 ETag / Cache-Control，If-None-Match 命中时直接返回 304，不查询也不序列化"""
+    cache_control = _cache_control_for(request.url.path) if request.method in ("GET", "HEAD") else None
+    if cache_control is None:
+        return await call_next(request)
+    try:
+        version = await run_db(get_dataset_version)
+    except _OVERLOAD_ERRORS:
+        return _overloaded_response()
+    etag = _make_etag(version, request)
+    # 响应可能按 Accept-Encoding 压缩，所有可缓存响应（含 304）都要带 Vary，避免共享缓存串用编码变体
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    matched = _etag_matches(request.headers.get("if-none-match", ""), etag)
+    if matched:
+        return Response(status_code=304, headers={**headers, "ETag": matched})
+    if (
+        request.method == "GET"
+        and request.url.path in _RESPONSE_CACHE_PATHS
+        and "cursor" not in request.query_params
+    ):
+        try:
+            return await _cached_response(request, call_next, version, headers)
+        except _OVERLOAD_ERRORS:
+            return _overloaded_response()
+
+    response = await call_next(request)
+    # 处理期间数据被更新时，响应体可能已是新版本，不能贴旧 ETag
+    if response.status_code == 200:
+        try:
+            if await run_db(get_dataset_version) == version:
+                response.headers.update(headers)
+        except _OVERLOAD_ERRORS:
+            pass  # 不带 ETag 也是正确响应
+    return response
 
 
 @app.middleware("http")
 async def usage_tracking_middleware(request: Request, call_next):
-    """记录 /api/v1/ 路径的 API 调用，支持 X-API-Key 认证和限流"""
+    """记录 /api/v1/ 路径的 API 调用，支持 X-API-Key 认证和限流
+
+    数据库操作都通过 run_db 放到专用线程执行，不阻塞事件循环。
+    """
     start = time.time()
 
     # 如果有 X-API-Key header，先检查限流
     api_key_header = request.headers.get("x-api-key", "")
     api_key_record = None
     if api_key_header and request.url.path.startswith("/api/v1/"):
-        api_key_record = _resolve_api_key(api_key_header)
-        if api_key_record:
-            daily_limit = api_key_record["daily_limit"]
-            if daily_limit != -1:  # -1 表示无限制
-                # 原子操作：在同一个事务中检查并插入，避免 TOCTOU 竞态
-                conn = _get_conn()
-                try:
-                    today_count = conn.execute(
-                        "SELECT COUNT(*) FROM usage_logs WHERE api_key_id = ? AND date(created_at) = date('now')",
-                        (api_key_record["id"],),
-                    ).fetchone()[0]
-                    if today_count >= daily_limit:
-                        conn.close()
-                        return Response(
-                            content='{"detail":"API 调用次数已达今日上限"}',
-                            status_code=429,
-                            media_type="application/json",
-                        )
-                    # 预插入占位日志（在同一事务中保证原子性）
-                    conn.execute(
-                        "INSERT INTO usage_logs (api_key_id, user_id, endpoint, method, status_code, response_time_ms) VALUES (?, ?, ?, ?, 0, 0)",
-                        (api_key_record["id"], api_key_record["user_id"], request.url.path, request.method),
+        try:
+            api_key_record = await run_db(_resolve_api_key, api_key_header)
+            if api_key_record:
+                # 单条 UPSERT 原子地计数并校验额度（daily_limit=-1 表示无限制）
+                used = await run_db(consume_daily_quota, api_key_record["id"], api_key_record["daily_limit"])
+                if used is None:
+                    return Response(
+                        content='{"detail":"API 调用次数已达今日上限"}',
+                        status_code=429,
+                        media_type="application/json",
                     )
-                    pre_log_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
-                    conn.commit()
-                finally:
-                    conn.close()
+        except _OVERLOAD_ERRORS:
+            return _overloaded_response()
 
     response = await call_next(request)
     duration_ms = int((time.time() - start) * 1000)
@@ -148,22 +397,11 @@ async def usage_tracking_middleware(request: Request, call_next):
     # 只记录 /api/v1/ 路径的请求
     if request.url.path.startswith("/api/v1/"):
         try:
-            if api_key_record and api_key_record.get("daily_limit", -1) != -1:
-                # 已经预插入了日志，更新实际状态码和耗时
-                conn = _get_conn()
-                try:
-                    conn.execute(
-                        "UPDATE usage_logs SET status_code = ?, response_time_ms = ? WHERE id = ?",
-                        (response.status_code, duration_ms, pre_log_id),
-                    )
-                    conn.commit()
-                finally:
-                    conn.close()
-            else:
-                api_key_id = api_key_record["id"] if api_key_record else None
-                user_id = api_key_record["user_id"] if api_key_record else None
-                if api_key_id:  # 只有有效 API Key 才记录日志
-                    log_usage(api_key_id, user_id, request.url.path, request.method, response.status_code, duration_ms)
+            if api_key_record:  # 只有有效 API Key 才记录日志（只入队，由后台线程批量写库）
+                log_usage(
+                    api_key_record["id"], api_key_record["user_id"],
+                    request.url.path, request.method, response.status_code, duration_ms,
+                )
         except Exception:
             logger.exception("记录使用日志失败")
 
@@ -173,6 +411,33 @@ async def usage_tracking_middleware(request: Request, call_next):
 @app.on_event("startup")
 def startup():
     init_db()
+    warmup.start()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    usage_writer.shutdown()
+    db_executor.shutdown()
+    vector_executor.shutdown()
+    close_pools()
+
+
+class _StageTimer:
+    """记录各阶段耗时，输出为 Server-Timing 响应头（浏览器开发者工具可直接查看）"""
+
+    def __init__(self):
+        self.stages: list[tuple[str, float]] = []
+
+    @contextmanager
+    def __call__(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, (time.perf_counter() - start) * 1000))
+
+    def header(self) -> str:
+        return ", ".join(f"{name};dur={ms:.1f}" for name, ms in self.stages)
 
 
 # ── 搜索 ─────────────────────────────────────────────────────
@@ -181,34 +446,57 @@ def startup():
     "/api/v1/search",
     response_model=SearchResponse,
     summary="搜索 Agent 能力",
-    description="根据关键词搜索能力，支持按分类筛选、多维度排序和分页。"
-    "关键词会匹配名称、描述和提供者字段。",
+    description="根据关键词搜索能力，支持按分类、语言、协议、来源、测试、评分和 Star 数筛选，多维度排序和分页。"
+    "关键词通过全文索引匹配名称、提供者、描述、一句话介绍和 AI 摘要，"
+    "sort=relevance 时按 BM25 相关度排序。",
     response_description="分页搜索结果，包含匹配项列表和分页信息",
     tags=["搜索"],
     responses={
         200: {"description": "搜索成功，返回匹配结果"},
+        400: {"description": "分页游标非法", "model": ErrorResponse},
     },
 )
 def api_search(
     q: str = Query(default="", description="搜索关键词，留空返回全部"),
     category: str = Query(default="", description="按分类筛选，如 'coding', 'data'"),
-    sort: str = Query(default="overall_score", description="排序字段：overall_score / stars / last_updated / name / created_at"),
-    order: str = Query(default="desc", description="排序方向：asc / desc"),
+    sort: str = Query(default="overall_score", description="排序字段：overall_score / stars / last_updated / name / created_at / relevance"),
+    order: str = Query(default="desc", description="排序方向：asc / desc（relevance 固定为最相关在前）"),
     page: int = Query(default=1, ge=1, description="页码，从 1 开始"),
     per_page: int = Query(default=20, ge=1, le=200, description="每页数量，1-200"),
+    cursor: str | None = Query(default=None, description="分页游标（上一页返回的 next_cursor），传入后忽略 page"),
+    total: str = Query(default="exact", pattern="^(exact|estimate|none)$", description="总数计算方式：exact 精确 / estimate 估算（可能是下界）/ none 不计算"),
+    language: str = Query(default="", description="按主要编程语言筛选，如 'Python'"),
+    protocol: str = Query(default="", description="按协议筛选：rest / mcp / grpc 等"),
+    source: str = Query(default="", description="按数据来源筛选，如 'github'"),
+    has_tests: bool | None = Query(default=None, description="是否包含测试"),
+    min_score: float | None = Query(default=None, ge=0, le=10, description="综合评分下限"),
+    min_stars: int | None = Query(default=None, ge=0, description="Star 数下限"),
+    facets: bool = Query(default=False, description="是否返回筛选结果在各维度上的分面计数"),
 ):
-    """搜索 Agent 能力，支持关键词匹配、分类筛选、排序和分页。"""
-    data = search_capabilities(
-        q=q, category=category, sort_by=sort, order=order, page=page, per_page=per_page
-    )
-    total_pages = math.ceil(data["total"] / per_page) if per_page > 0 else 1
-    return {
-        "results": data["items"],
-        "total": data["total"],
-        "page": page,
-        "per_page": per_page,
-        "total_pages": total_pages,
+    """搜索 Agent 能力，支持关键词匹配、多维筛选、排序和分页。"""
+    filters = {
+        "language": language, "protocol": protocol, "source": source,
+        "has_tests": has_tests, "min_score": min_score, "min_stars": min_stars,
     }
+    try:
+        data = search_capabilities(
+            q=q, category=category, sort_by=sort, order=order, page=page, per_page=per_page,
+            cursor=cursor, total_mode=total, encoded=True, filters=filters,
+        )
+        facet_counts = get_facet_counts(q=q, category=category, filters=filters) if facets else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    total_pages = math.ceil(data["total"] / per_page) if data["total"] is not None else None
+    return _json_list_response(
+        data["items"],
+        total=data["total"],
+        total_estimated=data["total_estimated"],
+        page=page,
+        per_page=per_page,
+        total_pages=total_pages,
+        next_cursor=data["next_cursor"],
+        facets=facet_counts,
+    )
 
 
 # ── 能力详情 ──────────────────────────────────────────────────
@@ -227,10 +515,10 @@ def api_search(
 )
 def api_get_capability(slug: str):
     """根据 slug 获取单个能力的完整详情。"""
-    cap = get_capability(slug)
-    if not cap:
+    payload = get_capability_json(slug)
+    if payload is None:
         raise HTTPException(status_code=404, detail="Capability not found")
-    return cap
+    return Response(content=payload, media_type="application/json")
 
 
 @app.get(
@@ -253,6 +541,50 @@ def api_get_scores(slug: str):
     return {"slug": slug, "scores": cap["scores"], "overall_score": cap["overall_score"]}
 
 
+BATCH_MAX_SLUGS = 100  # 单次批量查询的 slug 上限
+
+
+def _batch_response(slugs: list[str]) -> Response:
+    slugs = [slug.strip() for slug in slugs if slug.strip()]
+    if not slugs:
+        raise HTTPException(status_code=400, detail="slugs 不能为空")
+    if len(slugs) > BATCH_MAX_SLUGS:
+        raise HTTPException(status_code=400, detail=f"单次最多查询 {BATCH_MAX_SLUGS} 个 slug")
+    invalid: list[str] = []
+    found = get_capabilities_json(slugs, invalid)
+    not_found = list(dict.fromkeys(slug for slug in slugs if slug not in found and slug not in invalid))
+    return _json_list_response([found.get(slug, "null") for slug in slugs], not_found=not_found, errors=invalid)
+
+
+_BATCH_ROUTE = dict(
+    response_model=BatchCapabilitiesResponse,
+    summary="批量获取能力详情",
+    description=f"一次获取多个能力的完整信息（最多 {BATCH_MAX_SLUGS} 个），结果按请求顺序返回，"
+    "不存在的 slug 对应 null 并列入 not_found，记录损坏无法解析的 slug 同样对应 null 并列入 errors，"
+    "不影响其他 slug。适合对比页、收藏页等需要多条详情的场景。",
+    response_description="与请求 slug 一一对应的能力详情列表",
+    tags=["能力详情"],
+    responses={
+        200: {"description": "成功返回（部分 slug 可能不存在或无法解析）"},
+        400: {"description": "slug 列表为空或超过上限", "model": ErrorResponse},
+    },
+)
+
+
+@app.get("/api/v1/capabilities:batch", **_BATCH_ROUTE)
+def api_batch_capabilities(
+    slugs: list[str] = Query(..., description="slug 列表，可重复传参或用逗号分隔，如 slugs=a,b,c"),
+):
+    """批量获取能力详情（GET，适合可缓存的少量 slug）。"""
+    return _batch_response([slug for value in slugs for slug in value.split(",")])
+
+
+@app.post("/api/v1/capabilities:batch", **_BATCH_ROUTE)
+def api_batch_capabilities_post(req: BatchCapabilitiesRequest):
+    """批量获取能力详情（POST，slug 较多时避免 URL 过长）。"""
+    return _batch_response(req.slugs)
+
+
 # ── 分类 ─────────────────────────────────────────────────────
 
 @app.get(
@@ -283,6 +615,7 @@ def api_categories():
     tags=["排行榜"],
     responses={
         200: {"description": "成功返回排行榜数据"},
+        400: {"description": "分页游标非法", "model": ErrorResponse},
     },
 )
 def api_rankings(
@@ -290,10 +623,81 @@ def api_rankings(
     sort: str = Query(default="overall_score", description="排序字段：overall_score / stars / last_updated / name / created_at"),
     order: str = Query(default="desc", description="排序方向：asc / desc"),
     limit: int = Query(default=50, ge=1, le=200, description="返回数量上限，1-200"),
+    cursor: str | None = Query(default=None, description="分页游标（上一次返回的 next_cursor）"),
+    total: str = Query(default="exact", pattern="^(exact|estimate|none)$", description="总数计算方式：exact / estimate / none"),
 ):
     """获取能力排行榜。"""
-    data = search_capabilities(category=category, sort_by=sort, order=order, limit=limit)
-    return {"results": data["items"], "total": data["total"]}
+    try:
+        data = search_capabilities(
+            category=category, sort_by=sort, order=order, limit=limit, cursor=cursor, total_mode=total,
+            encoded=True,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _json_list_response(
+        data["items"],
+        total=data["total"],
+        total_estimated=data["total_estimated"],
+        next_cursor=data["next_cursor"],
+    )
+
+
+# ── 导出 ─────────────────────────────────────────────────────
+
+EXPORT_CHUNK_BYTES = 64 * 1024  # 攒够这么多字节再写出一块，避免逐行 send
+
+
+def _ndjson_chunks(lines, compress: bool):
+    """把 JSON 行拼成 NDJSON 块，按需 gzip 压缩；内存占用只与块大小有关"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits=31 → gzip 格式
+    buf, size = [], 0
+    for line in lines:
+        buf.append(line)
+        size += len(line) + 1
+        if size >= EXPORT_CHUNK_BYTES:
+            data = ("\n".join(buf) + "\n").encode()
+            buf, size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = ("\n".join(buf) + "\n").encode() if buf else b""
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+@app.get(
+    "/api/v1/export.ndjson",
+    response_class=StreamingResponse,
+    summary="流式导出能力数据",
+    description="以 NDJSON（每行一个能力 JSON）流式导出全部能力，字段与详情接口一致。"
+    "请求头带 `Accept-Encoding: gzip` 时返回 gzip 压缩流。"
+    "传 updated_since 时只导出该时间之后更新过的能力，并按 updated_at 升序排列，便于增量同步。",
+    response_description="NDJSON 数据流",
+    tags=["导出"],
+    responses={
+        200: {"description": "成功返回数据流", "content": {"application/x-ndjson": {}}},
+        400: {"description": "updated_since 格式非法", "model": ErrorResponse},
+    },
+)
+def api_export(
+    request: Request,
+    category: str = Query(default="", description="按分类筛选，留空导出所有分类"),
+    updated_since: str | None = Query(default=None, description="只导出该时间之后更新的能力（ISO 8601，如 2026-02-18T12:00:00Z）"),
+):
+    """流式导出能力数据。"""
+    try:
+        lines = iter_capabilities_json(category=category, updated_since=updated_since)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    compress = "gzip" in _accepted_encodings(request)
+    headers = {"Vary": "Accept-Encoding", "Cache-Control": "no-store"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        _ndjson_chunks(lines, compress), media_type="application/x-ndjson", headers=headers,
+    )
 
 
 # ── 语义搜索 ──────────────────────────────────────────────────
@@ -315,6 +719,7 @@ def api_rankings(
 def api_semantic_search(
     q: str = Query(..., description="自然语言查询，如 '帮我分析代码质量'"),
     limit: int = Query(default=10, ge=1, le=50, description="返回数量上限，1-50"),
+    mode: str = Query(default="exact", pattern="^(exact|approx)$", description="检索方式：exact 精确 / approx IVF 近似（无索引时退回精确）"),
 ):
     """语义搜索 — 用 embedding 理解查询意图"""
     import os
@@ -322,18 +727,137 @@ def api_semantic_search(
     if not api_key:
         raise HTTPException(status_code=503, detail="OpenAI API key not configured")
 
-    from scripts.embeddings import search_similar
-    results = search_similar(q, api_key, top_k=limit)
+    from scripts.embeddings import embed_query, rank_similar
+    timer = _StageTimer()
+    with timer("embed"):
+        query_emb = embed_query(q, api_key)
+    with timer("rank"):
+        results = rank_similar(query_emb, top_k=limit, mode=mode)
+
+    # 一次批量查询获取完整信息（预编码 JSON），按相似度顺序拼接并补上 similarity 字段
+    with timer("hydrate"):
+        found = get_capabilities_json([slug for slug, _ in results])
+        items = [
+            found[slug][:-1] + f',"similarity":{json.dumps(round(score, 4))}}}'
+            for slug, score in results
+            if slug in found
+        ]
+
+    response = _json_list_response(items, total=len(items), query=q)
+    response.headers["Server-Timing"] = timer.header()
+    return response
+
+
+# ── 混合搜索 ──────────────────────────────────────────────────
+
+HYBRID_CANDIDATES = 50  # 每一路参与融合的候选数
+HYBRID_RRF_K = 60       # RRF 平滑常数，越大越弱化头部排名差异
+# 向量检索（含调用 OpenAI 生成查询向量）的时间预算，超时则只用关键词结果
+HYBRID_VECTOR_BUDGET_MS = int(os.getenv("HYBRID_VECTOR_BUDGET_MS", "800"))
+# 向量检索专用线程池：超时后线程仍会跑到 OpenAI 请求超时为止，必须限量，排满时直接降级
+vector_executor = AsyncDB(
+    workers=int(os.getenv("HYBRID_VECTOR_WORKERS", "4")),
+    max_pending=int(os.getenv("HYBRID_VECTOR_MAX_PENDING", "16")),
+    thread_name_prefix="agentstore-vector",
+)
 
-    # 查数据库获取完整信息
-    capabilities = []
-    for slug, score in results:
-        cap = get_capability(slug)
-        if cap:
-            cap["similarity"] = round(score, 4)
-            capabilities.append(cap)
 
-    return {"results": capabilities, "total": len(capabilities), "query": q}
+def _vector_candidates(q: str, api_key: str, top_k: int) -> list[str]:
+    from scripts.embeddings import embed_query, rank_similar
+    return [slug for slug, _ in rank_similar(embed_query(q, api_key), top_k=top_k)]
+
+
+def _keyword_candidates(q: str, category: str, top_k: int) -> list[str]:
+    data = search_capabilities(q=q, category=category, sort_by="relevance", limit=top_k, total_mode="none")
+    return [item["slug"] for item in data["items"]]
+
+
+def _rrf(rankings: dict[str, list[str]], k: int = HYBRID_RRF_K) -> list[tuple[str, float, dict]]:
+    """倒数排名融合：score = Σ 1 / (k + rank)，返回 [(slug, score, {来源: 排名})]，按分数降序"""
+    scores: dict[str, float] = {}
+    ranks: dict[str, dict] = {}
+    for source, slugs in rankings.items():
+        for rank, slug in enumerate(slugs, 1):
+            scores[slug] = scores.get(slug, 0.0) + 1.0 / (k + rank)
+            ranks.setdefault(slug, {})[source] = rank
+    ordered = sorted(scores, key=lambda slug: (-scores[slug], slug))
+    return [(slug, scores[slug], ranks[slug]) for slug in ordered]
+
+
+@app.get(
+    "/api/v1/hybrid-search",
+    response_model=HybridSearchResponse,
+    summary="混合搜索",
+    description="同时执行关键词全文检索和向量语义检索，用倒数排名融合（RRF）合并为一个排序列表。"
+    "分类筛选在融合前应用于两路候选。向量检索不可用或超过时间预算时退回纯关键词结果（degraded=true）。",
+    response_description="按融合分数降序排列的搜索结果",
+    tags=["语义搜索"],
+    responses={
+        200: {"description": "搜索成功"},
+        503: {"description": "服务繁忙", "model": ErrorResponse},
+    },
+)
+async def api_hybrid_search(
+    q: str = Query(..., min_length=1, description="查询文本，同时用于关键词和语义检索"),
+    category: str = Query(default="", description="按分类筛选，如 'coding', 'data'"),
+    limit: int = Query(default=10, ge=1, le=50, description="返回数量上限，1-50"),
+):
+    """混合搜索 — 关键词 + 向量检索并发执行，RRF 融合"""
+    timer = _StageTimer()
+    started = time.perf_counter()
+    api_key = os.getenv("OPENAI_API_KEY", "")
+    # 有分类筛选时向量检索多取一些候选，过滤后仍有足够的结果参与融合
+    vector_k = HYBRID_CANDIDATES * (4 if category else 1)
+    vector_task = (
+        asyncio.ensure_future(vector_executor.run(_vector_candidates, q, api_key, vector_k))
+        if api_key else None
+    )
+    if vector_task is not None:
+        # 提前返回（超时/503）时任务可能没人 await，取走异常避免 "never retrieved" 告警
+        vector_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    try:
+        with timer("keyword"):
+            keyword = await run_db(_keyword_candidates, q, category, HYBRID_CANDIDATES)
+
+        vector: list[str] = []
+        degraded = vector_task is None
+        if vector_task is not None:
+            remaining = HYBRID_VECTOR_BUDGET_MS / 1000 - (time.perf_counter() - started)
+            with timer("vector"):
+                try:
+                    # shield：超时后后台线程继续跑完，查询向量仍会写入缓存，下次请求可直接命中
+                    vector = await asyncio.wait_for(asyncio.shield(vector_task), timeout=max(remaining, 0))
+                except (asyncio.TimeoutError, DatabaseOverloaded):
+                    degraded = True
+                except Exception:
+                    logger.exception("混合搜索的向量检索失败，退回关键词结果")
+                    degraded = True
+            if vector and category:
+                allowed = await run_db(filter_slugs_by_category, vector, category)
+                vector = [slug for slug in vector if slug in allowed]
+
+        with timer("fuse"):
+            fused = _rrf({"keyword": keyword, "vector": vector[:HYBRID_CANDIDATES]})[:limit]
+        with timer("hydrate"):
+            found = await run_db(get_capabilities_json, [slug for slug, _, _ in fused])
+    except _OVERLOAD_ERRORS:
+        return _overloaded_response()
+
+    items = []
+    for slug, score, ranks in fused:
+        if slug not in found:
+            continue
+        extra = json.dumps({
+            "rrf_score": round(score, 6),
+            "keyword_rank": ranks.get("keyword"),
+            "vector_rank": ranks.get("vector"),
+        }, separators=(",", ":"))
+        items.append(found[slug][:-1] + "," + extra[1:])
+
+    response = _json_list_response(items, total=len(items), query=q, degraded=degraded)
+    response.headers["Server-Timing"] = timer.header()
+    return response
 
 
 # ── 统计 ─────────────────────────────────────────────────────
@@ -53,15 +53,27 @@ class SemanticCapabilityItem(CapabilityItem):
     similarity: float = Field(0, description="与查询的语义相似度 (0-1)")
 
 
+class HybridCapabilityItem(CapabilityItem):
+    """混合搜索结果项，额外包含融合分数和两路排名"""
+    rrf_score: float = Field(0, description="倒数排名融合分数，越大越相关")
+    keyword_rank: int | None = Field(None, description="在关键词检索中的排名（从 1 开始），未命中为 null")
+    vector_rank: int | None = Field(None, description="在向量检索中的排名（从 1 开始），未命中为 null")
+
+
 # ── 端点响应模型 ─────────────────────────────────────────────
 
 class SearchResponse(BaseModel):
     """搜索结果响应"""
     results: list[CapabilityItem] = Field(..., description="搜索结果列表")
-    total: int = Field(..., description="匹配总数")
+    total: int | None = Field(..., description="匹配总数（total=none 时为 null）")
+    total_estimated: bool = Field(False, description="total 是否为估算下界（total=estimate 且无缓存时）")
     page: int = Field(..., description="当前页码")
     per_page: int = Field(..., description="每页数量")
-    total_pages: int = Field(..., description="总页数")
+    total_pages: int | None = Field(..., description="总页数（total 为 null 时为 null）")
+    next_cursor: str | None = Field(None, description="下一页游标，传给 cursor 参数继续翻页；没有更多结果时为 null")
+    facets: dict[str, dict[str, int]] | None = Field(
+        None, description="分面计数（facets=true 时返回）：维度 -> {取值: 数量}，维度为 category/language/protocol/source/has_tests"
+    )
 
 
 class CapabilityResponse(CapabilityItem):
@@ -69,6 +81,18 @@ class CapabilityResponse(CapabilityItem):
     pass
 
 
+class BatchCapabilitiesRequest(BaseModel):
+    """批量查询请求"""
+    slugs: list[str] = Field(..., description="要查询的 slug 列表，按此顺序返回")
+
+
+class BatchCapabilitiesResponse(BaseModel):
+    """批量查询响应"""
+    results: list[CapabilityItem | None] = Field(..., description="与请求 slug 一一对应，不存在或无法解析的为 null")
+    not_found: list[str] = Field(..., description="不存在的 slug 列表")
+    errors: list[str] = Field(default_factory=list, description="记录存在但数据无法解析的 slug 列表")
+
+
 class ScoresResponse(BaseModel):
     """评分查询响应"""
     slug: str = Field(..., description="能力唯一标识符")
@@ -84,7 +108,9 @@ class CategoriesResponse(BaseModel):
 class RankingsResponse(BaseModel):
     """排行榜响应"""
     results: list[CapabilityItem] = Field(..., description="排行榜列表")
-    total: int = Field(..., description="匹配总数")
+    total: int | None = Field(..., description="匹配总数（total=none 时为 null）")
+    total_estimated: bool = Field(False, description="total 是否为估算下界")
+    next_cursor: str | None = Field(None, description="下一页游标，没有更多结果时为 null")
 
 
 class SemanticSearchResponse(BaseModel):
@@ -94,11 +120,20 @@ class SemanticSearchResponse(BaseModel):
     query: str = Field(..., description="原始查询文本")
 
 
+class HybridSearchResponse(BaseModel):
+    """混合搜索响应"""
+    results: list[HybridCapabilityItem] = Field(..., description="融合排序后的结果，按 rrf_score 降序")
+    total: int = Field(..., description="结果数量")
+    query: str = Field(..., description="原始查询文本")
+    degraded: bool = Field(False, description="向量检索不可用或超出时间预算，仅返回关键词结果")
+
+
 class StatsResponse(BaseModel):
     """平台统计响应"""
     total: int = Field(..., description="能力总数")
     categories: dict[str, int] = Field(..., description="各分类数量，key 为分类名")
     avg_score: float = Field(..., description="全平台平均综合评分")
+    score_histogram: dict[str, int] = Field(default_factory=dict, description="综合评分分布，key 为整数分段下界 '0'-'9'")
     top_capability: CapabilityItem | None = Field(None, description="综合评分最高的能力")
 
 
@@ -1,17 +1,25 @@
 """用户系统：注册、登录、收藏、评论、插件提交、API Key 管理"""
 import os
 import secrets
+import threading
+import time
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from jose import JWTError, jwt
-from passlib.context import CryptContext
 import re
 from pydantic import BaseModel, Field, field_validator
 
-from .database import _get_conn, get_usage_stats, TIER_LIMITS
+from .cache import LRUCache
+from .database import (
+    _get_conn,
+    _bump_generation,
+    _forget_generation,
+    get_usage_stats,
+    API_KEYS_GENERATION,
+    TIER_LIMITS,
+)
 
 # ── 配置 ──────────────────────────────────────────────
 _default_secret = os.urandom(32).hex()  # 未配置时随机生成（重启后旧 token 失效）
@@ -22,7 +30,25 @@ if not os.getenv("JWT_SECRET_KEY"):
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 小时
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 认证缓存：已解析的 API Key 记录和 JWT claims（条目数 / 最长缓存秒数）
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "2048"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+_token_cache = LRUCache(AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+# passlib/bcrypt 和 python-jose 导入较慢，只有注册/登录/带 token 的请求才用到，首次使用时再导入，缩短冷启动
+_pwd_context = None
+_pwd_context_lock = threading.Lock()
+
+
+def _get_pwd_context():
+    global _pwd_context
+    if _pwd_context is None:
+        with _pwd_context_lock:
+            if _pwd_context is None:
+                from passlib.context import CryptContext
+                _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
+
 security = HTTPBearer(auto_error=False)
 
 router = APIRouter(tags=["users"])
@@ -98,6 +124,8 @@ class SubmissionOut(BaseModel):
 # ── 工具函数 ──────────────────────────────────────────
 def _create_token(user_id: int, username: str) -> str:
     """生成 JWT token"""
+    from jose import jwt
+
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     payload = {"sub": str(user_id), "username": username, "exp": expire}
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
@@ -108,21 +136,33 @@ def _get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depe
     if credentials is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="未提供认证信息")
     token = credentials.credentials
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = int(payload["sub"])
-        username = payload["username"]
-    except (JWTError, KeyError, ValueError):
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="无效的 token")
-    return {"id": user_id, "username": username}
+    user = _token_cache.get(token)
+    if user is None:
+        from jose import JWTError, jwt
+
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            user_id = int(payload["sub"])
+            username = payload["username"]
+            expires_in = float(payload["exp"]) - time.time()
+        except (JWTError, KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="无效的 token")
+        user = {"id": user_id, "username": username}
+        # 缓存时间不超过 token 剩余有效期，过期的 token 不会从缓存里“复活”
+        _token_cache.set(token, user, ttl=min(AUTH_CACHE_TTL, expires_in))
+    return dict(user)
+
+
+def get_token_cache_stats() -> dict:
+    """JWT claims 缓存的命中/未命中/淘汰统计"""
+    return _token_cache.stats()
 
 
 # ── 认证路由 ──────────────────────────────────────────
 @router.post("/api/v1/auth/register", response_model=TokenResponse)
 def register(req: RegisterRequest):
     """注册新用户"""
-    conn = _get_conn()
-    try:
+    with _get_conn() as conn:
         # 检查用户名是否已存在
         existing = conn.execute(
             "SELECT id FROM users WHERE username = ?", (req.username,)
@@ -130,15 +170,13 @@ def register(req: RegisterRequest):
         if existing:
             raise HTTPException(status_code=409, detail="用户名已存在")
 
-        password_hash = pwd_context.hash(req.password)
+        password_hash = _get_pwd_context().hash(req.password)
         cursor = conn.execute(
             "INSERT INTO users (username, password_hash) VALUES (?, ?)",
             (req.username, password_hash),
         )
         conn.commit()
         user_id = cursor.lastrowid
-    finally:
-        conn.close()
 
     token = _create_token(user_id, req.username)
     return TokenResponse(access_token=token)
@@ -147,16 +185,13 @@ def register(req: RegisterRequest):
 @router.post("/api/v1/auth/login", response_model=TokenResponse)
 def login(req: LoginRequest):
     """用户登录"""
-    conn = _get_conn()
-    try:
+    with _get_conn() as conn:
         row = conn.execute(
             "SELECT id, username, password_hash FROM users WHERE username = ?",
             (req.username,),
         ).fetchone()
-    finally:
-        conn.close()
 
-    if not row or not pwd_context.verify(req.password, row["password_hash"]):
+    if not row or not _get_pwd_context().verify(req.password, row["password_hash"]):
         raise HTTPException(status_code=401, detail="用户名或密码错误")
 
     token = _create_token(row["id"], row["username"])
@@ -166,13 +201,10 @@ def login(req: LoginRequest):
 @router.get("/api/v1/users/me", response_model=UserInfo)
 def get_me(user: dict = Depends(_get_current_user)):
     """获取当前用户信息"""
-    conn = _get_conn()
-    try:
+    with _get_conn() as conn:
         row = conn.execute(
             "SELECT id, username, created_at FROM users WHERE id = ?", (user["id"],)
         ).fetchone()
-    finally:
-        conn.close()
 
     if not row:
         raise HTTPException(status_code=404, detail="用户不存在")
@@ -183,8 +215,7 @@ def get_me(user: dict = Depends(_get_current_user)):
 @router.post("/api/v1/favorites/{slug}")
 def toggle_favorite(slug: str, user: dict = Depends(_get_current_user)):
     """收藏/取消收藏（toggle）"""
-    conn = _get_conn()
-    try:
+    with _get_conn() as conn:
         existing = conn.execute(
             "SELECT id FROM favorites WHERE user_id = ? AND capability_slug = ?",
             (user["id"], slug),
@@ -203,15 +234,12 @@ def toggle_favorite(slug: str, user: dict = Depends(_get_current_user)):
             )
             conn.commit()
             return {"action": "favorited", "slug": slug}
-    finally:
-        conn.close()
 
 
 @router.get("/api/v1/favorites")
 def list_favorites(user: dict = Depends(_get_current_user)):
     """获取当前用户的收藏列表"""
-    conn = _get_conn()
-    try:
+    with _get_conn() as conn:
         rows = conn.execute(
             """SELECT f.capability_slug, f.created_at
                FROM favorites f
@@ -219,8 +247,6 @@ def list_favorites(user: dict = Depends(_get_current_user)):
                ORDER BY f.created_at DESC""",
             (user["id"],),
         ).fetchall()
-    finally:
-        conn.close()
 
     return {
         "favorites": [
@@ -235,8 +261,7 @@ def list_favorites(user: dict = Depends(_get_current_user)):
 @router.post("/api/v1/comments/{slug}", response_model=CommentOut)
 def create_comment(slug: str, req: CommentRequest, user: dict = Depends(_get_current_user)):
     """发表评论（同一用户对同一插件每分钟限 1 条）"""
-    conn = _get_conn()
-    try:
+    with _get_conn() as conn:
         # 频率限制：同一用户对同一插件每分钟限 1 条
         recent = conn.execute(
             """SELECT id FROM comments
@@ -261,8 +286,6 @@ def create_comment(slug: str, req: CommentRequest, user: dict = Depends(_get_cur
                WHERE c.id = ?""",
             (comment_id,),
         ).fetchone()
-    finally:
-        conn.close()
 
     return CommentOut(**dict(row))
 
@@ -270,8 +293,7 @@ def create_comment(slug: str, req: CommentRequest, user: dict = Depends(_get_cur
 @router.get("/api/v1/comments/{slug}")
 def list_comments(slug: str):
     """获取指定能力的评论列表（无需登录），包含每条评论的点赞数"""
-    conn = _get_conn()
-    try:
+    with _get_conn() as conn:
         rows = conn.execute(
             """SELECT c.id, u.username, c.capability_slug, c.content, c.rating, c.created_at,
                       COALESCE((SELECT COUNT(*) FROM comment_likes cl WHERE cl.comment_id = c.id), 0) AS likes_count
@@ -280,8 +302,6 @@ def list_comments(slug: str):
                ORDER BY c.created_at DESC""",
             (slug,),
         ).fetchall()
-    finally:
-        conn.close()
 
     comments = [CommentOut(**dict(r)) for r in rows]
     # 计算平均评分
@@ -311,8 +331,7 @@ def verify_admin(x_admin_password: str = Header(...)):
 @router.post("/api/v1/submissions", response_model=SubmissionOut)
 def create_submission(req: SubmissionRequest, user: dict = Depends(_get_current_user)):
     """提交新插件（需登录）"""
-    conn = _get_conn()
-    try:
+    with _get_conn() as conn:
         # 频率限制：同一用户每分钟限 1 次提交
         recent = conn.execute(
             """SELECT id FROM submissions
@@ -336,8 +355,6 @@ def create_submission(req: SubmissionRequest, user: dict = Depends(_get_current_
                WHERE s.id = ?""",
             (submission_id,),
         ).fetchone()
-    finally:
-        conn.close()
 
     return SubmissionOut(**dict(row))
 
@@ -349,8 +366,7 @@ def list_submissions(
     status_filter: str = Query("", alias="status"),
 ):
     """获取提交列表（公开，分页）"""
-    conn = _get_conn()
-    try:
+    with _get_conn() as conn:
         conditions = []
         params: list = []
         if status_filter:
@@ -372,8 +388,6 @@ def list_submissions(
                 LIMIT ? OFFSET ?""",
             params + [per_page, offset],
         ).fetchall()
-    finally:
-        conn.close()
 
     submissions = [SubmissionOut(**dict(r)) for r in rows]
     return {"submissions": submissions, "total": total, "page": page, "per_page": per_page}
@@ -385,8 +399,7 @@ def approve_submission(
     _admin: None = Depends(_check_admin),
 ):
     """审核通过提交（需 admin 密码 header）"""
-    conn = _get_conn()
-    try:
+    with _get_conn() as conn:
         row = conn.execute(
             "SELECT id, status FROM submissions WHERE id = ?", (submission_id,)
         ).fetchone()
@@ -404,8 +417,6 @@ def approve_submission(
                WHERE s.id = ?""",
             (submission_id,),
         ).fetchone()
-    finally:
-        conn.close()
 
     return SubmissionOut(**dict(updated))
 
@@ -416,8 +427,7 @@ def reject_submission(
     _admin: None = Depends(_check_admin),
 ):
     """拒绝提交（需 admin 密码 header）"""
-    conn = _get_conn()
-    try:
+    with _get_conn() as conn:
         row = conn.execute(
             "SELECT id, status FROM submissions WHERE id = ?", (submission_id,)
         ).fetchone()
@@ -435,8 +445,6 @@ def reject_submission(
                WHERE s.id = ?""",
             (submission_id,),
         ).fetchone()
-    finally:
-        conn.close()
 
     return SubmissionOut(**dict(updated))
 
@@ -482,8 +490,7 @@ class UsageStatsResponse(BaseModel):
 @router.post("/api/v1/api-keys", response_model=ApiKeyCreatedResponse)
 def create_api_key(req: CreateApiKeyRequest, user: dict = Depends(_get_current_user)):
     """生成新 API Key（需登录，每用户最多 5 个）"""
-    conn = _get_conn()
-    try:
+    with _get_conn() as conn:
         # 检查当前用户已有 key 数量
         count = conn.execute(
             "SELECT COUNT(*) FROM api_keys WHERE user_id = ?", (user["id"],)
@@ -509,8 +516,6 @@ def create_api_key(req: CreateApiKeyRequest, user: dict = Depends(_get_current_u
             "SELECT id, key_prefix, name, tier, daily_limit, created_at FROM api_keys WHERE id = ?",
             (key_id,),
         ).fetchone()
-    finally:
-        conn.close()
 
     return ApiKeyCreatedResponse(
         id=row["id"],
@@ -526,16 +531,13 @@ def create_api_key(req: CreateApiKeyRequest, user: dict = Depends(_get_current_u
 @router.get("/api/v1/api-keys")
 def list_api_keys(user: dict = Depends(_get_current_user)):
     """列出当前用户的所有 API Key（不返回完整 key 或 hash）"""
-    conn = _get_conn()
-    try:
+    with _get_conn() as conn:
         rows = conn.execute(
             """SELECT id, key_prefix, name, tier, daily_limit, is_active, created_at, last_used_at
                FROM api_keys WHERE user_id = ?
                ORDER BY created_at DESC""",
             (user["id"],),
         ).fetchall()
-    finally:
-        conn.close()
 
     keys = [ApiKeyOut(**dict(r)) for r in rows]
     return {"api_keys": keys, "total": len(keys)}
@@ -544,8 +546,7 @@ def list_api_keys(user: dict = Depends(_get_current_user)):
 @router.delete("/api/v1/api-keys/{key_id}")
 def delete_api_key(key_id: int, user: dict = Depends(_get_current_user)):
     """删除 API Key（只能删自己的）"""
-    conn = _get_conn()
-    try:
+    with _get_conn() as conn:
         row = conn.execute(
             "SELECT id, user_id FROM api_keys WHERE id = ?", (key_id,)
         ).fetchone()
@@ -555,9 +556,9 @@ def delete_api_key(key_id: int, user: dict = Depends(_get_current_user)):
             raise HTTPException(status_code=403, detail="无权删除此 API Key")
 
         conn.execute("DELETE FROM api_keys WHERE id = ?", (key_id,))
+        _bump_generation(conn, API_KEYS_GENERATION)  # 让所有进程的 Key 缓存失效
         conn.commit()
-    finally:
-        conn.close()
+    _forget_generation(API_KEYS_GENERATION)
 
     return {"detail": "API Key 已删除", "key_id": key_id}
 
@@ -565,13 +566,10 @@ def delete_api_key(key_id: int, user: dict = Depends(_get_current_user)):
 @router.get("/api/v1/api-keys/{key_id}/usage", response_model=UsageStatsResponse)
 def api_key_usage(key_id: int, user: dict = Depends(_get_current_user)):
     """查看某个 API Key 的使用统计（需登录，只能查自己的）"""
-    conn = _get_conn()
-    try:
+    with _get_conn() as conn:
         row = conn.execute(
             "SELECT id, user_id FROM api_keys WHERE id = ?", (key_id,)
         ).fetchone()
-    finally:
-        conn.close()
 
     if not row:
         raise HTTPException(status_code=404, detail="API Key 不存在")
@@ -595,8 +593,7 @@ class UserProfile(BaseModel):
 @router.get("/api/v1/users/{username}/profile", response_model=UserProfile)
 def get_user_profile(username: str):
     """获取用户公开 Profile（无需登录）"""
-    conn = _get_conn()
-    try:
+    with _get_conn() as conn:
         # 查找用户
         user_row = conn.execute(
             "SELECT id, username, created_at FROM users WHERE username = ?",
@@ -639,8 +636,6 @@ def get_user_profile(username: str):
                ORDER BY f.created_at DESC LIMIT 5""",
             (user_id,),
         ).fetchall()
-    finally:
-        conn.close()
 
     return UserProfile(
         username=user_row["username"],
@@ -659,8 +654,7 @@ def get_user_profile(username: str):
 @router.post("/api/v1/comments/{comment_id}/like")
 def toggle_comment_like(comment_id: int, user: dict = Depends(_get_current_user)):
     """切换评论点赞（需登录，toggle 逻辑）"""
-    conn = _get_conn()
-    try:
+    with _get_conn() as conn:
         # 检查评论是否存在
         comment = conn.execute(
             "SELECT id FROM comments WHERE id = ?", (comment_id,)
@@ -692,7 +686,5 @@ def toggle_comment_like(comment_id: int, user: dict = Depends(_get_current_user)
         likes_count = conn.execute(
             "SELECT COUNT(*) FROM comment_likes WHERE comment_id = ?", (comment_id,)
         ).fetchone()[0]
-    finally:
-        conn.close()
 
     return {"action": action, "comment_id": comment_id, "likes_count": likes_count}
@@ -0,0 +1,84 @@
+"""启动预热：在后台线程预先加载数据库页、缓存和 embedding 矩阵，完成前 /health 返回 503"""
+import logging
+import os
+import threading
+import time
+from typing import Callable
+
+from .database import warm_caches, warm_page_cache
+
+logger = logging.getLogger("uvicorn.error.warmup")  # 挂在 uvicorn 日志器下，默认配置即输出 INFO
+
+# 按顺序执行的预热步骤，留空则跳过预热、启动即就绪
+WARMUP_STEPS = os.getenv("WARMUP_STEPS", "sqlite,capabilities,embeddings")
+WARMUP_CAPABILITIES = int(os.getenv("WARMUP_CAPABILITIES", "1000"))  # 预先缓存详情的能力数（按综合评分）
+
+
+def _warm_embeddings():
+    try:
+        from scripts.embeddings import get_index  # 依赖 numpy/openai，未安装时跳过
+    except ImportError:
+        return "skipped"
+    return get_index().warm()
+
+
+STEPS: dict[str, Callable] = {
+    "sqlite": warm_page_cache,
+    "capabilities": lambda: warm_caches(WARMUP_CAPABILITIES),
+    "embeddings": _warm_embeddings,
+}
+
+
+class Warmup:
+    """依次执行预热步骤并记录每步耗时
+
+    单步失败只记日志，不影响后续步骤；全部执行完后标记就绪（预热只是优化，不能挡住服务）。
+    """
+
+    def __init__(self, steps: dict[str, Callable] = STEPS):
+        self.steps = steps
+        self._ready = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.timings: dict[str, float] = {}
+        self.errors: dict[str, str] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def start(self, names: str = WARMUP_STEPS):
+        """在后台线程执行 names（逗号分隔）中的步骤"""
+        selected = [name.strip() for name in names.split(",") if name.strip()]
+        for name in selected:
+            if name not in self.steps:
+                raise ValueError(f"未知的预热步骤: {name}（可选: {', '.join(self.steps)}）")
+        self._ready.clear()
+        self.timings, self.errors = {}, {}
+        self._thread = threading.Thread(target=self._run, args=(selected,), name="warmup", daemon=True)
+        self._thread.start()
+
+    def _run(self, names: list[str]):
+        started = time.perf_counter()
+        try:
+            for name in names:
+                step_start = time.perf_counter()
+                try:
+                    result = self.steps[name]()
+                except Exception as e:
+                    self.errors[name] = str(e)
+                    logger.exception("预热步骤 %s 失败", name)
+                    result = "failed"
+                self.timings[name] = round((time.perf_counter() - step_start) * 1000, 1)
+                logger.info("预热步骤 %s 完成: %s，耗时 %.1f ms", name, result, self.timings[name])
+        finally:
+            self._ready.set()
+            logger.info("预热完成，总耗时 %.1f ms", (time.perf_counter() - started) * 1000)
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def stats(self) -> dict:
+        return {"ready": self.ready, "steps_ms": dict(self.timings), "errors": dict(self.errors)}
+
+
+warmup = Warmup()
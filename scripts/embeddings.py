@@ -1,13 +1,43 @@
 """生成和管理 capability embedding，用于语义搜索"""
+from __future__ import annotations
+
+import argparse
+import fcntl
+import hashlib
+import io
 import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
 import numpy as np
 from pathlib import Path
-from openai import OpenAI
+from typing import TYPE_CHECKING
+
+from api.cache import LRUCache
+
+if TYPE_CHECKING:
+    from openai import OpenAI  # 导入约 0.2s，只在真正调用 API 时才加载
+
+EMBEDDINGS_FILE = Path(__file__).parent.parent / "data" / "embeddings.json"  # 旧格式，仅用于迁移
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# 查询向量缓存：内存 LRU 条目数 / 过期秒数 / 可选的磁盘 SQLite 路径（留空不落盘）及其最大条目数
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2048"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", str(7 * 24 * 3600)))
+QUERY_CACHE_DB = os.getenv("QUERY_EMBEDDING_CACHE_DB", "")
+QUERY_CACHE_DISK_MAX = int(os.getenv("QUERY_EMBEDDING_CACHE_DISK_MAX", "50000"))
+# OpenAI 请求超时（秒）与重试次数：调用它的线程在超时前一直被占用，不能沿用 SDK 默认的 10 分钟
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "10"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "1"))
 
 
 def generate_embeddings(api_key: str):
     """为所有 capability 生成 embedding 并保存"""
-    client = OpenAI(api_key=api_key)
+    client = _get_client(api_key)
     data_file = Path(__file__).parent.parent / "data" / "capabilities.json"
     items = json.loads(data_file.read_text())
 
@@ -21,43 +51,622 @@ def generate_embeddings(api_key: str):
             for item in batch
         ]
         resp = client.embeddings.create(
-            model="text-embedding-3-small",
+            model=EMBEDDING_MODEL,
             input=texts
         )
         for item, emb in zip(batch, resp.data):
             embeddings[item['slug']] = emb.embedding
         print(f"  [{i + len(batch)}/{len(items)}] embedding 生成中...")
 
-    # 保存为 JSON 文件
-    out_file = Path(__file__).parent.parent / "data" / "embeddings.json"
-    out_file.write_text(json.dumps(embeddings))
-    print(f"完成！{len(embeddings)} 个 embedding 已保存到 {out_file}")
+    # 保存为二进制存储
+    store = EmbeddingStore()
+    store.rewrite(embeddings)
+    print(f"完成！{len(embeddings)} 个 embedding 已保存到 {store.meta_path}")
     return embeddings
 
 
+_clients: dict[str, OpenAI] = {}
+_clients_lock = threading.Lock()
+
+
+def _get_client(api_key: str) -> OpenAI:
+    """复用 OpenAI 客户端（及其连接池），不再每次查询新建"""
+    client = _clients.get(api_key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(api_key)
+            if client is None:
+                from openai import OpenAI
+
+                client = _clients[api_key] = OpenAI(
+                    api_key=api_key, timeout=OPENAI_TIMEOUT, max_retries=OPENAI_MAX_RETRIES
+                )
+    return client
+
+
+def normalize_query(query: str) -> str:
+    """缓存键：全角转半角、转小写、合并空白"""
+    return " ".join(unicodedata.normalize("NFKC", query).lower().split())
+
+
+class QueryEmbeddingCache:
+    """查询文本 → 向量的缓存：内存 LRU + 可选的磁盘 SQLite 表，均带 TTL 和条目上限
+
+    磁盘层在多个 worker、重启之间共享，预热结果也写在这里。
+    """
+
+    _PRUNE_EVERY = 100  # 每写入多少条清理一次磁盘上过期/超额的条目
+
+    def __init__(
+        self,
+        maxsize: int = QUERY_CACHE_SIZE,
+        ttl: float = QUERY_CACHE_TTL,
+        db_path: str = QUERY_CACHE_DB,
+        disk_max: int = QUERY_CACHE_DISK_MAX,
+        model: str = EMBEDDING_MODEL,
+    ):
+        self.ttl = ttl
+        self.model = model
+        self.disk_max = disk_max
+        self._memory = LRUCache(maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._writes = 0
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self.provider_calls = 0
+        if db_path:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    model TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (model, query)
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_query_embeddings_created ON query_embeddings(created_at)"
+            )
+            self._conn.commit()
+
+    def get(self, query: str) -> np.ndarray | None:
+        key = normalize_query(query)
+        vector = self._memory.get(key)
+        if vector is not None or self._conn is None:
+            return vector
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector, created_at FROM query_embeddings WHERE model = ? AND query = ?",
+                (self.model, key),
+            ).fetchone()
+            remaining = row[1] + self.ttl - time.time() if row else 0
+            if remaining <= 0:
+                self.disk_misses += 1
+                return None
+            self.disk_hits += 1
+        vector = np.frombuffer(row[0], dtype=np.float32)
+        self._memory.set(key, vector, ttl=remaining)
+        return vector
+
+    def set(self, query: str, vector) -> np.ndarray:
+        key = normalize_query(query)
+        vector = np.asarray(vector, dtype=np.float32)
+        vector.setflags(write=False)  # 缓存共享同一数组，禁止调用方原地修改
+        self._memory.set(key, vector)
+        if self._conn is not None:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (model, query, vector, created_at) VALUES (?, ?, ?, ?)",
+                    (self.model, key, vector.tobytes(), time.time()),
+                )
+                self._writes += 1
+                if self._writes % self._PRUNE_EVERY == 0:
+                    self._prune()
+                self._conn.commit()
+        return vector
+
+    def _prune(self):
+        """删除过期条目，并把磁盘条目数压到 disk_max 以内（先删最旧的）"""
+        self._conn.execute("DELETE FROM query_embeddings WHERE created_at < ?", (time.time() - self.ttl,))
+        excess = self._conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0] - self.disk_max
+        if excess > 0:
+            self._conn.execute(
+                """DELETE FROM query_embeddings WHERE (model, query) IN (
+                       SELECT model, query FROM query_embeddings ORDER BY created_at LIMIT ?
+                   )""",
+                (excess,),
+            )
+
+    def stats(self) -> dict:
+        memory = self._memory.stats()
+        lookups = memory["hits"] + memory["misses"]
+        hits = memory["hits"] + self.disk_hits
+        return {
+            "memory": memory,
+            "disk_enabled": self._conn is not None,
+            "disk_hits": self.disk_hits,
+            "disk_misses": self.disk_misses,
+            "provider_calls": self.provider_calls,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_query_cache = QueryEmbeddingCache()
+
+
+def get_query_cache_stats() -> dict:
+    """查询向量缓存的命中率等统计"""
+    return _query_cache.stats()
+
+
+def _create_embeddings(texts: list[str], api_key: str) -> list[list[float]]:
+    _query_cache.provider_calls += 1
+    resp = _get_client(api_key).embeddings.create(model=EMBEDDING_MODEL, input=texts)
+    return [item.embedding for item in resp.data]
+
+
+def embed_query(query: str, api_key: str) -> np.ndarray:
+    """生成查询文本的 embedding；命中缓存时不调用 OpenAI
+
+    用归一化后的文本生成向量，保证同一缓存键无论谁先请求都对应同一个向量。
+    """
+    query = normalize_query(query)
+    vector = _query_cache.get(query)
+    if vector is None:
+        vector = _query_cache.set(query, _create_embeddings([query], api_key)[0])
+    return vector
+
+
+def warm_query_cache(queries: list[str], api_key: str, batch_size: int = 100) -> int:
+    """用热门查询预热缓存，只为未缓存的查询批量调用 OpenAI，返回新生成的数量"""
+    pending = list(dict.fromkeys(
+        q for q in (normalize_query(q) for q in queries) if q and _query_cache.get(q) is None
+    ))
+    for i in range(0, len(pending), batch_size):
+        batch = pending[i:i + batch_size]
+        for query, vector in zip(batch, _create_embeddings(batch, api_key)):
+            _query_cache.set(query, vector)
+    return len(pending)
+
+
+# ── 二进制 embedding 存储 ──────────────────────────────────────
+EMBEDDINGS_BASE = EMBEDDINGS_FILE.with_suffix("")  # data/embeddings
+COMPACT_RATIO = float(os.getenv("EMBEDDINGS_COMPACT_RATIO", "0.25"))  # 墓碑行占比超过该值时后台压缩
+
+logger = logging.getLogger("agentstore.embeddings")
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0  # 全零向量保持为零，相似度恒为 0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+
+def _file_signature(path: Path) -> tuple[int, int] | None:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _atomic_write(path: Path, data: bytes):
+    """写到同目录下的唯一临时文件再原子替换，多个进程同时写也不会互相覆盖半成品"""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+class EmbeddingStore:
+    """embedding 的二进制存储：只追加的 float32 原始矩阵 + slug 索引文件
+
+    - <base>.<generation>.f32：行优先的 float32 矩阵，写入前已归一化，读取时只读 mmap，
+      多个 worker 通过页缓存共享同一份内存，加载几乎不耗时
+    - <base>.idx.json：{"dim", "data_file", "slugs"}，slugs[i] 是第 i 行的 slug，删除的行为 null（墓碑）
+    - 新增/更新只向矩阵末尾追加行，再原子替换索引文件；读者看到的索引只引用已写完的行
+    - 墓碑行过多时压缩：写出新一代矩阵文件，再原子切换索引文件，旧文件最后删除
+    - 只有旧的 <base>.json 时迁移（update_embeddings.py 和服务启动预热时执行，跨进程用文件锁互斥）；
+      数据目录只读等原因迁移失败时，读取退回到在内存中解析旧文件
+    """
+
+    def __init__(self, base: Path = EMBEDDINGS_BASE):
+        self.base = Path(base)
+        self.meta_path = self.base.with_name(self.base.name + ".idx.json")
+        self.legacy_path = self.base.with_name(self.base.name + ".json")
+        self.lock_path = self.base.with_name(self.base.name + ".lock")
+        self._lock = threading.RLock()  # 可重入：写入方法持锁时 _read_meta 可能触发迁移，迁移也要持锁
+        self._compaction: threading.Thread | None = None
+        self._legacy: tuple[tuple[int, int] | None, dict] | None = None  # (旧文件签名, 内存中的 meta)
+
+    # ── 读取 ──
+    def _read_meta(self, for_write: bool = False) -> dict | None:
+        if not self.meta_path.exists():
+            if not self.legacy_path.exists():
+                return None
+            try:
+                self.migrate_from_json()
+            except OSError as e:
+                if for_write:
+                    raise
+                return self._legacy_meta(e)
+        return json.loads(self.meta_path.read_text())
+
+    def _legacy_meta(self, error: OSError) -> dict:
+        """迁移失败时直接在内存中使用旧 JSON（按文件签名缓存，旧文件变化后重新解析）"""
+        signature = _file_signature(self.legacy_path)
+        with self._lock:
+            if self._legacy is None or self._legacy[0] != signature:
+                logger.warning("无法迁移 %s（%s），改为在内存中读取旧格式", self.legacy_path, error)
+                data = json.loads(self.legacy_path.read_text())
+                matrix = _normalize_rows(_rows(data.values()))
+                meta = {"dim": matrix.shape[1], "data_file": None, "slugs": list(data), "matrix": matrix}
+                self._legacy = (signature, meta)
+            return self._legacy[1]
+
+    def read(self) -> tuple[list[str | None], np.ndarray]:
+        """返回 (slugs, 只读 mmap 矩阵)；slugs 中 None 表示已删除的行"""
+        meta = self._read_meta()
+        if meta is None or not meta["slugs"]:
+            return [], np.zeros((0, meta["dim"] if meta else 0), dtype=np.float32)
+        if "matrix" in meta:
+            return meta["slugs"], meta["matrix"]
+        matrix = np.memmap(
+            self.base.parent / meta["data_file"], dtype=np.float32, mode="r",
+            shape=(len(meta["slugs"]), meta["dim"]),
+        )
+        return meta["slugs"], matrix
+
+    def live_slugs(self) -> set[str]:
+        meta = self._read_meta()
+        return {slug for slug in meta["slugs"] if slug is not None} if meta else set()
+
+    def signature(self) -> tuple[int, int] | None:
+        """索引文件的 (mtime, 大小)；尚未迁移时用旧 JSON 的，迁移完成后签名变化，读者会重新加载"""
+        return _file_signature(self.meta_path) or _file_signature(self.legacy_path)
+
+    # ── 写入 ──
+    def _write_meta(self, dim: int, data_file: str, slugs: list[str | None]):
+        meta = {"dim": dim, "data_file": data_file, "slugs": slugs}
+        _atomic_write(self.meta_path, json.dumps(meta, ensure_ascii=False).encode())
+
+    def _new_data_file(self, meta: dict | None) -> str:
+        generation = int(meta["data_file"].rsplit(".", 2)[-2]) + 1 if meta else 1
+        return f"{self.base.name}.{generation}.f32"
+
+    def rewrite(self, embeddings: dict[str, list[float]]):
+        """整体替换为给定的 embedding（全量重建）"""
+        with self._lock:
+            meta = self._read_meta() if self.meta_path.exists() else None
+            self._replace(meta, list(embeddings), _rows(embeddings.values()))
+
+    def _replace(self, old_meta: dict | None, slugs: list[str], matrix: np.ndarray):
+        data_file = self._new_data_file(old_meta)
+        _atomic_write(self.base.parent / data_file, _normalize_rows(matrix).tobytes())
+        self._write_meta(matrix.shape[1] if matrix.size else (old_meta or {}).get("dim", 0), data_file, slugs)
+        if old_meta and old_meta["data_file"] != data_file:
+            # 已 mmap 旧文件的读者不受影响（文件在最后一个映射关闭后才真正释放）
+            (self.base.parent / old_meta["data_file"]).unlink(missing_ok=True)
+
+    def upsert(self, embeddings: dict[str, list[float]]):
+        """追加新行；已存在的 slug 旧行标记为墓碑"""
+        if not embeddings:
+            return
+        with self._lock:
+            meta = self._read_meta(for_write=True)
+            if meta is None or not meta["slugs"]:
+                self._replace(meta, list(embeddings), _rows(embeddings.values()))
+                return
+            matrix = _normalize_rows(_rows(embeddings.values()))
+            if matrix.shape[1] != meta["dim"]:
+                raise ValueError(f"embedding 维度不一致: {matrix.shape[1]} != {meta['dim']}")
+            data_path = self.base.parent / meta["data_file"]
+            with open(data_path, "r+b") as f:
+                # 截掉上次中断写入留下的残余字节，保证新行紧接在已登记的行之后
+                f.truncate(len(meta["slugs"]) * meta["dim"] * 4)
+                f.seek(0, os.SEEK_END)
+                f.write(matrix.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            updated = set(embeddings)
+            slugs = [None if slug in updated else slug for slug in meta["slugs"]] + list(embeddings)
+            self._write_meta(meta["dim"], meta["data_file"], slugs)
+        self._maybe_compact(slugs)
+
+    def delete(self, slugs) -> int:
+        """把给定 slug 的行标记为墓碑，返回实际删除的数量"""
+        targets = set(slugs)
+        with self._lock:
+            meta = self._read_meta(for_write=True)
+            if meta is None:
+                return 0
+            removed = sum(1 for slug in meta["slugs"] if slug in targets)
+            if removed:
+                remaining = [None if slug in targets else slug for slug in meta["slugs"]]
+                self._write_meta(meta["dim"], meta["data_file"], remaining)
+        if removed:
+            self._maybe_compact(remaining)
+        return removed
+
+    def _maybe_compact(self, slugs: list[str | None]):
+        dead = sum(1 for slug in slugs if slug is None)
+        if dead and dead / len(slugs) > COMPACT_RATIO:
+            if self._compaction is None or not self._compaction.is_alive():
+                self._compaction = threading.Thread(
+                    target=self.compact, name="agentstore-embeddings-compact", daemon=True
+                )
+                self._compaction.start()
+
+    def compact(self):
+        """去掉墓碑行，写出新一代矩阵文件"""
+        with self._lock:
+            meta = self._read_meta(for_write=True)
+            if meta is None or None not in meta["slugs"]:
+                return
+            slugs, matrix = self.read()
+            live = [i for i, slug in enumerate(slugs) if slug is not None]
+            self._replace(meta, [slugs[i] for i in live], np.asarray(matrix[live], dtype=np.float32))
+
+    def wait(self):
+        """等待后台压缩结束（脚本退出前调用）"""
+        if self._compaction is not None:
+            self._compaction.join()
+
+    def migrate_from_json(self) -> bool:
+        """从旧的 embeddings.json 迁移，返回是否执行了迁移；旧文件保留不动
+
+        线程锁之外再持有 <base>.lock 的 flock，多个 worker 同时启动时只有一个真正迁移，
+        其余拿到锁后发现索引文件已存在直接返回。
+        """
+        with self._lock:
+            if self.meta_path.exists() or not self.legacy_path.exists():
+                return False
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    if self.meta_path.exists():
+                        return False
+                    data = json.loads(self.legacy_path.read_text())
+                    self._replace(None, list(data), _rows(data.values()))
+                    return True
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _rows(vectors) -> np.ndarray:
+    vectors = list(vectors)
+    if not vectors:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+
+
+# IVF-flat 近似索引：与 embedding 存储放在一起，由 update_embeddings.py 构建
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))  # 近似查询时探查的聚类数，越大召回越高、越慢
+SEARCH_MODES = ("exact", "approx")
+
+
+def _slugs_digest(slugs: list[str | None]) -> str:
+    return hashlib.sha256("\n".join(slug or "" for slug in slugs).encode()).hexdigest()
+
+
+def _assign(matrix: np.ndarray, centroids: np.ndarray, chunk: int = 8192) -> np.ndarray:
+    """每行分配到最相似的聚类中心（分块计算，避免 n×nlist 的大矩阵）"""
+    return np.concatenate([
+        np.argmax(matrix[i:i + chunk] @ centroids.T, axis=1)
+        for i in range(0, len(matrix), chunk)
+    ]) if len(matrix) else np.zeros(0, dtype=np.int64)
+
+
+def build_ivf(matrix: np.ndarray, n_lists: int | None = None, iters: int = 10, seed: int = 0) -> dict:
+    """球面 k-means 聚类，返回 {"centroids", "order", "offsets"}
+
+    order 把行按聚类排列，第 c 个聚类的行号是 order[offsets[c]:offsets[c + 1]]。
+    """
+    n = len(matrix)
+    n_lists = max(1, min(n_lists or int(np.sqrt(n)), n))
+    rng = np.random.default_rng(seed)
+    centroids = np.array(matrix[rng.choice(n, n_lists, replace=False)], dtype=np.float32)
+    for _ in range(iters):
+        assign = _assign(matrix, centroids)
+        counts = np.bincount(assign, minlength=n_lists)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, matrix)
+        empty = counts == 0
+        sums[empty] = matrix[rng.choice(n, int(empty.sum()))]  # 空聚类重新随机取点
+        centroids = _normalize_rows(sums)
+    assign = _assign(matrix, centroids)
+    order = np.argsort(assign, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_lists))])
+    return {"centroids": centroids, "order": order.astype(np.int64), "offsets": offsets.astype(np.int64)}
+
+
+def build_ivf_index(store: EmbeddingStore | None = None, n_lists: int | None = None) -> Path:
+    """为存储中的有效行构建 IVF 索引，原子地写到 <base>.ivf.npz"""
+    store = store or EmbeddingStore()
+    slugs, matrix = store.read()
+    live = np.array([i for i, slug in enumerate(slugs) if slug is not None], dtype=np.int64)
+    ivf = build_ivf(np.asarray(matrix[live], dtype=np.float32), n_lists=n_lists)
+    ivf["order"] = live[ivf["order"]]  # 局部序号换成存储中的行号
+    index_file = _ivf_path(store)
+    buf = io.BytesIO()
+    np.savez(buf, slugs_digest=np.array(_slugs_digest(slugs)), **ivf)
+    _atomic_write(index_file, buf.getvalue())
+    return index_file
+
+
+def _ivf_path(store: EmbeddingStore) -> Path:
+    return store.base.with_name(store.base.name + ".ivf.npz")
+
+
+class EmbeddingIndex:
+    """常驻内存的 embedding 索引
+
+    - 矩阵直接 mmap 存储文件（行已归一化），余弦相似度就是一次矩阵-向量乘
+    - top-k 用 argpartition 选出后只对 k 个结果排序
+    - 存在与当前存储匹配的 IVF 索引时，mode="approx" 只计算最近的 nprobe 个聚类
+    - 每次查询检查索引文件 mtime/大小，存储或 IVF 索引被更新后自动重新加载
+    """
+
+    def __init__(self, store: EmbeddingStore | None = None):
+        self.store = store or EmbeddingStore()
+        self.index_path = _ivf_path(self.store)
+        self._lock = threading.Lock()
+        self._signature: tuple | None = None
+        self.slugs: list[str | None] = []
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.dead = np.zeros(0, dtype=np.int64)  # 墓碑行号，精确查询时排除
+        self.ivf: dict | None = None
+
+    def __len__(self) -> int:
+        return len(self.slugs) - len(self.dead)
+
+    def _load(self, signature: tuple):
+        slugs, matrix = self.store.read()
+        ivf = None
+        if signature[1] is not None:
+            with np.load(self.index_path) as data:
+                if str(data["slugs_digest"]) == _slugs_digest(slugs):
+                    ivf = {"centroids": data["centroids"], "order": data["order"], "offsets": data["offsets"]}
+        dead = np.array([i for i, slug in enumerate(slugs) if slug is None], dtype=np.int64)
+        # 一次性替换，查询线程拿到的始终是一致的一组数据
+        self.slugs, self.matrix, self.dead, self.ivf = slugs, matrix, dead, ivf
+        self._signature = signature
+
+    def refresh(self):
+        """文件有变化时重新加载"""
+        signature = (self.store.signature(), _file_signature(self.index_path))
+        if signature == self._signature and signature[0] is not None:
+            return
+        with self._lock:
+            if signature != self._signature or signature[0] is None:
+                try:
+                    self._load(signature)
+                except (OSError, KeyError, ValueError):
+                    pass  # 文件正在被写入，沿用旧索引，下次查询再试
+
+    def warm(self) -> int:
+        """加载索引并把向量矩阵的所有页读入内存（mmap 首次访问会缺页），返回有效条目数"""
+        self.refresh()
+        if self.matrix.size:
+            float(np.asarray(self.matrix).sum())
+        return len(self)
+
+    def search(
+        self, query_emb, top_k: int = 10, mode: str = "exact", nprobe: int | None = None
+    ) -> list[tuple[str, float]]:
+        """返回与 query_emb 余弦相似度最高的 [(slug, similarity_score), ...]
+
+        mode="approx" 且有 IVF 索引时只在最近的 nprobe 个聚类中查找；没有索引时退回精确查询。
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"非法的 mode: {mode}")
+        self.refresh()
+        slugs, matrix, dead, ivf = self.slugs, self.matrix, self.dead, self.ivf
+        if len(slugs) == len(dead):
+            return []
+        query = np.asarray(query_emb, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+        if mode == "approx" and ivf is not None:
+            centroids, order, offsets = ivf["centroids"], ivf["order"], ivf["offsets"]
+            nprobe = max(1, min(nprobe or ANN_NPROBE, len(centroids)))
+            probe = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+            rows = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probe])
+            scores = np.asarray(matrix[rows] @ query)
+        else:
+            rows = None
+            scores = np.asarray(matrix @ query)
+            scores[dead] = -np.inf
+        k = min(top_k, len(scores) if rows is not None else len(slugs) - len(dead))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        if rows is not None:
+            return [(slugs[rows[i]], float(scores[i])) for i in top]
+        return [(slugs[i], float(scores[i])) for i in top]
+
+
+def benchmark_ann(
+    index: "EmbeddingIndex", k: int = 10, n_queries: int = 100, nprobe: int | None = None, seed: int = 0
+) -> dict:
+    """以精确查询为基准，评估近似查询的 recall@k 和平均延迟
+
+    查询向量取库内随机向量加噪声，模拟与库内条目相近但不完全相同的真实查询。
+    """
+    index.refresh()
+    if not len(index) or index.ivf is None:
+        return {}
+    rng = np.random.default_rng(seed)
+    live = index.ivf["order"]  # IVF 覆盖全部有效行
+    picks = rng.choice(live, min(n_queries, len(live)), replace=False)
+    queries = index.matrix[picks] + rng.normal(scale=0.05, size=(len(picks), index.matrix.shape[1]))
+    recall, exact_s, approx_s = 0.0, 0.0, 0.0
+    for query in queries:
+        start = time.perf_counter()
+        exact = index.search(query, top_k=k)
+        exact_s += time.perf_counter() - start
+        start = time.perf_counter()
+        approx = index.search(query, top_k=k, mode="approx", nprobe=nprobe)
+        approx_s += time.perf_counter() - start
+        recall += len({s for s, _ in exact} & {s for s, _ in approx}) / max(len(exact), 1)
+    n = len(queries)
+    return {
+        "size": len(index),
+        "lists": len(index.ivf["centroids"]),
+        "nprobe": max(1, min(nprobe or ANN_NPROBE, len(index.ivf["centroids"]))),
+        f"recall@{k}": round(recall / n, 4),
+        "exact_ms": round(exact_s / n * 1000, 3),
+        "approx_ms": round(approx_s / n * 1000, 3),
+    }
+
+
+_index = EmbeddingIndex()
+
+
+def get_index() -> EmbeddingIndex:
+    """进程内共享的 embedding 索引"""
+    return _index
+
+
+def rank_similar(query_emb: np.ndarray, top_k: int = 10, mode: str = "exact") -> list[tuple[str, float]]:
+    """用已有 embedding 计算余弦相似度，返回 [(slug, similarity_score), ...]"""
+    return _index.search(query_emb, top_k=top_k, mode=mode)
+
+
 def search_similar(query: str, api_key: str, top_k: int = 10) -> list[tuple[str, float]]:
     """语义搜索：返回 [(slug, similarity_score), ...]"""
-    client = OpenAI(api_key=api_key)
-
-    # 生成 query embedding
-    resp = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=[query]
-    )
-    query_emb = np.array(resp.data[0].embedding)
-
-    # 加载已有 embedding
-    emb_file = Path(__file__).parent.parent / "data" / "embeddings.json"
-    if not emb_file.exists():
-        return []
-    all_embs = json.loads(emb_file.read_text())
-
-    # 计算余弦相似度
-    results = []
-    for slug, emb in all_embs.items():
-        emb_arr = np.array(emb)
-        sim = np.dot(query_emb, emb_arr) / (np.linalg.norm(query_emb) * np.linalg.norm(emb_arr))
-        results.append((slug, float(sim)))
-
-    results.sort(key=lambda x: x[1], reverse=True)
-    return results[:top_k]
+    return rank_similar(embed_query(query, api_key), top_k=top_k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AgentStore 查询向量缓存预热")
+    parser.add_argument("--warm", required=True, help="热门查询文件，每行一个查询")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    api_key = os.getenv("OPENAI_API_KEY", "")
+    if not api_key:
+        print("错误：未设置 OPENAI_API_KEY")
+        return
+    if _query_cache._conn is None:
+        print("提示：未配置 QUERY_EMBEDDING_CACHE_DB，预热结果只在本进程内有效")
+    queries = Path(args.warm).read_text(encoding="utf-8").splitlines()
+    print(f"完成！新生成 {warm_query_cache(queries, api_key)} 个查询向量")
+
+
+if __name__ == "__main__":
+    main()
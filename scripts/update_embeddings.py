@@ -1,6 +1,6 @@
 """增量更新 embedding
 
-只为新增的插件生成 embedding，合并到现有 embeddings.json。
+只为新增的插件生成 embedding，追加到二进制 embedding 存储（data/embeddings.*）。
 避免每次都为全部插件重新生成，节省 API 调用开销。
 """
 import argparse
@@ -17,17 +17,6 @@ load_dotenv()
 ROOT_DIR = Path(__file__).parent.parent
 DATA_DIR = ROOT_DIR / "data"
 CAPABILITIES_FILE = DATA_DIR / "capabilities.json"
-EMBEDDINGS_FILE = DATA_DIR / "embeddings.json"
-
-
-def _load_existing_embeddings() -> dict:
-    """读取现有 embeddings.json"""
-    if not EMBEDDINGS_FILE.exists():
-        return {}
-    try:
-        return json.loads(EMBEDDINGS_FILE.read_text())
-    except (json.JSONDecodeError, TypeError):
-        return {}
 
 
 def _load_capabilities() -> list[dict]:
@@ -42,6 +31,7 @@ def update_embeddings(
     force: bool = False,
     api_key: str | None = None,
     batch_size: int = 50,
+    n_lists: int | None = None,
 ):
     """增量更新 embedding
 
@@ -49,6 +39,7 @@ def update_embeddings(
         force: 强制为所有插件重新生成 embedding
         api_key: OpenAI API Key（默认从环境变量读取）
         batch_size: 每批处理的插件数量
+        n_lists: IVF 索引的聚类数（默认 sqrt(条目数)）
     """
     api_key = api_key or os.getenv("OPENAI_API_KEY", "")
     if not api_key:
@@ -62,8 +53,12 @@ def update_embeddings(
     if not capabilities:
         return
 
-    existing_embeddings = {} if force else _load_existing_embeddings()
-    existing_slugs = set(existing_embeddings.keys())
+    from scripts.embeddings import EmbeddingStore
+
+    store = EmbeddingStore()
+    if store.migrate_from_json():
+        print(f"已将 {store.legacy_path.name} 迁移为二进制 embedding 存储")
+    existing_slugs = set() if force else store.live_slugs()
 
     # 找出需要生成 embedding 的插件
     new_items = [
@@ -73,11 +68,11 @@ def update_embeddings(
 
     if not new_items:
         print("没有新插件需要生成 embedding。")
-        print(f"  当前 embedding 数量: {len(existing_embeddings)}")
+        print(f"  当前 embedding 数量: {len(existing_slugs)}")
         print(f"  当前插件数量: {len(capabilities)}")
         return
 
-    print(f"需要生成 embedding: {len(new_items)} 个（已有 {len(existing_embeddings)} 个）")
+    print(f"需要生成 embedding: {len(new_items)} 个（已有 {len(existing_slugs)} 个）")
 
     # 批量生成 embedding
     new_embeddings = {}
@@ -101,20 +96,39 @@ def update_embeddings(
             for item in batch:
                 print(f"    跳过: {item['slug']}")
 
-    # 合并到现有 embedding
-    merged = {**existing_embeddings, **new_embeddings}
+    # 保存：force 时整体重写，否则只追加新行
+    if force:
+        store.rewrite(new_embeddings)
+    else:
+        store.upsert(new_embeddings)
 
-    # 清理不再存在的 slug（capabilities 中已删除的插件）
+    # 清理不再存在的 slug（capabilities 中已删除的插件），墓碑过多时后台压缩
     current_slugs = {item["slug"] for item in capabilities if "slug" in item}
-    stale_slugs = set(merged.keys()) - current_slugs
+    stale_slugs = store.live_slugs() - current_slugs
     if stale_slugs:
-        print(f"  清理 {len(stale_slugs)} 个已删除插件的 embedding")
-        for slug in stale_slugs:
-            del merged[slug]
+        print(f"  清理 {store.delete(stale_slugs)} 个已删除插件的 embedding")
+    store.wait()
+
+    print(f"完成！embedding 总数: {len(store.live_slugs())}（新增 {len(new_embeddings)} 个）")
+    rebuild_index(n_lists)
 
-    # 保存
-    EMBEDDINGS_FILE.write_text(json.dumps(merged))
-    print(f"完成！embedding 总数: {len(merged)}（新增 {len(new_embeddings)} 个）")
+
+def rebuild_index(n_lists: int | None = None):
+    """重建近似查询用的 IVF 索引，并以精确查询为基准报告 recall@k 和延迟"""
+    from scripts.embeddings import EmbeddingIndex, EmbeddingStore, benchmark_ann, build_ivf_index
+
+    store = EmbeddingStore()
+    if not store.live_slugs():
+        print("错误：embedding 存储为空，请先生成 embedding")
+        return
+    index_file = build_ivf_index(store, n_lists=n_lists)
+    report = benchmark_ann(EmbeddingIndex(store))
+    print(f"IVF 索引已保存到 {index_file}")
+    if report:
+        print(
+            f"  {report['size']} 条 / {report['lists']} 个聚类 / nprobe={report['nprobe']}："
+            f"recall@10={report['recall@10']}，精确 {report['exact_ms']}ms，近似 {report['approx_ms']}ms"
+        )
 
 
 def main():
@@ -130,11 +144,26 @@ def main():
         default=50,
         help="每批处理的插件数量（默认 50）",
     )
+    parser.add_argument(
+        "--nlist",
+        type=int,
+        default=None,
+        help="IVF 近似索引的聚类数（默认 sqrt(条目数)）",
+    )
+    parser.add_argument(
+        "--index-only",
+        action="store_true",
+        help="不生成 embedding，只用现有 embedding 存储重建 IVF 索引",
+    )
     args = parser.parse_args()
 
+    if args.index_only:
+        rebuild_index(args.nlist)
+        return
     update_embeddings(
         force=args.force,
         batch_size=args.batch_size,
+        n_lists=args.nlist,
     )
 
 
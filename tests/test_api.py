@@ -1,4 +1,9 @@
 """API 端点测试"""
+import json
+import os
+import subprocess
+import sys
+
 import pytest
 from fastapi.testclient import TestClient
 
@@ -89,3 +94,565 @@ class TestRankings:
         assert resp.status_code == 200
         results = resp.json()["results"]
         assert results[0]["overall_score"] >= results[1]["overall_score"]
+
+
+class TestCursorPagination:
+    def test_search_next_cursor(self, client):
+        first = client.get("/api/v1/search", params={"per_page": 1}).json()
+        assert first["next_cursor"]
+        second = client.get("/api/v1/search", params={"per_page": 1, "cursor": first["next_cursor"]}).json()
+        assert second["results"][0]["slug"] != first["results"][0]["slug"]
+        assert second["next_cursor"] is None
+
+    def test_invalid_cursor(self, client):
+        resp = client.get("/api/v1/rankings", params={"cursor": "garbage"})
+        assert resp.status_code == 400
+
+
+class TestSearchTotalMode:
+    def test_total_none(self, client):
+        data = client.get("/api/v1/search", params={"total": "none"}).json()
+        assert data["total"] is None and data["total_pages"] is None
+        assert len(data["results"]) == 2
+
+    def test_total_invalid(self, client):
+        assert client.get("/api/v1/search", params={"total": "fuzzy"}).status_code == 422
+
+
+class TestQueryPlans:
+    """跑一遍所有读写接口，记录实际执行的 SQL，用 EXPLAIN QUERY PLAN 确认没有全表扫描"""
+
+    def _trace_queries(self, monkeypatch):
+        import api.database as db_mod
+        statements = []
+        original_connect = db_mod.ConnectionPool._connect
+
+        def traced_connect(pool):
+            conn = original_connect(pool)
+            conn.set_trace_callback(statements.append)
+            return conn
+
+        db_mod.close_pools()
+        monkeypatch.setattr(db_mod.ConnectionPool, "_connect", traced_connect)
+        return statements
+
+    def _exercise_endpoints(self, client):
+        import api.database as db_mod
+        from api.users import _create_token
+        conn = db_mod._get_conn()
+        user_id = conn.execute(
+            "INSERT INTO users (username, password_hash) VALUES ('planner', 'x')"
+        ).lastrowid
+        conn.commit()
+        conn.close()
+        auth = {"Authorization": f"Bearer {_create_token(user_id, 'planner')}"}
+
+        for sort in ("overall_score", "stars", "last_updated", "name", "created_at"):
+            first = client.get("/api/v1/search", params={"sort": sort, "per_page": 1}).json()
+            client.get("/api/v1/search", params={"sort": sort, "per_page": 1, "cursor": first["next_cursor"]})
+            client.get("/api/v1/rankings", params={"category": "trading", "sort": sort, "order": "asc"})
+        client.get("/api/v1/search", params={"q": "trading", "sort": "relevance"})
+        client.get("/api/v1/search", params={"q": "trading", "category": "trading"})
+        for name, value in (("language", "Python"), ("protocol", "mcp"), ("source", "openclaw")):
+            client.get("/api/v1/search", params={name: value, "facets": "true"})
+        client.get("/api/v1/search", params={"facets": "true"})
+        client.get("/api/v1/capabilities/test-1")
+        client.get("/api/v1/capabilities/test-1/scores")
+        client.post("/api/v1/capabilities:batch", json={"slugs": ["test-2", "test-1", "nope"]})
+        client.get("/api/v1/categories")
+        client.get("/api/v1/stats")
+
+        client.post("/api/v1/favorites/test-1", headers=auth)
+        client.get("/api/v1/favorites", headers=auth)
+        comment = client.post("/api/v1/comments/test-1", json={"content": "nice", "rating": 5}, headers=auth).json()
+        client.post("/api/v1/comments/test-1", json={"content": "again", "rating": 4}, headers=auth)
+        client.get("/api/v1/comments/test-1")
+        client.post(f"/api/v1/comments/{comment['id']}/like", headers=auth)
+        client.post("/api/v1/submissions", headers=auth, json={
+            "name": "Tool", "repo_url": "https://github.com/a/b",
+            "description": "a useful tool", "category": "coding",
+        })
+        client.get("/api/v1/submissions")
+        client.get("/api/v1/submissions", params={"status": "pending"})
+        key = client.post("/api/v1/api-keys", json={"name": "ci"}, headers=auth).json()
+        client.get("/api/v1/api-keys", headers=auth)
+        client.get("/api/v1/search", headers={"X-API-Key": key["key"]})
+        client.get(f"/api/v1/api-keys/{key['id']}/usage", headers=auth)
+        client.get("/api/v1/users/me", headers=auth)
+        client.get("/api/v1/users/planner/profile")
+        client.delete(f"/api/v1/api-keys/{key['id']}", headers=auth)
+
+    def test_no_full_table_scans(self, client, monkeypatch):
+        import re
+        import api.database as db_mod
+        statements = self._trace_queries(monkeypatch)
+        self._exercise_endpoints(client)
+
+        checked = 0
+        conn = db_mod._get_conn()
+        try:
+            for sql in set(statements):
+                head = sql.lstrip().split(None, 1)[0].upper()
+                if head not in ("SELECT", "UPDATE", "DELETE", "INSERT"):
+                    continue
+                plan = [r["detail"] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+                full_scans = [d for d in plan if re.fullmatch(r"SCAN \w+", d)]
+                assert not full_scans, f"全表扫描: {sql}\n{plan}"
+                checked += 1
+        finally:
+            conn.close()
+        assert checked > 30
+
+    def test_filters_and_facets_use_indexes(self, client, monkeypatch):
+        import api.database as db_mod
+        statements = self._trace_queries(monkeypatch)
+        for name, value in (("language", "Python"), ("protocol", "mcp"), ("source", "openclaw")):
+            client.get("/api/v1/search", params={name: value, "facets": "true", "per_page": 1})
+        client.get("/api/v1/search", params={"facets": "true"})
+
+        with db_mod._get_conn() as conn:
+            def plan(fragment):
+                sql = next(s for s in statements if fragment in s and s.lstrip().startswith("SELECT"))
+                return " ".join(r["detail"] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall())
+
+            for name in ("language", "protocol", "source"):
+                assert f"idx_capabilities_{name}_overall_score_slug ({name}=?)" in plan(f"WHERE c.{name} = ")
+            assert "COVERING INDEX idx_capabilities_facets" in plan("capabilities c  GROUP BY")
+
+
+class TestOverload:
+    def test_pool_timeout_maps_to_503(self, client, monkeypatch):
+        import api.main as main_mod
+
+        def exhausted():
+            raise main_mod.PoolTimeout("数据库连接池耗尽")
+
+        monkeypatch.setattr(main_mod, "get_categories", exhausted)
+        resp = client.get("/api/v1/categories")
+        assert resp.status_code == 503
+        assert resp.json()["detail"] == "服务繁忙，请稍后重试"
+
+
+class TestApiKeyRateLimit:
+    def test_daily_limit_enforced(self, client):
+        import hashlib
+        import api.database as db_mod
+        raw_key = "ask_" + "0" * 32
+        conn = db_mod._get_conn()
+        user_id = conn.execute("INSERT INTO users (username, password_hash) VALUES ('k', 'x')").lastrowid
+        conn.execute(
+            "INSERT INTO api_keys (user_id, key_prefix, key_hash, daily_limit) VALUES (?, ?, ?, 2)",
+            (user_id, raw_key[:8], hashlib.sha256(raw_key.encode()).hexdigest()),
+        )
+        conn.commit()
+        conn.close()
+        headers = {"X-API-Key": raw_key}
+        assert client.get("/api/v1/categories", headers=headers).status_code == 200
+        assert client.get("/api/v1/categories", headers=headers).status_code == 200
+        assert client.get("/api/v1/categories", headers=headers).status_code == 429
+
+
+class TestAuthCache:
+    def _login(self, client):
+        import api.database as db_mod
+        from api.users import _create_token
+        conn = db_mod._get_conn()
+        user_id = conn.execute("INSERT INTO users (username, password_hash) VALUES ('c', 'x')").lastrowid
+        conn.commit()
+        conn.close()
+        return {"Authorization": f"Bearer {_create_token(user_id, 'c')}"}
+
+    def test_token_claims_cached(self, client):
+        headers = self._login(client)
+        before = client.get("/metrics").json()["token_cache"]["hits"]
+        assert client.get("/api/v1/users/me", headers=headers).status_code == 200
+        assert client.get("/api/v1/users/me", headers=headers).status_code == 200
+        assert client.get("/metrics").json()["token_cache"]["hits"] >= before + 1
+        bad = {"Authorization": "Bearer not-a-token"}
+        assert client.get("/api/v1/users/me", headers=bad).status_code == 401
+
+    def test_revoked_key_invalidated_immediately(self, client):
+        from api.main import _resolve_api_key
+        headers = self._login(client)
+        created = client.post("/api/v1/api-keys", json={"name": "k"}, headers=headers).json()
+        raw_key = created["key"]
+        assert _resolve_api_key(raw_key)["id"] == created["id"]
+        before = client.get("/metrics").json()["api_key_cache"]["hits"]
+        assert _resolve_api_key(raw_key)["id"] == created["id"]
+        assert client.get("/metrics").json()["api_key_cache"]["hits"] == before + 1
+        assert client.delete(f"/api/v1/api-keys/{created['id']}", headers=headers).status_code == 200
+        assert _resolve_api_key(raw_key) is None
+
+
+class TestPreEncodedResponses:
+    def test_matches_response_model_serialization(self, client):
+        from api.database import get_capability
+        from api.schemas import CapabilityItem, SearchResponse
+        expected = CapabilityItem.model_validate(get_capability("test-1")).model_dump(mode="json")
+        detail = client.get("/api/v1/capabilities/test-1")
+        assert detail.headers["content-type"] == "application/json"
+        assert detail.json() == expected
+        search = client.get("/api/v1/search", params={"q": "trading"}).json()
+        SearchResponse.model_validate(search)
+        assert search["results"] == [expected]
+        assert search["total"] == 1 and search["next_cursor"] is None
+        assert client.get("/api/v1/rankings").json()["results"][0] == expected
+
+    def test_openapi_schema_kept(self, client):
+        paths = client.get("/api/v1/openapi.json").json()["paths"]
+        schema = paths["/api/v1/search"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+        assert schema["$ref"].endswith("/SearchResponse")
+
+
+class TestConditionalGet:
+    def test_etag_and_not_modified(self, client):
+        first = client.get("/api/v1/search", params={"q": "trading", "per_page": 5})
+        etag = first.headers["etag"]
+        assert "stale-while-revalidate" in first.headers["cache-control"]
+        # 参数顺序不同视为同一查询
+        again = client.get("/api/v1/search?per_page=5&q=trading", headers={"If-None-Match": etag})
+        assert again.status_code == 304
+        assert again.content == b""
+        assert again.headers["etag"] == etag
+        other = client.get("/api/v1/search", params={"q": "bot"}, headers={"If-None-Match": etag})
+        assert other.status_code == 200
+
+    def test_etag_changes_with_dataset(self, client):
+        import api.database as db_mod
+        etag = client.get("/api/v1/categories").headers["etag"]
+        cap = db_mod.get_capability("test-1")
+        cap["category"] = "finance"
+        db_mod.insert_capabilities([cap])
+        fresh = client.get("/api/v1/categories", headers={"If-None-Match": etag})
+        assert fresh.status_code == 200
+        assert fresh.headers["etag"] != etag
+        assert "finance" in fresh.json()["categories"]
+
+    def test_vary_on_every_cacheable_response(self, client):
+        detail = client.get("/api/v1/capabilities/test-1")
+        assert detail.headers["vary"] == "Accept-Encoding"
+        not_modified = client.get("/api/v1/capabilities/test-1", headers={"If-None-Match": detail.headers["etag"]})
+        assert not_modified.status_code == 304
+        assert not_modified.headers["vary"] == "Accept-Encoding"
+
+    def test_not_applied_to_errors_and_user_endpoints(self, client):
+        assert "etag" not in client.get("/api/v1/capabilities/missing").headers
+        assert "etag" not in client.get("/api/v1/comments/test-1").headers
+
+
+class TestResponseCache:
+    def test_variants_cached_per_encoding(self, client, monkeypatch):
+        import api.main as main_mod
+        monkeypatch.setattr(main_mod, "RESPONSE_COMPRESS_MIN_BYTES", 0)
+        plain = client.get("/api/v1/rankings", params={"limit": 5}, headers={"Accept-Encoding": "identity"})
+        assert plain.headers["x-response-cache"] == "miss"
+        assert "content-encoding" not in plain.headers
+        gz = client.get("/api/v1/rankings", params={"limit": 5}, headers={"Accept-Encoding": "gzip"})
+        assert gz.headers["x-response-cache"] == "miss"  # 复用已缓存的原文，只做一次压缩
+        assert gz.headers["content-encoding"] == "gzip"
+        assert gz.headers["vary"] == "Accept-Encoding"
+        assert gz.headers["etag"] == plain.headers["etag"][:-1] + '-gzip"'  # 强 ETag 按编码区分
+        assert gz.content == plain.content
+        revalidated = client.get(
+            "/api/v1/rankings", params={"limit": 5},
+            headers={"Accept-Encoding": "gzip", "If-None-Match": gz.headers["etag"]},
+        )
+        assert revalidated.status_code == 304
+        assert revalidated.headers["etag"] == gz.headers["etag"]
+        assert revalidated.headers["vary"] == "Accept-Encoding"
+        again = client.get("/api/v1/rankings", params={"limit": 5}, headers={"Accept-Encoding": "gzip"})
+        assert again.headers["x-response-cache"] == "hit"
+        br_only = client.get("/api/v1/rankings", params={"limit": 5}, headers={"Accept-Encoding": "br"})
+        assert "content-encoding" not in br_only.headers  # 只提供 gzip，不认识的编码回落到原文
+        assert br_only.headers["etag"] == plain.headers["etag"]
+
+    def test_skips_cursor_pages_and_invalidates(self, client):
+        import api.database as db_mod
+        first = client.get("/api/v1/rankings", params={"limit": 1}).json()
+        page2 = client.get("/api/v1/rankings", params={"limit": 1, "cursor": first["next_cursor"]})
+        assert "x-response-cache" not in page2.headers
+        assert client.get("/api/v1/stats").headers["x-response-cache"] == "miss"
+        assert client.get("/api/v1/stats").headers["x-response-cache"] == "hit"
+        db_mod.insert_capabilities([{**db_mod.get_capability("test-1"), "slug": "test-3"}])
+        fresh = client.get("/api/v1/stats")
+        assert fresh.headers["x-response-cache"] == "miss"
+        assert fresh.json()["total"] == 3
+
+    def test_skips_oversized_bodies(self, client, monkeypatch):
+        import api.main as main_mod
+        monkeypatch.setattr(main_mod, "RESPONSE_CACHE_MAX_ENTRY_BYTES", 10)
+        size = main_mod.get_response_cache_stats()["size"]
+        for _ in range(2):
+            resp = client.get("/api/v1/stats", headers={"Accept-Encoding": "gzip"})
+            assert resp.status_code == 200 and resp.headers["x-response-cache"] == "skip"
+            assert resp.json()["total"] == 2
+        assert main_mod.get_response_cache_stats()["size"] == size
+
+    def test_bounded_by_total_bytes(self):
+        from api.cache import LRUCache
+        cache = LRUCache(100, maxbytes=10)
+        cache.set("a", b"12345")
+        cache.set("b", b"123")
+        cache.set("c", b"1234")  # 超出 10 字节，淘汰最久未用的 a
+        assert cache.get("a") is None and cache.get("b") == b"123"
+        cache.set("huge", b"x" * 11)  # 单个值超过上限直接不缓存
+        assert cache.get("huge") is None and cache.get("c") == b"1234"
+        cache.set("b", b"1")  # 覆盖时按新值重新计算
+        assert cache.stats()["bytes"] == 5 and cache.stats()["evictions"] == 1
+        cache.pop("c")
+        assert cache.stats()["bytes"] == 1
+
+
+class TestInvalidRows:
+    def test_invalid_row_does_not_break_reads(self, client):
+        import api.database as db_mod
+        bad = db_mod.get_capability("test-2")
+        bad.update(slug="bad", stars="lots")  # 无法通过 CapabilityItem 校验
+        db_mod.insert_capabilities([bad])
+        search = client.get("/api/v1/search")
+        assert search.status_code == 200
+        assert [c["slug"] for c in search.json()["results"]] == ["test-1", "test-2"]
+        assert client.get("/api/v1/rankings").status_code == 200
+        assert client.get("/api/v1/capabilities/bad").status_code == 404
+        assert client.get("/api/v1/capabilities/test-1").status_code == 200
+
+
+class TestBatchCapabilities:
+    def test_get_preserves_order_and_marks_missing(self, client):
+        resp = client.get("/api/v1/capabilities:batch", params={"slugs": "test-2,nope,test-1"})
+        assert resp.status_code == 200
+        data = resp.json()
+        assert [c and c["slug"] for c in data["results"]] == ["test-2", None, "test-1"]
+        assert data["not_found"] == ["nope"]
+        assert data["results"][2] == client.get("/api/v1/capabilities/test-1").json()
+        assert "etag" in resp.headers
+
+    def test_post_and_limits(self, client):
+        resp = client.post("/api/v1/capabilities:batch", json={"slugs": ["test-1", "test-1"]})
+        assert [c["slug"] for c in resp.json()["results"]] == ["test-1", "test-1"]
+        assert client.post("/api/v1/capabilities:batch", json={"slugs": []}).status_code == 400
+        too_many = {"slugs": [f"s-{i}" for i in range(101)]}
+        assert client.post("/api/v1/capabilities:batch", json=too_many).status_code == 400
+
+    def test_invalid_slug_reported_without_failing_batch(self, client):
+        import api.database as db_mod
+        bad = db_mod.get_capability("test-2")
+        bad.update(slug="bad", stars="lots")
+        db_mod.insert_capabilities([bad])
+        for resp in (
+            client.get("/api/v1/capabilities:batch", params={"slugs": "test-1,bad,nope"}),
+            client.post("/api/v1/capabilities:batch", json={"slugs": ["test-1", "bad", "nope"]}),
+        ):
+            assert resp.status_code == 200
+            data = resp.json()
+            assert [c and c["slug"] for c in data["results"]] == ["test-1", None, None]
+            assert data["not_found"] == ["nope"] and data["errors"] == ["bad"]
+
+
+class TestSemanticSearch:
+    def test_bulk_hydration_keeps_similarity_order(self, client, monkeypatch):
+        import scripts.embeddings as emb
+        from api.schemas import SemanticSearchResponse
+        monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+        monkeypatch.setattr(emb, "embed_query", lambda q, api_key: [1.0])
+        monkeypatch.setattr(emb, "rank_similar", lambda query_emb, top_k=10, mode="exact": [
+            ("test-2", 0.91234), ("gone", 0.8), ("test-1", 0.5),
+        ])
+        resp = client.get("/api/v1/semantic-search", params={"q": "写作"})
+        assert resp.status_code == 200
+        data = resp.json()
+        SemanticSearchResponse.model_validate(data)
+        assert [(c["slug"], c["similarity"]) for c in data["results"]] == [("test-2", 0.9123), ("test-1", 0.5)]
+        assert data["total"] == 2 and data["query"] == "写作"
+        timing = resp.headers["server-timing"]
+        assert [part.split(";")[0] for part in timing.split(", ")] == ["embed", "rank", "hydrate"]
+
+
+class TestHybridSearch:
+    def test_fuses_keyword_and_vector_rankings(self, client, monkeypatch):
+        import api.main as main
+        from api.schemas import HybridSearchResponse
+        monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+        monkeypatch.setattr(main, "_vector_candidates", lambda q, api_key, top_k: ["test-2", "test-1", "gone"])
+        resp = client.get("/api/v1/hybrid-search", params={"q": "trading"})
+        assert resp.status_code == 200
+        data = resp.json()
+        HybridSearchResponse.model_validate(data)
+        assert data["degraded"] is False
+        # test-1 两路都命中，排在只被向量检索命中的 test-2 之前
+        assert [c["slug"] for c in data["results"]] == ["test-1", "test-2"]
+        assert data["results"][0]["keyword_rank"] == 1 and data["results"][0]["vector_rank"] == 2
+        assert data["results"][1]["keyword_rank"] is None
+        assert "vector;dur=" in resp.headers["server-timing"]
+
+    def test_category_filter_applies_to_vector_candidates(self, client, monkeypatch):
+        import api.main as main
+        monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+        requested = []
+        monkeypatch.setattr(
+            main, "_vector_candidates", lambda q, api_key, top_k: requested.append(top_k) or ["test-2", "test-1"]
+        )
+        data = client.get("/api/v1/hybrid-search", params={"q": "bot", "category": "trading"}).json()
+        assert [c["slug"] for c in data["results"]] == ["test-1"]
+        client.get("/api/v1/hybrid-search", params={"q": "bot"})
+        # 分类过滤发生在向量检索之后，带分类时多取候选
+        assert requested == [main.HYBRID_CANDIDATES * 4, main.HYBRID_CANDIDATES]
+
+    def test_degrades_to_keyword_when_vector_slow(self, client, monkeypatch):
+        import time as _time
+        import api.main as main
+        monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+        monkeypatch.setattr(main, "HYBRID_VECTOR_BUDGET_MS", 50)
+        monkeypatch.setattr(main, "_vector_candidates", lambda q, api_key, top_k: _time.sleep(0.5) or ["test-2"])
+        resp = client.get("/api/v1/hybrid-search", params={"q": "trading"})
+        timings = dict(part.split(";dur=") for part in resp.headers["server-timing"].split(", "))
+        assert float(timings["vector"]) < 400  # 没等满 0.5s 就放弃了向量检索
+        data = resp.json()
+        assert data["degraded"] is True
+        assert [c["slug"] for c in data["results"]] == ["test-1"]
+
+    def test_degrades_when_vector_executor_full(self, client, monkeypatch):
+        import api.main as main
+        from api.async_db import AsyncDB
+        monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+        monkeypatch.setattr(main, "_vector_candidates", lambda q, api_key, top_k: ["test-2"])
+        full = AsyncDB(workers=1, max_pending=1)
+        full._slots.acquire()  # 模拟名额被卡住的 OpenAI 请求占满
+        monkeypatch.setattr(main, "vector_executor", full)
+        resp = client.get("/api/v1/hybrid-search", params={"q": "trading"})
+        assert resp.status_code == 200
+        assert resp.json()["degraded"] is True
+        assert full.stats()["rejected"] == 1
+
+    def test_keyword_only_without_provider(self, client, monkeypatch):
+        monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+        data = client.get("/api/v1/hybrid-search", params={"q": "writer"}).json()
+        assert data["degraded"] is True
+        assert [c["slug"] for c in data["results"]] == ["test-2"]
+
+
+class TestFacetedSearch:
+    def test_filters_combine(self, client):
+        def slugs(**params):
+            return [c["slug"] for c in client.get("/api/v1/search", params=params).json()["results"]]
+        assert slugs(language="Python") == ["test-1"]
+        assert slugs(protocol="mcp", has_tests="false") == ["test-2"]
+        assert slugs(min_score=7) == ["test-1"]
+        assert slugs(min_stars=100, source="mcp") == ["test-2"]
+        assert slugs(min_stars=1000) == []
+        assert client.get("/api/v1/search", params={"min_score": 11}).status_code == 422
+
+    def test_facet_counts_over_filtered_set(self, client):
+        data = client.get("/api/v1/search", params={"facets": "true"}).json()
+        assert data["facets"]["language"] == {"Python": 1, "TypeScript": 1}
+        assert data["facets"]["has_tests"] == {"false": 1, "true": 1}
+        narrowed = client.get("/api/v1/search", params={"facets": "true", "min_stars": 300}).json()
+        assert narrowed["total"] == 1
+        assert narrowed["facets"]["protocol"] == {"openclaw": 1}
+        assert narrowed["facets"]["category"] == {"trading": 1}
+        assert client.get("/api/v1/search").json()["facets"] is None
+
+
+class TestExport:
+    def test_ndjson_stream(self, client):
+        resp = client.get("/api/v1/export.ndjson", headers={"Accept-Encoding": "identity"})
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("application/x-ndjson")
+        assert "content-encoding" not in resp.headers
+        rows = [json.loads(line) for line in resp.text.splitlines()]
+        assert [r["slug"] for r in rows] == ["test-1", "test-2"]
+        assert rows[0] == client.get("/api/v1/capabilities/test-1").json()
+
+    def test_gzip_and_filters(self, client):
+        raw = client.get(
+            "/api/v1/export.ndjson", params={"category": "writing"}, headers={"Accept-Encoding": "gzip"},
+        )
+        assert raw.headers["content-encoding"] == "gzip"
+        assert [json.loads(line)["slug"] for line in raw.text.splitlines()] == ["test-2"]
+        future = client.get("/api/v1/export.ndjson", params={"updated_since": "2999-01-01T00:00:00Z"})
+        assert future.status_code == 200 and future.text == ""
+        since = client.get("/api/v1/export.ndjson", params={"updated_since": "2000-01-01"})
+        assert len(since.text.splitlines()) == 2
+        assert client.get("/api/v1/export.ndjson", params={"updated_since": "yesterday"}).status_code == 400
+
+    def test_invalid_row_skipped_without_truncating(self, client, caplog):
+        import api.database as db_mod
+        bad = db_mod.get_capability("test-1")
+        bad.update(slug="test-15", stars="lots")  # 排在两条正常数据中间
+        db_mod.insert_capabilities([bad])
+        with caplog.at_level("WARNING", logger="agentstore.catalog"):
+            resp = client.get("/api/v1/export.ndjson")
+        assert resp.status_code == 200
+        assert [json.loads(line)["slug"] for line in resp.text.splitlines()] == ["test-1", "test-2"]
+        assert "test-15" in caplog.text
+
+
+class TestWarmup:
+    def test_health_waits_for_warmup(self, client, monkeypatch):
+        import threading
+        import api.main as main_mod
+        from api.warmup import Warmup
+        gate = threading.Event()
+
+        def boom():
+            raise RuntimeError("boom")
+
+        warmup = Warmup({"slow": gate.wait, "boom": boom})
+        monkeypatch.setattr(main_mod, "warmup", warmup)
+        warmup.start("slow,boom")
+        resp = client.get("/health")
+        assert resp.status_code == 503
+        assert resp.json()["status"] == "warming_up"
+        gate.set()
+        assert warmup.wait(5)
+        assert client.get("/health").json() == {"status": "ok"}
+        assert set(warmup.timings) == {"slow", "boom"}  # 单步失败不影响就绪
+        assert warmup.errors == {"boom": "boom"}
+        with pytest.raises(ValueError):
+            warmup.start("nope")
+
+    def test_startup_runs_default_steps(self, client):
+        import api.database as db_mod
+        from api.main import app
+        from api.warmup import warmup
+        with TestClient(app) as c:
+            assert warmup.wait(10)
+            assert c.get("/health").status_code == 200
+        assert list(warmup.timings) == ["sqlite", "capabilities", "embeddings"]
+        assert warmup.errors == {}
+        assert db_mod.get_capability_cache_stats()["size"] >= 2
+
+
+class TestColdStart:
+    """用 -X importtime 跟踪 `import api.main` 的耗时，防止重量级依赖回到启动路径"""
+
+    LAZY_MODULES = ("jose", "passlib", "bcrypt", "openai", "numpy", "scripts.embeddings")
+    # 基准（开发机）：import api.main 累计约 155ms，其中项目自身模块 self 合计约 35ms，其余是 fastapi/pydantic
+    # 预算留约 30% 余量，慢机器上可用环境变量调大
+    BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "200"))
+    OWN_BUDGET_MS = float(os.getenv("IMPORT_TIME_OWN_BUDGET_MS", "50"))
+
+    def _import_times(self, tmp_path) -> dict[str, tuple[int, int]]:
+        """返回 {模块名: (self 微秒, 累计微秒)}"""
+        env = dict(os.environ, DATABASE_PATH=str(tmp_path / "cold.db"), JWT_SECRET_KEY="test")
+        code = "import api.main, api.database as d; assert d.payload_version.cache_info().currsize == 0"
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env=env, capture_output=True, text=True, check=True,
+        )
+        times = {}
+        for line in proc.stderr.splitlines():
+            if line.startswith("import time:") and "|" in line:
+                own, cumulative, name = line.removeprefix("import time:").split("|")
+                if cumulative.strip().isdigit():
+                    times[name.strip()] = (int(own), int(cumulative))
+        return times
+
+    def test_heavy_dependencies_are_lazy(self, tmp_path):
+        times = self._import_times(tmp_path)
+        eager = [m for m in times if m.split(".")[0] in self.LAZY_MODULES or m in self.LAZY_MODULES]
+        assert eager == []
+        assert times["api.main"][1] / 1000 < self.BUDGET_MS
+        own = sum(t[0] for name, t in times.items() if name == "api" or name.startswith("api."))
+        assert own / 1000 < self.OWN_BUDGET_MS
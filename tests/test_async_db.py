@@ -0,0 +1,42 @@
+"""异步数据库线程池测试"""
+import asyncio
+import threading
+
+import pytest
+
+from api.async_db import AsyncDB, DatabaseOverloaded
+
+
+def test_runs_off_event_loop_and_records_metrics():
+    db = AsyncDB(workers=2, max_pending=4)
+
+    def query(x):
+        return x * 2, threading.current_thread().name
+
+    async def main():
+        return await db.run(query, 21)
+
+    value, thread_name = asyncio.run(main())
+    assert value == 42
+    assert thread_name.startswith("agentstore-db")
+    stats = db.stats()
+    assert stats["queries"]["query"]["count"] == 1
+    assert stats["pending"] == 0
+    db.shutdown()
+
+
+def test_rejects_when_queue_full():
+    db = AsyncDB(workers=1, max_pending=1)
+    release = threading.Event()
+
+    async def main():
+        blocked = asyncio.ensure_future(db.run(release.wait, name="slow"))
+        await asyncio.sleep(0)
+        with pytest.raises(DatabaseOverloaded):
+            await db.run(lambda: None)
+        release.set()
+        await blocked
+
+    asyncio.run(main())
+    assert db.stats()["rejected"] == 1
+    db.shutdown()
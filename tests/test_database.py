@@ -0,0 +1,402 @@
+"""数据库层测试"""
+import sqlite3
+
+import pytest
+
+
+def _cap(slug, name, **kwargs):
+    item = {
+        "slug": slug, "name": name, "source": "mcp", "source_id": slug,
+        "provider": "acme", "description": "", "category": "coding",
+        "overall_score": 5.0,
+    }
+    item.update(kwargs)
+    return item
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_PATH", str(tmp_path / "test.db"))
+    import api.database as db_mod
+    db_mod.init_db()
+    yield db_mod
+    db_mod.close_pools()
+
+
+class TestConnectionPool:
+    def test_connection_reused(self, db):
+        conn = db._get_conn()
+        raw = conn._conn
+        conn.close()
+        conn = db._get_conn()
+        assert conn._conn is raw
+        conn.close()
+        stats = db.get_pool_stats()
+        assert stats["checkouts"] >= 2
+        assert stats["size"] == stats["idle"]
+
+    def test_closed_proxy_rejects_use(self, db):
+        conn = db._get_conn()
+        conn.close()
+        conn.close()  # 重复归还安全
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+    def test_release_rolls_back_open_transaction(self, db):
+        conn = db._get_conn()
+        conn.execute("INSERT INTO users (username, password_hash) VALUES ('alice', 'x')")
+        conn.close()
+        conn = db._get_conn()
+        try:
+            assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0
+        finally:
+            conn.close()
+
+    def test_exhausted_pool_times_out(self, tmp_path):
+        from api.database import ConnectionPool, PoolTimeout
+        pool = ConnectionPool(str(tmp_path / "pool.db"), size=1, timeout=0.05)
+        held = pool.acquire()
+        with pytest.raises(PoolTimeout):
+            pool.acquire()
+        held.close()
+        assert pool.stats()["timeouts"] == 1
+        pool.close()
+
+    def test_context_manager_and_forgotten_proxy_return_to_pool(self, tmp_path):
+        from api.database import ConnectionPool
+        pool = ConnectionPool(str(tmp_path / "pool.db"), size=1, timeout=0.05)
+        with pool.acquire() as conn:
+            conn.execute("SELECT 1")
+        assert pool.stats()["in_use"] == 0
+        pool.acquire().execute("SELECT 1")  # 忘记 close()，代理被回收时归还
+        with pool.acquire() as conn:
+            assert conn.execute("SELECT 1").fetchone()[0] == 1
+        pool.close()
+
+
+class TestFullTextSearch:
+    def test_matches_one_liner_and_ai_summary(self, db):
+        db.insert_capabilities([
+            _cap("a", "Alpha", one_liner="Convert PDF files"),
+            _cap("b", "Beta", ai_summary="A spreadsheet helper"),
+        ])
+        assert [c["slug"] for c in db.search_capabilities(q="pdf")["items"]] == ["a"]
+        assert [c["slug"] for c in db.search_capabilities(q="spreadsheet")["items"]] == ["b"]
+
+    def test_relevance_prefers_name_hits(self, db):
+        db.insert_capabilities([
+            _cap("desc-hit", "Other", description="works with postgres", overall_score=9.0),
+            _cap("name-hit", "Postgres Tool", overall_score=1.0),
+        ])
+        items = db.search_capabilities(q="postgres", sort_by="relevance")["items"]
+        assert [c["slug"] for c in items] == ["name-hit", "desc-hit"]
+
+    def test_short_query_falls_back_to_substring(self, db):
+        db.insert_capabilities([_cap("cn", "数据助手"), _cap("en", "Writer")])
+        data = db.search_capabilities(q="数据")
+        assert data["total"] == 1
+        assert data["items"][0]["slug"] == "cn"
+
+    def test_upsert_keeps_index_in_sync(self, db):
+        db.insert_capabilities([_cap("a", "Old Name")])
+        db.insert_capabilities([_cap("a", "Fresh Name")])
+        assert db.search_capabilities(q="old name")["total"] == 0
+        assert db.search_capabilities(q="fresh")["total"] == 1
+
+    def test_query_quotes_are_escaped(self, db):
+        db.insert_capabilities([_cap("a", 'Say "hello" tool')])
+        assert db.search_capabilities(q='"hello"')["total"] == 1
+        assert db.search_capabilities(q="OR AND NOT")["total"] == 0
+
+
+class TestKeysetPagination:
+    def test_cursor_walks_all_rows_with_ties(self, db):
+        db.insert_capabilities([_cap(f"cap-{i}", f"Cap {i}", overall_score=float(i % 3)) for i in range(10)])
+        seen, cursor = [], None
+        while True:
+            data = db.search_capabilities(limit=3, cursor=cursor)
+            seen.extend(c["slug"] for c in data["items"])
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+        assert len(seen) == len(set(seen)) == 10
+        full = db.search_capabilities(limit=10)["items"]
+        assert seen == [c["slug"] for c in full]
+
+    def test_cursor_matches_offset_pages_ascending(self, db):
+        db.insert_capabilities([_cap(f"cap-{i}", f"Cap {i}", stars=i // 2) for i in range(6)])
+        first = db.search_capabilities(sort_by="stars", order="asc", per_page=2, page=1)
+        second = db.search_capabilities(sort_by="stars", order="asc", per_page=2, cursor=first["next_cursor"])
+        by_page = db.search_capabilities(sort_by="stars", order="asc", per_page=2, page=2)
+        assert [c["slug"] for c in second["items"]] == [c["slug"] for c in by_page["items"]]
+
+    def test_cursor_walks_rows_with_null_sort_keys(self, db):
+        db.insert_capabilities([_cap(f"c{i}", f"C {i}", stars=None if i % 2 else i) for i in range(6)])
+        # 模拟迁移前的老数据：排序字段为 NULL
+        conn = db._get_conn()
+        conn.execute("UPDATE capabilities SET stars = NULL, overall_score = NULL WHERE slug IN ('c1', 'c3')")
+        conn.execute("PRAGMA user_version = 5")
+        conn.commit()
+        conn.close()
+        db.init_db()
+        for sort_by in ("stars", "overall_score"):
+            for order in ("desc", "asc"):
+                seen, cursor = [], None
+                while True:
+                    data = db.search_capabilities(sort_by=sort_by, order=order, limit=2, cursor=cursor)
+                    seen.extend(c["slug"] for c in data["items"])
+                    cursor = data["next_cursor"]
+                    if cursor is None:
+                        break
+                full = db.search_capabilities(sort_by=sort_by, order=order, limit=10)["items"]
+                assert seen == [c["slug"] for c in full] and len(seen) == 6
+
+    def test_null_dates_kept_and_paged(self, db):
+        import json
+        db.insert_capabilities([
+            _cap(f"d{i}", f"D {i}", last_updated=None if i % 2 else f"2026-01-0{i + 1}") for i in range(6)
+        ])
+        assert db.get_capability("d1")["last_updated"] is None  # API 仍返回 null，而不是空串
+        assert json.loads(db.get_capability_json("d1"))["last_updated"] is None
+        for order in ("desc", "asc"):
+            seen, cursor = [], None
+            while True:
+                data = db.search_capabilities(sort_by="last_updated", order=order, limit=2, cursor=cursor)
+                seen.extend(c["slug"] for c in data["items"])
+                cursor = data["next_cursor"]
+                if cursor is None:
+                    break
+            full = db.search_capabilities(sort_by="last_updated", order=order, limit=10)["items"]
+            assert seen == [c["slug"] for c in full] and len(seen) == 6
+
+    def test_cursor_for_other_sort_rejected(self, db):
+        db.insert_capabilities([_cap(f"cap-{i}", f"Cap {i}") for i in range(3)])
+        cursor = db.search_capabilities(limit=1)["next_cursor"]
+        with pytest.raises(ValueError):
+            db.search_capabilities(limit=1, sort_by="stars", cursor=cursor)
+        with pytest.raises(ValueError):
+            db.search_capabilities(limit=1, cursor="not-a-cursor")
+
+
+class TestSearchTotals:
+    def test_exact_total_counted_inline_and_cached(self, db):
+        db.insert_capabilities([_cap(f"cap-{i}", f"Cap {i}") for i in range(5)])
+        before = db.get_count_cache_stats()["hits"]
+        assert db.search_capabilities(per_page=2, page=1)["total"] == 5
+        assert db.search_capabilities(per_page=2, page=9)["total"] == 5
+        assert db.get_count_cache_stats()["hits"] == before + 1
+
+    def test_cache_invalidated_by_insert(self, db):
+        db.insert_capabilities([_cap("a", "Alpha")])
+        assert db.search_capabilities()["total"] == 1
+        version = db.get_dataset_version()
+        db.insert_capabilities([_cap("b", "Beta")])
+        assert db.get_dataset_version() == version + 1
+        assert db.search_capabilities()["total"] == 2
+
+    def test_estimate_and_none_modes(self, db):
+        db.insert_capabilities([_cap(f"cap-{i}", f"Cap {i}") for i in range(5)])
+        data = db.search_capabilities(q="cap", per_page=2, total_mode="estimate")
+        assert data["total"] == 3 and data["total_estimated"] is True
+        last = db.search_capabilities(q="cap", per_page=2, page=3, total_mode="estimate")
+        assert last["total"] == 5 and last["total_estimated"] is False
+        assert db.search_capabilities(total_mode="none")["total"] is None
+
+
+class TestCapabilityCache:
+    def test_hit_skips_database_and_returns_copy(self, db):
+        db.insert_capabilities([_cap("a", "Alpha", dependencies=["x"])])
+        first = db.get_capability("a")
+        first["scores"]["safety"] = 99
+        first["dependencies"].append("y")
+        hits = db.get_capability_cache_stats()["hits"]
+        second = db.get_capability("a")
+        assert db.get_capability_cache_stats()["hits"] == hits + 1
+        assert second["scores"]["safety"] == 0
+        assert second["dependencies"] == ["x"]
+
+    def test_invalidated_by_other_writer(self, db, monkeypatch):
+        db.insert_capabilities([_cap("a", "Alpha")])
+        assert db.get_capability("a")["name"] == "Alpha"
+        # 模拟另一个 worker 写库：直接改表并递增代际，不经过本进程的 insert_capabilities
+        conn = db._get_conn()
+        conn.execute("UPDATE capabilities SET name = 'Renamed' WHERE slug = 'a'")
+        db._bump_generation(conn, db.DATASET_GENERATION)
+        conn.commit()
+        conn.close()
+        monkeypatch.setattr(db, "GENERATION_CHECK_INTERVAL", 0)
+        assert db.get_capability("a")["name"] == "Renamed"
+
+
+class TestCatalogStats:
+    def test_stats_materialized_on_insert(self, db):
+        db.insert_capabilities([
+            _cap("a", "Alpha", category="coding", overall_score=8.5),
+            _cap("b", "Beta", category="coding", overall_score=6.0),
+            _cap("c", "Gamma", category="data", overall_score=3.2),
+            _cap("d", "Delta", category="", overall_score=10.0),
+        ])
+        stats = db.get_stats()
+        assert stats["total"] == 4
+        assert stats["categories"] == {"coding": 2, "data": 1}
+        assert stats["avg_score"] == round((8.5 + 6.0 + 3.2 + 10.0) / 4, 2)
+        assert stats["score_histogram"]["9"] == 1
+        assert stats["score_histogram"]["3"] == 1
+        assert stats["top_capability"]["slug"] == "d"
+        assert db.get_categories() == ["coding", "data"]
+
+        conn = db._get_conn()
+        row = conn.execute("SELECT * FROM catalog_stats WHERE category = 'coding'").fetchone()
+        conn.close()
+        assert row["top_slug"] == "a"
+        assert row["avg_score"] == 7.25
+
+    def test_empty_catalog(self, db):
+        assert db.get_stats()["total"] == 0
+        assert db.get_categories() == []
+
+
+class TestDailyQuota:
+    def _key(self, db, daily_limit):
+        conn = db._get_conn()
+        user_id = conn.execute("INSERT INTO users (username, password_hash) VALUES ('u', 'x')").lastrowid
+        key_id = conn.execute(
+            "INSERT INTO api_keys (user_id, key_prefix, key_hash, daily_limit) VALUES (?, 'ask_', 'h', ?)",
+            (user_id, daily_limit),
+        ).lastrowid
+        conn.commit()
+        conn.close()
+        return key_id
+
+    def test_limit_enforced_in_one_statement(self, db):
+        key_id = self._key(db, 3)
+        assert [db.consume_daily_quota(key_id, 3) for _ in range(4)] == [1, 2, 3, None]
+        assert db.get_today_usage_count(key_id) == 3
+        stats = db.get_usage_stats(key_id)
+        assert stats["today_count"] == 3
+        assert stats["today_remaining"] == 0
+        assert list(stats["last_7_days"].values()) == [3]
+
+    def test_unlimited_key_still_counted(self, db):
+        key_id = self._key(db, -1)
+        for _ in range(5):
+            assert db.consume_daily_quota(key_id, -1) is not None
+        assert db.get_usage_stats(key_id)["today_remaining"] == -1
+        assert db.get_today_usage_count(key_id) == 5
+
+
+class TestUsageLogWriter:
+    def test_batches_rows_and_coalesces_last_used(self, db):
+        conn = db._get_conn()
+        user_id = conn.execute("INSERT INTO users (username, password_hash) VALUES ('u', 'x')").lastrowid
+        key_id = conn.execute(
+            "INSERT INTO api_keys (user_id, key_prefix, key_hash) VALUES (?, 'ask_', 'h')", (user_id,)
+        ).lastrowid
+        conn.commit()
+        conn.close()
+
+        writer = db.UsageLogWriter(interval_ms=60_000, batch_size=1000)
+        for i in range(5):
+            writer.enqueue(key_id, user_id, "/api/v1/search", "GET", 200, i)
+        writer.shutdown()  # 不等攒批超时，立即唤醒后台线程并写完
+
+        conn = db._get_conn()
+        try:
+            assert conn.execute("SELECT COUNT(*) FROM usage_logs").fetchone()[0] == 5
+            assert conn.execute("SELECT last_used_at FROM api_keys WHERE id = ?", (key_id,)).fetchone()[0]
+        finally:
+            conn.close()
+        assert writer.stats()["written"] == 5
+
+    def test_background_thread_flushes_and_drains_on_shutdown(self, db):
+        writer = db.UsageLogWriter(interval_ms=10, batch_size=2)
+        for _ in range(3):
+            writer.enqueue(None, None, "/api/v1/stats", "GET", 200, 1)
+        writer.shutdown()
+        assert writer.stats()["written"] == 3
+        assert writer.stats()["queued"] == 0
+
+
+class TestPayloadJson:
+    def test_payload_refreshed_on_upsert(self, db):
+        import json
+        db.insert_capabilities([_cap("a", "Alpha", stars=1)])
+        db.insert_capabilities([_cap("a", "Alpha", stars=7)])
+        payload = json.loads(db.get_capability_json("a"))
+        assert payload["stars"] == 7
+        assert payload["created_at"] and "payload_json" not in payload
+        assert json.loads(db.search_capabilities(encoded=True)["items"][0]) == payload
+
+    def test_missing_payload_backfilled(self, db):
+        db.insert_capabilities([_cap("a", "Alpha")])
+        conn = db._get_conn()
+        conn.execute("UPDATE capabilities SET payload_json = NULL")
+        conn.commit()
+        db._refresh_payloads(conn)
+        conn.commit()
+        assert conn.execute("SELECT COUNT(*) FROM capabilities WHERE payload_json IS NULL").fetchone()[0] == 0
+        conn.close()
+
+
+    def test_invalid_row_does_not_abort_batch(self, db, caplog):
+        import json
+        bad = _cap("bad", "Broken")
+        bad["stars"] = "lots"  # 采集器偶尔给出的脏数据（None 会按默认值入库，这里用类型错误的值）
+        with caplog.at_level("WARNING", logger="agentstore.catalog"):
+            db.insert_capabilities([_cap("a", "Alpha"), bad])
+        conn = db._get_conn()
+        rows = dict(conn.execute("SELECT slug, payload_json FROM capabilities").fetchall())
+        conn.close()
+        assert rows["bad"] is None and json.loads(rows["a"])["slug"] == "a"
+        assert "bad" in caplog.text
+
+    def test_none_fields_coerced_on_ingest(self, db):
+        import json
+        cap = _cap("a", "Alpha", forks=None, contributors=None, readme_length=None, has_tests=None)
+        cap["scores"] = {"reliability": None}
+        db.insert_capabilities([cap])
+        payload = json.loads(db.get_capability_json("a"))
+        assert (payload["forks"], payload["has_tests"], payload["scores"]["reliability"]) == (0, False, 0)
+
+    def test_invalid_rows_treated_as_missing_on_read(self, db):
+        bad = _cap("bad", "Broken")
+        bad["stars"] = "lots"
+        db.insert_capabilities([_cap("a", "Alpha"), bad])
+        assert [json_item for json_item in db.search_capabilities(encoded=True)["items"] if '"bad"' in json_item] == []
+        assert db.get_capability_json("bad") is None and db.get_capability("bad") is None
+        assert list(db.get_capabilities_json(["bad", "a"])) == ["a"]
+
+    def test_stale_payload_version_refreshed_on_init(self, db):
+        import json
+        db.insert_capabilities([_cap("a", "Alpha")])
+        conn = db._get_conn()
+        conn.execute("UPDATE capabilities SET payload_json = '{}', payload_version = 'old-schema'")
+        conn.commit()
+        conn.close()
+        version = db.get_dataset_version()
+        db.init_db()
+        db._forget_generation(db.DATASET_GENERATION)
+        assert json.loads(db.get_capability_json("a"))["slug"] == "a"
+        assert db.get_dataset_version() != version  # 旧 ETag / 缓存随之失效
+
+
+class TestFacets:
+    def test_single_grouped_scan_and_cache(self, db):
+        db.insert_capabilities([
+            _cap("a", "Alpha", language="Python", protocol="mcp", stars=10),
+            _cap("b", "Beta", language="Python", protocol="rest", stars=5),
+            _cap("c", "Gamma", language="Go", protocol="mcp", category="data", stars=1),
+            _cap("d", "Delta", language=None, protocol="mcp"),
+        ])
+        statements = []
+        conn = db._get_conn()
+        conn._conn.set_trace_callback(statements.append)
+        conn.close()
+        facets = db.get_facet_counts(filters={"protocol": "mcp"})
+        assert facets["language"] == {"Go": 1, "Python": 1}
+        assert facets["category"] == {"coding": 2, "data": 1}
+        assert len([s for s in statements if "GROUP BY" in s]) == 1
+        assert db.get_facet_counts(filters={"protocol": "mcp"}) == facets
+        assert len([s for s in statements if "GROUP BY" in s]) == 1
+        with pytest.raises(ValueError):
+            db.get_facet_counts(filters={"license": "MIT"})
@@ -0,0 +1,207 @@
+"""embedding 索引测试"""
+import json
+
+import numpy as np
+import pytest
+
+from scripts.embeddings import EmbeddingIndex, EmbeddingStore
+
+
+def test_top_k_matches_brute_force_cosine(tmp_path):
+    rng = np.random.default_rng(0)
+    data = {f"cap-{i}": rng.normal(size=16).tolist() for i in range(200)}
+    store = EmbeddingStore(tmp_path / "embeddings")
+    store.rewrite(data)
+    query = rng.normal(size=16)
+
+    expected = sorted(
+        ((slug, float(np.dot(query, v) / (np.linalg.norm(query) * np.linalg.norm(v)))) for slug, v in data.items()),
+        key=lambda x: x[1], reverse=True,
+    )[:5]
+    index = EmbeddingIndex(store)
+    got = index.search(query, top_k=5)
+    assert [slug for slug, _ in got] == [slug for slug, _ in expected]
+    assert np.allclose([s for _, s in got], [s for _, s in expected], atol=1e-5)
+    assert isinstance(index.matrix, np.memmap)
+
+
+def test_reloads_when_store_changes(tmp_path):
+    store = EmbeddingStore(tmp_path / "embeddings")
+    index = EmbeddingIndex(store)
+    assert index.search([1.0, 0.0], top_k=3) == []
+
+    store.upsert({"a": [1.0, 0.0], "b": [0.0, 2.0]})
+    assert [slug for slug, _ in index.search([0.0, 1.0], top_k=3)] == ["b", "a"]
+    assert index.matrix.dtype == np.float32
+    assert np.allclose(np.linalg.norm(index.matrix, axis=1), 1.0)
+
+    store.upsert({"c": [0.0, -1.0]})
+    assert len(index.search([1.0, 0.0], top_k=10)) == 3
+
+
+def test_store_appends_tombstones_and_compacts(tmp_path):
+    import scripts.embeddings as emb
+    base = tmp_path / "embeddings"
+    legacy = {"a": [1.0, 0.0], "b": [0.0, 1.0], "c": [1.0, 1.0], "d": [-1.0, 0.0]}
+    (tmp_path / "embeddings.json").write_text(json.dumps(legacy))
+    store = EmbeddingStore(base)
+    assert store.live_slugs() == set(legacy)  # 首次读取自动从 JSON 迁移
+    data_file = json.loads(store.meta_path.read_text())["data_file"]
+    size = (tmp_path / data_file).stat().st_size
+
+    store.upsert({"a": [0.0, 3.0]})  # 更新 = 旧行墓碑 + 末尾追加
+    assert (tmp_path / data_file).stat().st_size == size + 2 * 4
+    slugs, _ = store.read()
+    assert slugs == [None, "b", "c", "d", "a"]
+    index = EmbeddingIndex(store)
+    assert index.search([0.0, 1.0], top_k=2)[0][1] == pytest.approx(1.0)
+    assert len(index) == 4
+
+    store.delete(["b"])  # 墓碑占比 2/5 超过阈值，后台压缩
+    store.wait()
+    slugs, matrix = store.read()
+    assert slugs == ["c", "d", "a"] and matrix.shape == (3, 2)
+    assert not (tmp_path / data_file).exists()
+    assert [slug for slug, _ in index.search([0.0, 1.0], top_k=5)] == ["a", "c", "d"]
+    assert emb.COMPACT_RATIO == 0.25
+
+
+def test_writes_migrate_legacy_json_without_deadlock(tmp_path):
+    import threading
+    legacy = {"a": [1.0, 0.0], "b": [0.0, 1.0]}
+
+    def run(op):
+        (tmp_path / "embeddings.json").write_text(json.dumps(legacy))
+        for path in tmp_path.glob("embeddings.*"):
+            if path.name != "embeddings.json":
+                path.unlink()
+        store = EmbeddingStore(tmp_path / "embeddings")
+        worker = threading.Thread(target=op, args=(store,), daemon=True)
+        worker.start()
+        worker.join(5)
+        assert not worker.is_alive(), "写入方法在迁移旧数据时死锁"
+        store.wait()
+        return store.read()[0]
+
+    assert run(lambda store: store.upsert({"c": [1.0, 1.0]})) == ["a", "b", "c"]
+    assert run(lambda store: store.delete(["a"])) == ["b"]  # 墓碑占比超过阈值，已压缩
+
+
+
+def test_concurrent_migration_runs_once(tmp_path):
+    import threading
+    legacy = {f"cap-{i}": [float(i), 1.0] for i in range(50)}
+    (tmp_path / "embeddings.json").write_text(json.dumps(legacy))
+    # 各自独立的 EmbeddingStore（相当于多个 worker 进程），只靠文件锁互斥
+    stores = [EmbeddingStore(tmp_path / "embeddings") for _ in range(8)]
+    results = []
+    threads = [threading.Thread(target=lambda s=s: results.append(s.migrate_from_json())) for s in stores]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(results) == [False] * 7 + [True]
+    assert not list(tmp_path.glob("*.tmp"))
+    assert [path.name for path in tmp_path.glob("embeddings.*.f32")] == ["embeddings.1.f32"]
+    assert stores[0].live_slugs() == set(legacy)
+
+
+def test_read_falls_back_to_legacy_json_when_migration_fails(tmp_path, monkeypatch):
+    import scripts.embeddings as emb
+
+    def read_only(path, data):
+        raise PermissionError(13, "Read-only file system", str(path))
+
+    monkeypatch.setattr(emb, "_atomic_write", read_only)
+    (tmp_path / "embeddings.json").write_text(json.dumps({"a": [3.0, 0.0], "b": [0.0, 1.0]}))
+    store = EmbeddingStore(tmp_path / "embeddings")
+    assert store.live_slugs() == {"a", "b"}
+    assert store.signature() == emb._file_signature(store.legacy_path)
+    index = EmbeddingIndex(store)
+    assert index.search([1.0, 0.0], top_k=1) == [("a", pytest.approx(1.0))]
+    with pytest.raises(PermissionError):
+        store.upsert({"c": [1.0, 1.0]})  # 写入不能落到内存副本上
+    assert not store.meta_path.exists()
+
+    monkeypatch.undo()
+    assert store.migrate_from_json() is True  # 目录可写后正常迁移，签名变化触发索引重新加载
+    assert store.signature() == emb._file_signature(store.meta_path)
+    assert len(index.search([1.0, 0.0], top_k=5)) == 2
+
+class _FakeEmbeddings:
+    def __init__(self):
+        self.inputs = []
+
+    def create(self, model, input):
+        from types import SimpleNamespace
+        self.inputs.append(list(input))
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[float(len(t)), 1.0]) for t in input])
+
+
+def _fake_provider(monkeypatch, cache):
+    from types import SimpleNamespace
+    import scripts.embeddings as emb
+    fake = _FakeEmbeddings()
+    monkeypatch.setattr(emb, "_query_cache", cache)
+    monkeypatch.setattr(emb, "_get_client", lambda api_key: SimpleNamespace(embeddings=fake))
+    return fake
+
+
+def test_repeated_queries_skip_provider(monkeypatch):
+    import scripts.embeddings as emb
+    fake = _fake_provider(monkeypatch, emb.QueryEmbeddingCache(maxsize=16, db_path=""))
+    first = emb.embed_query("PDF  Tools", "sk")
+    again = emb.embed_query("ｐｄｆ tools", "sk")  # 全角 + 大小写 + 空白归一化后相同
+    assert fake.inputs == [["pdf tools"]]
+    assert np.array_equal(first, again)
+    stats = emb.get_query_cache_stats()
+    assert stats["provider_calls"] == 1 and stats["hit_rate"] == 0.5
+
+
+def test_disk_cache_shared_and_expires(tmp_path, monkeypatch):
+    import scripts.embeddings as emb
+    db_path = str(tmp_path / "query_cache.db")
+    fake = _fake_provider(monkeypatch, emb.QueryEmbeddingCache(db_path=db_path))
+    assert emb.warm_query_cache(["pdf", "database", "PDF", ""], "sk") == 2
+    assert fake.inputs == [["pdf", "database"]]
+
+    # 新进程（新的内存层）直接从磁盘命中
+    restarted = emb.QueryEmbeddingCache(db_path=db_path)
+    assert restarted.get("database").tolist() == [8.0, 1.0]
+    assert restarted.stats()["disk_hits"] == 1
+    expired = emb.QueryEmbeddingCache(db_path=db_path, ttl=0)
+    assert expired.get("pdf") is None
+
+
+def test_ivf_index_recall_and_staleness(tmp_path):
+    from scripts.embeddings import benchmark_ann, build_ivf_index
+    rng = np.random.default_rng(1)
+    centers = rng.normal(size=(20, 32))
+    vectors = centers[rng.integers(0, 20, 2000)] + rng.normal(scale=0.3, size=(2000, 32))
+    store = EmbeddingStore(tmp_path / "embeddings")
+    store.rewrite({f"cap-{i}": v.tolist() for i, v in enumerate(vectors)})
+
+    index = EmbeddingIndex(store)
+    query = vectors[0]
+    exact = index.search(query, top_k=10)
+    assert index.search(query, top_k=10, mode="approx") == exact  # 没有索引时退回精确查询
+
+    build_ivf_index(store, n_lists=20)
+    assert index.search(query, top_k=10) == exact
+    assert index.ivf is not None and len(index.ivf["centroids"]) == 20
+    report = benchmark_ann(index, k=10, n_queries=50, nprobe=4)
+    assert report["recall@10"] >= 0.9
+
+    # 存储更新后旧索引不再匹配，忽略它而不是返回错误结果
+    store.upsert({"cap-0": [1.0] * 32})
+    assert index.search([1.0] * 32, top_k=1, mode="approx")[0][0] == "cap-0"
+    assert index.ivf is None
+
+
+def test_openai_client_has_bounded_timeout(monkeypatch):
+    pytest.importorskip("openai")
+    import scripts.embeddings as emb
+    monkeypatch.setattr(emb, "_clients", {})
+    client = emb._get_client("sk-test")
+    assert client.timeout == emb.OPENAI_TIMEOUT and client.max_retries == emb.OPENAI_MAX_RETRIES
+    assert emb._get_client("sk-test") is client